@@ -1,11 +1,28 @@
+from flask import Response, request
 from flask_restx import Api, Resource, fields
 
-from api.src.dao import MinioDAO, MongoDAO
+from api.src.dao import VersionConflictError, get_minio_dao, \
+    get_mongo_dao
+from api.src.artifacts import ArtifactStore
 from configurator import get_config
-from bson import json_util
+from bson import ObjectId, json_util
+import ast
 import json
+import os
+import threading
+import time
 from api.src.trainer import ModelTrainer
-from api.src.data_preproccesor import get_train_test_data
+from api.src.jobs import JobManager, JobQueueFull, jobs_dao, \
+    sweep_models, train_model, train_streaming
+from api.src.cache import model_cache, prediction_cache
+from api.src.warmup import TrafficCounter, WarmUp
+from api.src.batching import MicroBatcher
+from api.src import ensemble
+from api.src.metrics import STAGE_SECONDS, Gauge, process_memory, \
+    registry
+from api.src.serving import ModelLoadError, configure_prediction_cache, \
+    get_model_doc, get_trainer, load_trainer, parse_batch_texts
+from api.src.startup import startup
 from logger import create_logger
 import numpy as np
 
@@ -17,20 +34,131 @@ def parse_json(data):
 api = Api(version='1.0', title="MLOps sucker",
           description="takkat's fancy MLOps API")
 logger = create_logger()
+startup.mark("imports")
 cfg = get_config()
+startup.mark("config")
 logger.warning(cfg)
+model_cache.configure(**cfg.cache.models)
+
+
+configure_prediction_cache(cfg)
+# Client of preloading gunicorn master is not fork-safe
+os.register_at_fork(after_in_child=lambda: configure_prediction_cache(cfg))
+batcher = MicroBatcher(**cfg.batching)
+job_manager = JobManager(cfg)
+traffic = TrafficCounter(cfg, cfg.warmup.traffic_flush_s)
+warmup = WarmUp(cfg, lambda _id: get_trainer(cfg, _id, logger=logger)[1],
+                logger)
+
+
+def numeric_stats(stats_by_name: dict) -> dict:
+    return {(name, stat): value
+            for name, stats in stats_by_name.items()
+            for stat, value in stats.items()
+            if isinstance(value, (int, float)) and not isinstance(value, bool)}
+
+
+registry.register(batcher.histogram)
+registry.register(Gauge(
+    "mlops_cache", "Model and prediction cache stats",
+    lambda: numeric_stats({"models": model_cache.stats(),
+                           "predictions": prediction_cache.stats()}),
+    ("cache", "stat")))
+registry.register(Gauge(
+    "mlops_jobs_pending", "Unfinished jobs submitted by this process",
+    lambda: {(): job_manager.pending()}))
+registry.register(Gauge(
+    "mlops_process_memory_bytes",
+    "Resident memory of this process, private part is the per worker cost",
+    lambda: {(kind,): value for kind, value in process_memory().items()},
+    ("kind",)))
+
+
+def encode_cursor(doc) -> str:
+    return f"{doc['createdTimeS']!r}_{doc['_id']}"
+
+
+def decode_cursor(cursor: str) -> dict:
+    """ Keyset filter for documents after cursor in listing order """
+    created, _id = cursor.rsplit("_", 1)
+    created, _id = float(created), ObjectId(_id)
+    return {"$or": [{"createdTimeS": {"$lt": created}},
+                    {"createdTimeS": created, "_id": {"$lt": _id}}]}
+
+
+def list_models_query(args) -> tuple:
+    """ Mongo filter, projection and limit from /models/list query args """
+    limit = min(int(args.get("limit", 100)), cfg.mongo.get("max_list_limit",
+                                                           1000))
+    if limit < 1:
+        raise ValueError("limit should be positive")
+    conditions = []
+    if args.get("model_type"):
+        conditions.append({"model_type": args["model_type"]})
+    for score in ("test", "train"):
+        bounds = {}
+        if args.get(f"min_{score}_accuracy"):
+            bounds["$gte"] = float(args[f"min_{score}_accuracy"])
+        if args.get(f"max_{score}_accuracy"):
+            bounds["$lte"] = float(args[f"max_{score}_accuracy"])
+        if bounds:
+            conditions.append({f"{score}_score.accuracy": bounds})
+    if args.get("after"):
+        conditions.append(decode_cursor(args["after"]))
+    query = {"$and": conditions} if conditions else {}
+
+    if args.get("fields"):
+        projection = {field: 1 for field in args["fields"].split(",")}
+        # Needed to build cursor
+        projection["createdTimeS"] = 1
+    else:
+        projection = {"params": 0}
+    return query, projection, limit
 
 
 @api.route("/models/list")
+@api.doc(params={
+    'limit': 'Page size',
+    'after': 'Cursor from X-Next-Cursor header of previous page',
+    'model_type': "Filter by model type, e.g. 'linearSVC'",
+    'min_test_accuracy': 'Min test accuracy',
+    'max_test_accuracy': 'Max test accuracy',
+    'min_train_accuracy': 'Min train accuracy',
+    'max_train_accuracy': 'Max train accuracy',
+    'fields': "Comma-separated fields to return, e.g. 'model_type,\
+    test_score'. Defaults to everything but params",
+})
 class ModelList(Resource):
-    @api.doc(responses={201: "Success"})
+    @api.doc(responses={201: "Success", 400: "Bad query",
+                        408: "Failed to reach DB"})
     def get(self):
-        dao = MongoDAO(cfg.mongo.host, cfg.mongo.port,
-                       cfg.mongo.dbname,  cfg.mongo.models_collection)
-        models = dao.list_documents()
-        result = list(models)
-        dao.shutdown()
-        return parse_json(result), 201
+        try:
+            query, projection, limit = list_models_query(request.args)
+        except Exception as e:
+            return {
+                "status": "Failed",
+                "message": "Bad request. Original message: "
+                + getattr(e, "message", repr(e))
+            }, 400
+
+        try:
+            dao = get_mongo_dao(cfg)
+            models = list(dao.list_documents(
+                limit=limit, filter=query, projection=projection,
+                sort=[("createdTimeS", -1), ("_id", -1)]))
+        except Exception as e:
+            return {
+                "status": "Failed",
+                "message": "Error occured while Mongo reaching. \
+                Original message: " +
+                getattr(e, "message", repr(e))
+            }, 408
+
+        response = Response(json_util.dumps(models), status=201,
+                            mimetype="application/json")
+        if len(models) == limit:
+            response.headers["X-Next-Cursor"] = encode_cursor(models[-1])
+        return response
 
 
 model_add = api.model(
@@ -38,7 +166,7 @@ model_add = api.model(
         "type":
         fields.String(required=True,
                       title="Model type",
-                      description="Must be 'logreg' or 'linearSVC';",
+                      description="Must be 'logreg', 'linearSVC' or 'sgd';",
                       default="linearSVC",
                       ),
         "params":
@@ -46,7 +174,14 @@ model_add = api.model(
             required=True,
             title="Model params",
             description="Params to use in model init; Must be valid dict;",
-            default="{'C': 0.5}")
+            default="{'C': 0.5}"),
+        "streaming":
+        fields.Boolean(
+            required=False,
+            title="Out-of-core training",
+            description="Train chunk by chunk from MinIO stream with \
+            bounded memory; Only for incremental types, e.g. 'sgd';",
+            default=False),
     })
 
 
@@ -61,20 +196,50 @@ model_predict = api.model(
     })
 
 
+model_predict_batch = api.model(
+    "Model.predict_batch.input", {
+        "texts":
+        fields.List(fields.String,
+                    required=True,
+                    title="Input texts",
+                    description="Texts in Russian to predict on; \
+                    NDJSON body is accepted as well;",
+                    ),
+    })
+
+
+model_partial_fit = api.model(
+    "Model.partial_fit.input", {
+        "texts":
+        fields.List(fields.String,
+                    required=True,
+                    title="Input texts",
+                    description="New labeled texts in Russian;",
+                    ),
+        "labels":
+        fields.List(fields.Raw,
+                    required=True,
+                    title="Labels",
+                    description="Category of every text;",
+                    ),
+    })
+
+
 @api.route("/models/add")
 class ModelAdd(Resource):
     @api.expect(model_add)
     @api.doc(
         responses={
-            201: "Success",
+            202: "Training job queued, poll /jobs/<job_id>",
             400: "Unable to init model",
-            401: "Model fitting/scoring issue",
-            404: "Unable to get data",
-            408: "Failed to reach DB"
+            401: "Unable to init trainer",
+            408: "Failed to reach DB",
+            503: "Training queue is full"
         })
     def post(self):
         __type = api.payload["type"]  # type:ignore
         __rawParams = api.payload["params"]  # type:ignore
+        __streaming = bool(api.payload.get("streaming", False))  # type:ignore
 
         try:
             classname = cfg[__type].model
@@ -84,6 +249,12 @@ class ModelAdd(Resource):
                 "status": "Failed",
                 "message": getattr(e, "message", repr(e))
             }, 400
+        if __streaming and not cfg[__type].get("incremental", False):
+            return {
+                "status": "Failed",
+                "message": f"Model type {__type} doesn't support \
+                streaming training"
+            }, 400
 
         try:
             __params = eval(__rawParams)
@@ -96,12 +267,14 @@ class ModelAdd(Resource):
             }, 400
 
         try:
-            model_trainer = ModelTrainer(classname, vectorizer,
-                                         model_params=__params,
-                                         load_model=False,
-                                         model_obj=None,
-                                         common_cfg=cfg,
-                                         logger=logger)
+            # Fail fast on bad params, actual training runs in job
+            ModelTrainer(classname, vectorizer,
+                         model_params=__params,
+                         load_model=False,
+                         model_obj=None,
+                         common_cfg=cfg,
+                         model_type=__type,
+                         logger=logger)
         except Exception as e:
             return {
                 "status": "Failed",
@@ -110,41 +283,145 @@ class ModelAdd(Resource):
             }, 401
 
         try:
-            X_train, X_test, y_train, y_test = get_train_test_data(cfg)
-            model_trainer.fit(X_train.values, y_train)  # type:ignore
+            if __streaming:
+                job_id = job_manager.submit(
+                    "train_streaming", {"type": __type, "params": __params},
+                    train_streaming, __type, __params)
+            else:
+                job_id = job_manager.submit(
+                    "train", {"type": __type, "params": __params},
+                    train_model, __type, __params)
+        except JobQueueFull as e:
+            return {
+                "status": "Failed",
+                "message": "Training queue is full, try again later. \
+                Original message: " + e.args[0]
+            }, 503
         except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Error occured while fitting. Original message: " +
+                "message": "Error occured while queueing training. \
+                Original message: " +
                 getattr(e, "message", repr(e))
-            }, 401
+            }, 408
+
+        return {"status": "OK",
+                "message": "Training job queued!",
+                "job_id": job_id,
+                }, 202
+
+
+model_sweep = api.model(
+    "Model.sweep.input", {
+        "type":
+        fields.String(required=True,
+                      title="Model type",
+                      description="Must be 'logreg', 'linearSVC' or 'sgd';",
+                      default="linearSVC",
+                      ),
+        "grid":
+        fields.String(
+            required=True,
+            title="Params grid",
+            description="Dict of param name to list of values to try;",
+            default="{'C': [0.01, 0.1, 1.0]}"),
+        "top_k":
+        fields.Integer(
+            required=False,
+            title="Models to save",
+            description="Number of best (by test accuracy) models to save;",
+            default=1),
+    })
+
+
+@api.route("/models/sweep")
+class ModelSweep(Resource):
+    @api.expect(model_sweep)
+    @api.doc(
+        responses={
+            202: "Sweep job queued, poll /jobs/<job_id>",
+            400: "Unable to init model or bad grid",
+            408: "Failed to reach DB",
+            503: "Training queue is full"
+        })
+    def post(self):
+        __type = api.payload["type"]  # type:ignore
+        __rawGrid = api.payload["grid"]  # type:ignore
+        __top_k = api.payload.get("top_k", 1)  # type:ignore
 
         try:
-            test_score = model_trainer.score(X_test.values, y_test)  # type:ignore
-            train_score = model_trainer.score(X_train.values, y_train)  # type:ignore
+            cfg[__type].model
         except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Error occured while scoring. Original message: " +
-                getattr(e, "message", repr(e))
-            }, 401
+                "message": getattr(e, "message", repr(e))
+            }, 400
 
         try:
-            _id = model_trainer.save_model(None,
-                                           train_score, test_score)
+            from sklearn.model_selection import ParameterGrid
+            __grid = ast.literal_eval(__rawGrid)
+            ParameterGrid(__grid)
+            if int(__top_k) < 1:
+                raise ValueError("top_k should be positive")
         except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Error occured while saving. Original message: " +
+                "message": "Bad request. Grid should be valid dict of lists. \
+                Original message: "
+                + getattr(e, "message", repr(e))
+            }, 400
+
+        try:
+            job_id = job_manager.submit("sweep",
+                                        {"type": __type, "grid": __grid,
+                                         "top_k": __top_k},
+                                        sweep_models, __type, __grid,
+                                        int(__top_k))
+        except JobQueueFull as e:
+            return {
+                "status": "Failed",
+                "message": "Training queue is full, try again later. \
+                Original message: " + e.args[0]
+            }, 503
+        except Exception as e:
+            return {
+                "status": "Failed",
+                "message": "Error occured while queueing sweep. \
+                Original message: " +
                 getattr(e, "message", repr(e))
             }, 408
 
         return {"status": "OK",
-                "message": "Model created!",
-                "test_accuracy": test_score["accuracy"],
-                "train_accurcy": train_score["accuracy"],
-                "model_id": _id,
-                }, 201
+                "message": "Sweep job queued!",
+                "job_id": job_id,
+                }, 202
+
+
+@api.route("/jobs/<_id>")
+@api.doc(params={'_id': 'Job ID'})
+class JobStatus(Resource):
+    @api.doc(
+        responses={
+            201: "Success",
+            404: "Unable to get job by ID",
+            408: "Failed to reach DB"
+        })
+    def get(self, _id):
+        try:
+            doc = jobs_dao(cfg).find_by_id(_id)
+        except Exception as e:
+            return {
+                "status": "Failed",
+                "message": "Error occured while Mongo reaching. \
+                Original message: " +
+                getattr(e, "message", repr(e))
+            }, 408
+        if doc is None:
+            return {
+                "status": "Failed",
+                "message": "Not found any job by provided ID"
+            }, 404
+        return parse_json(doc), 201
 
 
 @api.route("/models/<_id>/remove")
@@ -159,10 +436,7 @@ class ModelRemove(Resource):
         })
     def post(self, _id):
         try:
-            mongo_cfg = cfg.mongo
-            mongo_dao = MongoDAO(mongo_cfg.host, mongo_cfg.port,
-                                 mongo_cfg.dbname,
-                                 mongo_cfg.models_collection)
+            mongo_dao = get_mongo_dao(cfg)
         except Exception as e:
             return {
                 "status": "Failed",
@@ -171,51 +445,44 @@ class ModelRemove(Resource):
             }, 408
 
         try:
-            doc = mongo_dao.find_by_id(_id)
+            get_minio_dao(cfg, cfg.minio.models_bucket)
         except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Error occured while Mongo reaching. Original message: " +
+                "message": "Error occured while MinIO reaching. \
+                Original message: " +
                 getattr(e, "message", repr(e))
             }, 408
-        if doc is None:
-            return {
-                "status": "Failed",
-                "message": "Not found any model by provided ID"
-            }, 404
 
         try:
-            bucket = cfg.minio.models_bucket
-            minio_cfg = cfg.minio
-            minio_dao = MinioDAO(host=minio_cfg.host,
-                                 port=minio_cfg.server_port,
-                                 user=minio_cfg.root_user,
-                                 password=minio_cfg.root_password,
-                                 bucket=bucket)
+            # Only the request which removed the document releases its
+            # blobs, so concurrent or retried removes never do it twice
+            doc = mongo_dao.pop_by_id(_id)
         except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Error occured while MinIO reaching. \
-                Original message: " +
+                "message": "Error occured while Mongo reaching. Original message: " +
                 getattr(e, "message", repr(e))
             }, 408
-
-        try:
-            minio_dao.remove_from_bucket(bucket=bucket, path_in_bucket=doc["minio_path"])
-        except Exception as e:
+        if doc is None:
             return {
                 "status": "Failed",
-                "message": "Error occured while removing from MinIO. \
-                Original message: " +
-                getattr(e, "message", repr(e))
-            }, 401
+                "message": "Not found any model by provided ID"
+            }, 404
+        model_cache.invalidate(_id)
+        try:
+            prediction_cache.invalidate(_id)
+        except Exception as e:
+            logger.warning("Unable to drop cached predictions: " +
+                           getattr(e, "message", repr(e)))
 
         try:
-            mongo_dao.remove_by_id(_id)
+            # Shared blobs are removed only with their last reference
+            ArtifactStore(cfg, logger).remove_artifacts(doc)
         except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Error occured while removing from Mongo. \
+                "message": "Model is removed, but its artifacts are not. \
                 Original message: " +
                 getattr(e, "message", repr(e))
             }, 401
@@ -241,91 +508,556 @@ class ModelPredict(Resource):
     def post(self, _id):
         text = api.payload["text"]  # type:ignore
         try:
-            mongo_cfg = cfg.mongo
-            mongo_dao = MongoDAO(mongo_cfg.host, mongo_cfg.port,
-                                 mongo_cfg.dbname,
-                                 mongo_cfg.models_collection)
-            doc = mongo_dao.find_by_id(_id)
+            with STAGE_SECONDS.time(operation="predict",
+                                    stage="mongo_lookup"):
+                doc = get_model_doc(cfg, _id)
+        except ModelLoadError as e:
+            return {
+                "status": "Failed",
+                "message": e.message
+            }, e.code
+        traffic.hit(_id)
+
+        version = doc.get("updatedTimeS")
+        with STAGE_SECONDS.time(operation="predict", stage="cache_lookup"):
+            cached = prediction_cache.get(_id, version, text)
+        if cached is not None:
+            return {
+                "status": "OK",
+                "message": "Model succesfully predicted!",
+                "prediction": cached,
+            }, 201
+
+        try:
+            with STAGE_SECONDS.time(operation="predict", stage="model_load"):
+                _, model_trainer = get_trainer(cfg, _id, doc, logger)
+        except ModelLoadError as e:
+            return {
+                "status": "Failed",
+                "message": e.message
+            }, e.code
+
+        def predict(texts):
+            with STAGE_SECONDS.time(operation="predict", stage="vectorize"):
+                features = model_trainer.transform(
+                    np.array(texts, dtype=object))
+            with STAGE_SECONDS.time(operation="predict", stage="classify"):
+                predictions = model_trainer.predict_features(features)
+            with STAGE_SECONDS.time(operation="predict", stage="serialize"):
+                return [str(p) for p in predictions]
+
+        try:
+            prediction = batcher.predict((_id, version), text, predict)
+        except IndexError:
+            return {
+                "status": "Failed",
+                "message": "Model made no predictions"
+            }, 401
         except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Error occured while Mongo reaching. \
-                 Original message: " +
-                getattr(e, "message", repr(e))
-            }, 408
-        if doc is None:
+                "message": "Unable to predict for text. Original message: "
+                + getattr(e, "message", repr(e))
+            }, 401
+        prediction_cache.put(_id, version, text, prediction)
+        return {
+            "status": "OK",
+            "message": "Model succesfully predicted!",
+            "prediction": prediction,
+        }, 201
+
+
+# Updates of the same model are serialized within process. Striped, so
+# the set doesn't grow with requested IDs; versioned save in
+# `ModelTrainer.save_model` catches updates from other processes
+partial_fit_locks = [threading.Lock() for _ in range(64)]
+
+
+@api.route("/models/<_id>/partial_fit")
+@api.doc(params={'_id': 'Model ID'})
+class ModelPartialFit(Resource):
+    @api.expect(model_partial_fit)
+    @api.doc(
+        responses={
+            201: "Model updated",
+            400: "Bad input or model is not incremental",
+            401: "Model update issue",
+            404: "Unable to get data",
+            408: "Failed to reach DB",
+            409: "Model was updated concurrently, retry"
+        })
+    def post(self, _id):
+        try:
+            texts = api.payload["texts"]  # type:ignore
+            labels = api.payload["labels"]  # type:ignore
+            if not isinstance(texts, list) or not isinstance(labels, list) \
+               or len(texts) != len(labels) or not texts:
+                raise ValueError("'texts' and 'labels' should be non-empty "
+                                 "lists of the same length")
+        except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Not found any model by provided ID"
-            }, 404
+                "message": "Bad request. Original message: "
+                + getattr(e, "message", repr(e))
+            }, 400
+
+        with partial_fit_locks[hash(_id) % len(partial_fit_locks)]:
+            try:
+                doc = get_model_doc(cfg, _id)
+                if not cfg[doc["model_type"]].get("incremental", False):
+                    raise ModelLoadError(
+                        f"Model type {doc['model_type']} doesn't support "
+                        "incremental updates", 400)
+                model_cfg = cfg[doc["model_type"]]
+                # Fresh copy, cached trainer keeps serving predictions
+                model_trainer = load_trainer(cfg, doc, model_cfg.model,
+                                             model_cfg.tfidf, mmap=False,
+                                             lite=False, logger=logger)
+            except ModelLoadError as e:
+                return {
+                    "status": "Failed",
+                    "message": e.message
+                }, e.code
+            model_trainer.version = doc.get("version", 1)
+
+            try:
+                batch_score = model_trainer.partial_fit(
+                    np.array(texts, dtype=object), np.array(labels))
+            except Exception as e:
+                return {
+                    "status": "Failed",
+                    "message": "Unable to update model. Original message: "
+                    + getattr(e, "message", repr(e))
+                }, 401
+
+            try:
+                model_trainer.save_model(
+                    _id, doc.get("train_score"), doc.get("test_score"),
+                    extra={
+                        "online_score": batch_score,
+                        "incrementalSamples":
+                        doc.get("incrementalSamples", 0) + len(texts),
+                    },
+                    expected_version=model_trainer.version)
+            except VersionConflictError:
+                return {
+                    "status": "Failed",
+                    "message": "Model was updated or removed while "
+                    "updating, retry"
+                }, 409
+            except Exception as e:
+                return {
+                    "status": "Failed",
+                    "message": "Error occured while saving model. \
+                    Original message: " + getattr(e, "message", repr(e))
+                }, 408
+
+        return {
+            "status": "OK",
+            "message": "Model succesfully updated!",
+            "version": model_trainer.version,
+            "online_score": batch_score,
+            "fit_time_s": model_trainer.stats.get("fit_time_s"),
+        }, 201
+
+
+def read_batch_texts(req) -> list:
+    return parse_batch_texts(req.mimetype, req.get_data(as_text=True))
+
+
+@api.route("/models/<_id>/predict_batch")
+@api.doc(params={'_id': 'Model ID',
+                 'scores': 'Also return decision_function/predict_proba'})
+class ModelPredictBatch(Resource):
+    @api.expect(model_predict_batch)
+    @api.doc(
+        responses={
+            201: "Success",
+            400: "Unable to init model or bad input",
+            401: "Model prediction issue",
+            404: "Unable to get data",
+            408: "Failed to reach DB"
+        })
+    def post(self, _id):
         try:
-            # Можно, конечно, достать из монги все,
-            # Я просто люблю страдать
-            model_cfg = cfg[doc["model_type"]]
-            classname = model_cfg.model
-            vectorizer = model_cfg.tfidf
+            texts = read_batch_texts(request)
+            with_scores = request.args.get("scores", "false").lower() \
+                in ("1", "true", "yes")
         except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Error occured while config init. \
-                 Original message: " +
-                getattr(e, "message", repr(e))
+                "message": "Bad request. Expected JSON with 'texts' list \
+                or NDJSON. Original message: "
+                + getattr(e, "message", repr(e))
             }, 400
 
         try:
-            bucket = cfg.minio.models_bucket
-            minio_cfg = cfg.minio
-            minio_dao = MinioDAO(host=minio_cfg.host,
-                                 port=minio_cfg.server_port,
-                                 user=minio_cfg.root_user,
-                                 password=minio_cfg.root_password,
-                                 bucket=bucket)
+            with STAGE_SECONDS.time(operation="predict_batch",
+                                    stage="mongo_lookup"):
+                doc = get_model_doc(cfg, _id)
+        except ModelLoadError as e:
+            return {
+                "status": "Failed",
+                "message": e.message
+            }, e.code
+        traffic.hit(_id, len(texts))
+
+        # Scores are not cached, only labels
+        version = doc.get("updatedTimeS")
+        with STAGE_SECONDS.time(operation="predict_batch",
+                                stage="cache_lookup"):
+            cached = {} if with_scores else \
+                prediction_cache.get_many(_id, version, texts)
+        missing = [i for i in range(len(texts)) if i not in cached]
+        predictions = [cached.get(i) for i in range(len(texts))]
+
+        if missing or with_scores:
+            try:
+                with STAGE_SECONDS.time(operation="predict_batch",
+                                        stage="model_load"):
+                    _, model_trainer = get_trainer(cfg, _id, doc, logger)
+            except ModelLoadError as e:
+                return {
+                    "status": "Failed",
+                    "message": e.message
+                }, e.code
+
+            chunk_size = cfg[doc["model_type"]].get("predict_chunk_size",
+                                                    10000)
+            missing_texts = [texts[i] for i in missing]
+            try:
+                with STAGE_SECONDS.time(operation="predict_batch",
+                                        stage="predict"):
+                    predicted, scores = model_trainer.predict_chunked(
+                        np.array(missing_texts, dtype=object), chunk_size,
+                        with_scores)
+            except Exception as e:
+                return {
+                    "status": "Failed",
+                    "message": "Unable to predict for texts. Original message: "
+                    + getattr(e, "message", repr(e))
+                }, 401
+            with STAGE_SECONDS.time(operation="predict_batch",
+                                    stage="serialize"):
+                predicted = [str(p) for p in predicted]
+            for i, prediction in zip(missing, predicted):
+                predictions[i] = prediction
+            prediction_cache.put_many(_id, version, missing_texts, predicted)
+
+        result = {
+            "status": "OK",
+            "message": "Model succesfully predicted!",
+            "predictions": predictions,
+        }
+        if with_scores:
+            result["classes"] = [str(c) for c in model_trainer.classes()]
+            result["scores"] = scores.tolist()  # type:ignore
+        return result, 201
+
+
+ensemble_add = api.model(
+    "Ensemble.add.input", {
+        "name":
+        fields.String(required=True,
+                      title="Ensemble name",
+                      description="Unique name, adding again overwrites;",
+                      default="candidates"),
+        "models":
+        fields.List(fields.String,
+                    required=True,
+                    title="Model IDs",
+                    description="Models to predict with;"),
+        "weights":
+        fields.List(fields.Float,
+                    required=False,
+                    title="Weights",
+                    description="Vote/score weight or traffic share of \
+                    every model, equal by default;"),
+        "aggregate":
+        fields.String(required=False,
+                      title="Aggregation",
+                      description="'vote', 'average' (of scores) or \
+                      'split' (traffic split, one model per text);",
+                      default="vote"),
+    })
+
+
+ensemble_predict = api.model(
+    "Ensemble.predict.input", {
+        "models":
+        fields.List(fields.String,
+                    required=False,
+                    title="Model IDs",
+                    description="Models to predict with, if no 'ensemble';"),
+        "ensemble":
+        fields.String(required=False,
+                      title="Ensemble name",
+                      description="Stored ensemble to predict with;"),
+        "texts":
+        fields.List(fields.String,
+                    required=True,
+                    title="Input texts",
+                    description="Texts in Russian to predict on;"),
+        "aggregate":
+        fields.String(required=False,
+                      title="Aggregation",
+                      description="Overrides one of ensemble;"),
+    })
+
+
+def ensemble_spec(payload: dict) -> dict:
+    """ Validated models, weights and aggregation of ensemble """
+    models = [str(_id) for _id in payload["models"]]
+    weights = [float(w) for w in payload.get("weights")
+               or [1.0] * len(models)]
+    aggregate = payload.get("aggregate") or "vote"
+    if not models or len(models) != len(weights):
+        raise ValueError("'models' should be non-empty and match 'weights'")
+    if min(weights) < 0 or sum(weights) <= 0:
+        raise ValueError("'weights' should be non-negative, not all zero")
+    if aggregate not in ensemble.AGGREGATES:
+        raise ValueError(f"'aggregate' should be one of {ensemble.AGGREGATES}")
+    return {"models": models, "weights": weights, "aggregate": aggregate}
+
+
+def get_ensemble(name: str) -> dict:
+    """ Find stored ensemble by name
+
+    Raises:
+        ModelLoadError: with HTTP code to respond with
+    """
+    try:
+        docs = list(get_mongo_dao(cfg, cfg.mongo.ensembles_collection)
+                    .find_by_keys([name]))
+    except Exception as e:
+        raise ModelLoadError("Error occured while Mongo reaching. \
+            Original message: " + getattr(e, "message", repr(e)), 408)
+    if not docs:
+        raise ModelLoadError("Not found any ensemble by provided name", 404)
+    return docs[0]
+
+
+@api.route("/ensembles/add")
+class EnsembleAdd(Resource):
+    @api.expect(ensemble_add)
+    @api.doc(
+        responses={
+            201: "Success",
+            400: "Bad ensemble",
+            404: "Unable to get model",
+            408: "Failed to reach DB"
+        })
+    def post(self):
+        try:
+            name = str(api.payload["name"])  # type:ignore
+            spec = ensemble_spec(api.payload)  # type:ignore
         except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Error occured while MinIO reaching. \
+                "message": "Bad request. Original message: "
+                + getattr(e, "message", repr(e))
+            }, 400
+
+        try:
+            for _id in spec["models"]:
+                get_model_doc(cfg, _id)
+        except ModelLoadError as e:
+            return {
+                "status": "Failed",
+                "message": e.message
+            }, e.code
+        except Exception as e:
+            return {
+                "status": "Failed",
+                "message": "Bad model ID. Original message: "
+                + getattr(e, "message", repr(e))
+            }, 400
+
+        try:
+            get_mongo_dao(cfg, cfg.mongo.ensembles_collection) \
+                .bulk_set_by_keys({name: {**spec, "updatedTimeS": time.time()}})
+        except Exception as e:
+            return {
+                "status": "Failed",
+                "message": "Error occured while Mongo reaching. \
                 Original message: " +
                 getattr(e, "message", repr(e))
             }, 408
+        return {
+            "status": "OK",
+            "message": "Ensemble succesfully saved!",
+            "name": name,
+        }, 201
 
+
+@api.route("/ensembles/<name>/remove")
+@api.doc(params={'name': 'Ensemble name'})
+class EnsembleRemove(Resource):
+    @api.doc(
+        responses={
+            201: "Success",
+            404: "Unable to get ensemble by name",
+            408: "Failed to reach DB"
+        })
+    def post(self, name):
         try:
-            obj = minio_dao.get_from_bucket(bucket=bucket, path_in_bucket=doc["minio_path"])
+            removed = get_mongo_dao(cfg, cfg.mongo.ensembles_collection) \
+                .remove_many({"_id": name})
         except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Error occured while getting model from MinIO. \
+                "message": "Error occured while Mongo reaching. \
                 Original message: " +
                 getattr(e, "message", repr(e))
+            }, 408
+        if not removed:
+            return {
+                "status": "Failed",
+                "message": "Not found any ensemble by provided name"
             }, 404
+        return {
+            "status": "OK",
+            "message": "Ensemble succesfully removed!",
+        }, 201
+
 
+@api.route("/ensembles/predict")
+class EnsemblePredict(Resource):
+    @api.expect(ensemble_predict)
+    @api.doc(
+        responses={
+            201: "Success",
+            400: "Unable to init model or bad input",
+            401: "Model prediction issue",
+            404: "Unable to get data",
+            408: "Failed to reach DB"
+        })
+    def post(self):
+        payload = api.payload or {}  # type:ignore
         try:
-            model_trainer = ModelTrainer(classname, vectorizer,
-                                         model_params=None,
-                                         load_model=True,
-                                         model_obj=obj,
-                                         common_cfg=cfg,
-                                         logger=logger)
+            name = payload.get("ensemble")
+            spec = get_ensemble(str(name)) if name else {}
+            spec = ensemble_spec({**spec, **{
+                key: payload[key]
+                for key in ("models", "weights", "aggregate")
+                if payload.get(key)}})
+            texts = payload["texts"]
+            if not isinstance(texts, list):
+                raise ValueError("'texts' should be a list of strings")
+        except ModelLoadError as e:
+            return {
+                "status": "Failed",
+                "message": e.message
+            }, e.code
         except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Unable to init trainer. Original message: "
+                "message": "Bad request. Expected 'texts' and 'models' or \
+                'ensemble'. Original message: "
                 + getattr(e, "message", repr(e))
             }, 400
+        models, weights = spec["models"], spec["weights"]
+        aggregate = spec["aggregate"]
+
+        # Traffic split predicts every text with its assigned model only
+        assigned = ensemble.split(texts, models, weights, name or "") \
+            if aggregate == "split" else None
+        used = [_id for _id in models
+                if assigned is None or _id in assigned]
+        trainers, fingerprints = {}, {}
         try:
-            prediction = model_trainer.predict(np.array([text]))
-        except Exception as e:
+            with STAGE_SECONDS.time(operation="predict_ensemble",
+                                    stage="model_load"):
+                for _id in used:
+                    doc, trainers[_id] = get_trainer(cfg, _id, logger=logger)
+                    fingerprints[_id] = doc.get("vectorizer_fingerprint")
+        except ModelLoadError as e:
             return {
                 "status": "Failed",
-                "message": "Unable to predict for text. Original message: "
-                + getattr(e, "message", repr(e))
-            }, 401
-        if len(prediction) < 1:
+                "message": e.message
+            }, e.code
+
+        try:
+            with STAGE_SECONDS.time(operation="predict_ensemble",
+                                    stage="predict"):
+                predicted, transforms = ensemble.predict_shared(
+                    trainers, fingerprints, texts,
+                    with_scores=aggregate == "average", assigned=assigned)
+        except Exception as e:
             return {
                 "status": "Failed",
-                "message": "Model made no predictions"
+                "message": "Unable to predict for texts. Original message: "
+                + getattr(e, "message", repr(e))
             }, 401
-        return {
+        for _id in used:
+            traffic.hit(_id, len(texts) if assigned is None
+                        else assigned.count(_id))
+
+        labels = {_id: [str(p) for p in predicted[_id][0]] for _id in used}
+        result = {
             "status": "OK",
-            "message": "Model succesfully predicted!",
-            "prediction": str(prediction[0]),
-        }, 201
+            "message": "Models succesfully predicted!",
+            "aggregate": aggregate,
+            "transforms": transforms,
+            "models": {_id: {"predictions": labels[_id],
+                             "fingerprint": fingerprints[_id]}
+                       for _id in used},
+        }
+        if aggregate == "vote":
+            result["predictions"] = ensemble.vote(
+                [labels[_id] for _id in models], weights)
+        elif aggregate == "average":
+            try:
+                result["predictions"], result["classes"], mean = \
+                    ensemble.average(
+                        [trainers[_id].classes() for _id in models],
+                        [predicted[_id][1] for _id in models], weights)
+            except Exception as e:
+                return {
+                    "status": "Failed",
+                    "message": "Unable to average model scores. \
+                    Original message: " + getattr(e, "message", repr(e))
+                }, 401
+            result["scores"] = mean.tolist()
+        else:
+            result["predictions"] = ensemble.scatter(assigned, labels)
+            result["assignments"] = assigned
+        return result, 201
+
+
+@api.route("/health")
+class Health(Resource):
+    @api.doc(responses={201: "Ready to serve", 503: "Warming up"})
+    def get(self):
+        ready = warmup.ready.is_set()
+        return {
+            "status": "OK" if ready else "Warming up",
+            "ready": ready,
+            "warmup": warmup.summary,
+            "startup": startup.summary,
+            "memory": process_memory(),
+        }, 201 if ready else 503
+
+
+@api.route("/cache/stats")
+class CacheStats(Resource):
+    @api.doc(responses={201: "Success"})
+    def get(self):
+        return {"models": model_cache.stats(),
+                "predictions": prediction_cache.stats()}, 201
+
+
+@api.route("/batching/stats")
+class BatchingStats(Resource):
+    @api.doc(responses={201: "Success"})
+    def get(self):
+        return batcher.stats(), 201
+
+
+@api.route("/metrics")
+class Metrics(Resource):
+    @api.doc(responses={200: "Prometheus text exposition format"})
+    def get(self):
+        # Prometheus scrapes only expect 200
+        return Response(registry.render(), 200,
+                        mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,421 @@
+# Model artifacts: compact serialization and local on-disk cache
+import copy
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from typing import List, Optional, Tuple
+
+import joblib
+import numpy as np
+from omegaconf import DictConfig
+
+from api.src.dao import get_minio_dao, get_mongo_dao
+from configurator import ROOT_DIR
+
+# Fitted attributes which are safe to keep in single precision
+FLOAT32_ATTRIBUTES = ("coef_", "idf_")
+
+
+def compact_pipeline(pipeline, float32: bool = False):
+    """ Drop fitted attributes not needed for inference, downcast weights
+
+    Pipeline is not modified: changed steps are shallow copies, so
+    e.g. vectorizer shared by FeatureStore keeps its attributes.
+
+    Args:
+        pipeline (sklearn.pipeline.Pipeline): fitted pipeline
+        float32 (bool): whether to downcast `coef_`/`idf_` to float32
+
+    Returns:
+        sklearn.pipeline.Pipeline: compacted copy of pipeline
+    """
+    steps = []
+    for name, step in pipeline.steps:
+        compacted = copy.copy(step)
+        # Nested estimators too, e.g. TfidfVectorizer.idf_ is kept by _tfidf
+        for key, value in list(vars(compacted).items()):
+            if hasattr(value, "get_params"):
+                setattr(compacted, key, copy.copy(value))
+        # Terms cut by min_df/max_df/max_features, kept for introspection only
+        if hasattr(compacted, "stop_words_"):
+            delattr(compacted, "stop_words_")
+        for attribute in FLOAT32_ATTRIBUTES if float32 else ():
+            value = getattr(compacted, attribute, None)
+            if isinstance(value, np.ndarray) and value.dtype == np.float64:
+                setattr(compacted, attribute, value.astype(np.float32))
+        steps.append((name, compacted))
+    compacted = copy.copy(pipeline)
+    compacted.steps = steps
+    return compacted
+
+
+class ArtifactStore():
+    def __init__(self, cfg: DictConfig, logger=None) -> None:
+        """ Dumps models to MinIO and loads them through local disk cache
+
+        Args:
+            cfg (DictConfig): common config, `cfg.artifacts` is used
+        """
+        self.cfg = cfg
+        artifacts_cfg = cfg.artifacts
+        self.bucket = cfg.minio.models_bucket
+        self.compress = artifacts_cfg.get("compress", "zlib")
+        self.compress_level = artifacts_cfg.get("compress_level", 3)
+        self.float32 = artifacts_cfg.get("float32", False)
+        self.mmap_mode = artifacts_cfg.get("mmap_mode", None)
+        self.mmap_unpack = artifacts_cfg.get("mmap_unpack", False)
+        # Relative to project root, hydra is not imported by serving
+        self.cache_dir = os.path.join(ROOT_DIR, artifacts_cfg.cache_dir)
+        self.cache_max_bytes = artifacts_cfg.get("cache_max_bytes", None)
+        self.content_addressed = artifacts_cfg.get("content_addressed", False)
+        self.blob_path_template = artifacts_cfg.get("blob_path_template",
+                                                    "blobs/{}.pk")
+        self.release_wait_s = artifacts_cfg.get("release_wait_s", 30)
+        self.logger = logger or logging.getLogger(__name__)
+
+    def _compress_arg(self):
+        if not self.compress or self.compress == "none":
+            return 0
+        return (self.compress, self.compress_level)
+
+    def _local_path(self, path_in_bucket: str, etag: str) -> str:
+        return os.path.join(self.cache_dir, f"{path_in_bucket}.{etag}")
+
+    def _dump(self, obj, path: str) -> None:
+        try:
+            joblib.dump(obj, path, compress=self._compress_arg())
+        except ValueError as e:
+            # e.g. lz4 is not installed
+            self.logger.warning(f"Unable to compress with {self.compress}, "
+                                f"falling back to zlib: {e!r}")
+            self.compress = "zlib"
+            joblib.dump(obj, path, compress=self._compress_arg())
+
+    def save(self, pipeline, path_in_bucket: str,
+             compact: bool = True) -> dict:
+        """ Dump pipeline, upload it and keep it in local cache
+
+        Args:
+            pipeline (sklearn.pipeline.Pipeline): fitted pipeline,
+                its compacted copy is saved, see `compact_pipeline`
+            path_in_bucket (str): path in models bucket
+            compact (bool): whether to compact, False for other objects,
+                e.g. lite artifacts
+
+        Returns:
+            dict: artifact metadata to store in Mongo
+        """
+        if compact:
+            pipeline = compact_pipeline(pipeline, self.float32)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        os.close(fd)
+        try:
+            start = time.time()
+            self._dump(pipeline, tmp_path)
+            dump_time = time.time() - start
+
+            start = time.time()
+            minio_dao = get_minio_dao(self.cfg, self.bucket)
+            result = minio_dao.save_to_bucket(self.bucket, path_in_bucket,
+                                              tmp_path)
+            upload_time = time.time() - start
+            etag = result.etag.strip('"')
+            size = os.path.getsize(tmp_path)
+            local_path = self._local_path(path_in_bucket, etag)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            os.replace(tmp_path, local_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._prune(keep=local_path)
+
+        return {
+            "etag": etag,
+            "size_bytes": size,
+            "compress": self.compress or "none",
+            "float32": bool(self.float32),
+            "dump_time_s": dump_time,
+            "upload_time_s": upload_time,
+        }
+
+    def _refs_dao(self):
+        return get_mongo_dao(self.cfg, self.cfg.mongo.blobs_collection)
+
+    def _reference(self, path_in_bucket: str, size: int) -> int:
+        """ Add reference to blob, waiting for its removal to finish
+
+        Returns:
+            int: number of references, 1 if reference document is created
+        """
+        deadline = time.time() + self.release_wait_s
+        while True:
+            refs = self._refs_dao().increment_by_key(
+                path_in_bucket, "refs", 1,
+                on_insert={"size_bytes": size, "createdTimeS": time.time()},
+                filter={"deleting": {"$exists": False}})
+            if refs is not None:
+                return refs
+            if time.time() > deadline:
+                raise TimeoutError(f"Blob {path_in_bucket} is being removed "
+                                   f"for over {self.release_wait_s}s")
+            time.sleep(0.05)
+
+    def save_blob(self, obj) -> dict:
+        """ Dump object to bucket path named by hash of its bytes
+
+        Reference of blob is counted in Mongo, upload is skipped if the
+        same bytes are already stored (e.g. by a retrain on the same data).
+
+        Returns:
+            dict: blob metadata to store in Mongo
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir)
+        os.close(fd)
+        try:
+            start = time.time()
+            self._dump(obj, tmp_path)
+            digest = hashlib.sha256()
+            with open(tmp_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            sha256 = digest.hexdigest()
+            path_in_bucket = self.blob_path_template.format(sha256)
+            dump_time = time.time() - start
+            size = os.path.getsize(tmp_path)
+
+            # Referenced before upload, so concurrent release keeps it
+            refs = self._reference(path_in_bucket, size)
+            start = time.time()
+            try:
+                minio_dao = get_minio_dao(self.cfg, self.bucket)
+                # Object of just created reference may be removed by the
+                # release which dropped the previous one, upload anyway
+                stat = minio_dao.stat(self.bucket, path_in_bucket) \
+                    if refs > 1 else None
+                deduplicated = stat is not None
+                if not deduplicated:
+                    stat = minio_dao.save_to_bucket(
+                        self.bucket, path_in_bucket, tmp_path)
+            except Exception:
+                self.release([{"minio_path": path_in_bucket}])
+                raise
+            upload_time = time.time() - start
+            etag = stat.etag.strip('"')
+            local_path = self._local_path(path_in_bucket, etag)
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            os.replace(tmp_path, local_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._prune(keep=local_path)
+
+        return {
+            "minio_path": path_in_bucket,
+            "sha256": sha256,
+            "etag": etag,
+            "size_bytes": size,
+            "compress": self.compress or "none",
+            "float32": bool(self.float32),
+            "deduplicated": deduplicated,
+            "dump_time_s": dump_time,
+            "upload_time_s": upload_time,
+        }
+
+    def save_blobs(self, pipeline, compact: bool = True) -> List[dict]:
+        """ Save every pipeline step as a separate blob
+
+        Fitted vectorizer is shared by models trained on the same features,
+        so it is stored once, only classifier weights differ.
+
+        Returns:
+            List[dict]: step name and blob metadata of every step
+        """
+        if compact:
+            pipeline = compact_pipeline(pipeline, self.float32)
+        blobs: List[dict] = []
+        try:
+            for name, step in pipeline.steps:
+                blobs.append({"name": name, **self.save_blob(step)})
+        except Exception:
+            self.release(blobs)
+            raise
+        return blobs
+
+    @staticmethod
+    def summary(blobs: List[dict]) -> dict:
+        """ Artifact metadata of model saved as blobs """
+        return {
+            "size_bytes": sum(blob["size_bytes"] for blob in blobs),
+            "uploaded_bytes": sum(blob["size_bytes"] for blob in blobs
+                                  if not blob["deduplicated"]),
+            "compress": blobs[0]["compress"] if blobs else "none",
+            "float32": any(blob["float32"] for blob in blobs),
+            "dump_time_s": sum(blob["dump_time_s"] for blob in blobs),
+            "upload_time_s": sum(blob["upload_time_s"] for blob in blobs),
+        }
+
+    def release(self, blobs: List[dict]) -> List[str]:
+        """ Drop references to blobs, removing ones nobody refers to
+
+        Returns:
+            List[str]: removed bucket paths
+        """
+        refs_dao = self._refs_dao()
+        removed = []
+        for blob in blobs:
+            path_in_bucket = blob["minio_path"]
+            refs = refs_dao.increment_by_key(path_in_bucket, "refs", -1,
+                                             upsert=False)
+            # Unknown blobs are kept, e.g. counted by someone else
+            if refs is None or refs > 0:
+                continue
+            # Claimed blob can't be referenced again until its reference
+            # document is dropped, i.e. after the object is removed
+            if not refs_dao.update_by_key(
+                    path_in_bucket, {"deleting": time.time()},
+                    filter={"refs": {"$lte": 0},
+                            "deleting": {"$exists": False}}):
+                continue
+            try:
+                get_minio_dao(self.cfg, self.bucket).remove_from_bucket(
+                    self.bucket, path_in_bucket)
+                removed.append(path_in_bucket)
+            finally:
+                refs_dao.remove_many({"_id": path_in_bucket})
+        return removed
+
+    @staticmethod
+    def blobs_of(doc: dict) -> List[dict]:
+        """ Content-addressed blobs referenced by model document """
+        blobs = list(doc.get("blobs") or [])
+        if (doc.get("lite") or {}).get("sha256"):
+            blobs.append(doc["lite"])
+        return blobs
+
+    @staticmethod
+    def paths_of(doc: dict) -> List[str]:
+        """ Bucket paths owned by model document (not shared blobs) """
+        lite = doc.get("lite") or {}
+        return [path for path in (doc.get("minio_path"),
+                                  None if lite.get("sha256")
+                                  else lite.get("minio_path"))
+                if path]
+
+    def remove_artifacts(self, doc: dict,
+                         keep: Optional[dict] = None) -> None:
+        """ Release blobs of model document and remove objects it owns
+
+        Args:
+            doc (dict): model document
+            keep (dict, optional): newer document of the same model,
+                objects it owns too (i.e. overwritten ones) are kept
+        """
+        self.release(self.blobs_of(doc))
+        kept = set(self.paths_of(keep)) if keep else set()
+        for path_in_bucket in self.paths_of(doc):
+            if path_in_bucket not in kept:
+                get_minio_dao(self.cfg, self.bucket).remove_from_bucket(
+                    self.bucket, path_in_bucket)
+
+    def fetch(self, path_in_bucket: str, etag: Optional[str] = None) -> str:
+        """ Get local path of artifact, downloading it on cache miss
+
+        Args:
+            path_in_bucket (str): path in models bucket
+            etag (str, optional): expected artifact ETag.
+                Defaults to current ETag of object in MinIO
+
+        Returns:
+            str: local path
+        """
+        minio_dao = get_minio_dao(self.cfg, self.bucket)
+        if etag is None:
+            stat = minio_dao.stat(self.bucket, path_in_bucket)
+            if stat is None:
+                raise FileNotFoundError(
+                    f"Not found {self.bucket}/{path_in_bucket}")
+            etag = stat.etag.strip('"')
+
+        local_path = self._local_path(path_in_bucket, etag)
+        if os.path.exists(local_path):
+            os.utime(local_path)
+            return local_path
+
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(local_path))
+        os.close(fd)
+        try:
+            minio_dao.download(self.bucket, path_in_bucket, tmp_path)
+            os.replace(tmp_path, local_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._prune(keep=local_path)
+        return local_path
+
+    def mmap_mode_for(self, artifact: dict) -> Optional[str]:
+        """ joblib mmap_mode for artifact, compressed ones can't be mapped """
+        if artifact.get("compress", "none") != "none":
+            return None
+        return self.mmap_mode
+
+    def mappable(self, local_path: str,
+                 artifact: dict) -> Tuple[str, Optional[str]]:
+        """ Local path and joblib mmap_mode to load artifact with
+
+        With `mmap_unpack` compressed artifact is unpacked once next to the
+        cached one. Its arrays are then memory-mapped, so all workers share
+        the same page cache instead of holding their own copies.
+
+        Args:
+            local_path (str): cached artifact, see `fetch`
+            artifact (dict): artifact metadata of model document
+        """
+        mmap_mode = self.mmap_mode_for(artifact)
+        if mmap_mode or not (self.mmap_unpack and self.mmap_mode):
+            return local_path, mmap_mode
+
+        unpacked_path = f"{local_path}.raw"
+        if os.path.exists(unpacked_path):
+            os.utime(unpacked_path)
+            return unpacked_path, self.mmap_mode
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(local_path))
+        os.close(fd)
+        try:
+            joblib.dump(joblib.load(local_path), tmp_path, compress=0)
+            os.replace(tmp_path, unpacked_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._prune(keep=unpacked_path)
+        return unpacked_path, self.mmap_mode
+
+    def _prune(self, keep: Optional[str] = None) -> None:
+        """ Remove least recently used artifacts above `cache_max_bytes` """
+        if not self.cache_max_bytes:
+            return
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.cache_max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                # Memory-mapped pages stay valid after unlink
+                os.remove(path)
+                total -= size
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,182 @@
+# Coalescing concurrent single-text predictions into vectorized batches
+import asyncio
+import threading
+from typing import Awaitable, Callable, Hashable, List, Optional
+
+from api.src.metrics import Histogram
+
+
+class _Batch():
+    def __init__(self) -> None:
+        self.texts: list = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results: Optional[list] = None
+        self.error: Optional[BaseException] = None
+
+
+def batch_size_buckets(max_batch_size: int) -> List[int]:
+    """ Powers of two up to `max_batch_size` """
+    buckets, bound = [], 1
+    while bound < max_batch_size:
+        buckets.append(bound)
+        bound *= 2
+    return buckets + [max_batch_size]
+
+
+class MicroBatcher():
+    def __init__(self, window_ms: float = 3, max_batch_size: int = 64,
+                 enabled: bool = True) -> None:
+        """ Collects concurrent predictions for the same model into batches
+
+        The first request of a batch waits up to `window_ms` (or until
+        `max_batch_size` texts are collected), runs a single vectorized
+        predict and hands results out to the other waiting requests.
+
+        Args:
+            window_ms (float): max time to wait for more texts
+            max_batch_size (int): max number of texts in batch
+            enabled (bool): whether to coalesce at all
+        """
+        self._lock = threading.Lock()
+        self._open: dict = {}
+        self.configure(enabled, window_ms, max_batch_size)
+
+    def configure(self, enabled: bool = True,
+                  window_ms: Optional[float] = None,
+                  max_batch_size: Optional[int] = None) -> None:
+        with self._lock:
+            self.enabled = enabled
+            if window_ms is not None:
+                self.window_s = float(window_ms) / 1000
+            if max_batch_size is not None:
+                self.max_batch_size = max(1, int(max_batch_size))
+                self.histogram = Histogram(
+                    "mlops_predict_batch_size",
+                    "Number of texts per coalesced predict call",
+                    buckets=batch_size_buckets(self.max_batch_size))
+
+    def predict(self, key: Hashable, text: str,
+                predict: Callable[[list], list]):
+        """ Predict for single text as part of a batch
+
+        Args:
+            key (Hashable): batch key, e.g. model ID and version
+            text (str): text to predict for
+            predict (Callable): vectorized predict, list of texts to
+                list of predictions. Called by one of requests of batch
+
+        Raises:
+            Exception: the one raised by `predict` for the whole batch
+
+        Returns:
+            prediction for `text`
+        """
+        if not self.enabled:
+            self.histogram.observe(1)
+            return predict([text])[0]
+
+        with self._lock:
+            batch = self._open.get(key)
+            is_leader = batch is None
+            if is_leader:
+                batch = self._open[key] = _Batch()
+            idx = len(batch.texts)
+            batch.texts.append(text)
+            if len(batch.texts) >= self.max_batch_size:
+                del self._open[key]
+                batch.full.set()
+
+        if is_leader:
+            batch.full.wait(self.window_s)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+            try:
+                batch.results = predict(batch.texts)
+            except BaseException as e:
+                batch.error = e
+            finally:
+                self.histogram.observe(len(batch.texts))
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[idx]  # type: ignore
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "window_ms": self.window_s * 1000,
+            "max_batch_size": self.max_batch_size,
+            "batch_size": self.histogram.snapshot(),
+        }
+
+
+class _AsyncBatch():
+    def __init__(self) -> None:
+        self.texts: list = []
+        self.full = asyncio.Event()
+        self.results: "asyncio.Future" = \
+            asyncio.get_running_loop().create_future()
+
+
+class AsyncMicroBatcher(MicroBatcher):
+    """ `MicroBatcher` for asyncio, requests wait without holding threads
+
+    All calls must come from the same event loop.
+    """
+
+    def __init__(self, window_ms: float = 3, max_batch_size: int = 64,
+                 enabled: bool = True) -> None:
+        super().__init__(window_ms, max_batch_size, enabled)
+        self._tasks: set = set()
+
+    async def predict_async(self, key: Hashable, text: str,
+                            predict: Callable[[list], Awaitable[list]]):
+        """ Predict for single text as part of a batch
+
+        Args:
+            key (Hashable): batch key, e.g. model ID and version
+            text (str): text to predict for
+            predict (Callable): async vectorized predict, list of texts to
+                list of predictions, e.g. run in executor
+
+        Returns:
+            prediction for `text`
+        """
+        if not self.enabled:
+            self.histogram.observe(1)
+            return (await predict([text]))[0]
+
+        batch = self._open.get(key)
+        if batch is None:
+            batch = self._open[key] = _AsyncBatch()
+            task = asyncio.ensure_future(self._run(key, batch, predict))
+            # Event loop keeps only weak references to tasks
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        idx = len(batch.texts)
+        batch.texts.append(text)
+        if len(batch.texts) >= self.max_batch_size:
+            del self._open[key]
+            batch.full.set()
+        # Cancelled request must not cancel the whole batch
+        results = await asyncio.shield(batch.results)
+        return results[idx]
+
+    async def _run(self, key: Hashable, batch: _AsyncBatch,
+                   predict: Callable[[list], Awaitable[list]]) -> None:
+        try:
+            await asyncio.wait_for(batch.full.wait(), self.window_s)
+        except asyncio.TimeoutError:
+            pass
+        if self._open.get(key) is batch:
+            del self._open[key]
+        self.histogram.observe(len(batch.texts))
+        try:
+            batch.results.set_result(await predict(batch.texts))
+        except Exception as e:
+            batch.results.set_exception(e)
@@ -0,0 +1,341 @@
+import datetime
+import hashlib
+import logging
+import re
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+import numpy as np
+
+
+def estimate_nbytes(obj: Any, _seen: Optional[set] = None) -> int:
+    """ Rough in-memory footprint of a fitted object (pipeline, model, ...)
+
+    Walks numpy arrays, scipy sparse matrices, containers and object
+    attributes. Shared objects are counted only once.
+
+    Args:
+        obj (Any): object to measure
+
+    Returns:
+        int: estimated size in bytes
+    """
+    seen = set() if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        if obj.dtype == object:
+            return obj.nbytes + sum(estimate_nbytes(x, seen)
+                                    for x in obj.ravel())
+        return obj.nbytes
+    if hasattr(obj, "data") and hasattr(obj, "indices") \
+       and hasattr(obj, "indptr"):  # scipy.sparse compressed matrix
+        return sum(estimate_nbytes(getattr(obj, name), seen)
+                   for name in ("data", "indices", "indptr"))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(estimate_nbytes(k, seen) + estimate_nbytes(v, seen)
+                    for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(estimate_nbytes(x, seen) for x in obj)
+    elif hasattr(obj, "__dict__"):
+        size += estimate_nbytes(vars(obj), seen)
+    return size
+
+
+class ModelCache():
+    def __init__(self, max_items: int = 8,
+                 max_bytes: int = 1024 ** 3) -> None:
+        """ Bounded thread-safe LRU cache of loaded models
+
+        Every entry is keyed by model id and remembers the version
+        (Mongo `updatedTimeS`) it was loaded for, so a retrained model
+        is never served from a stale entry.
+
+        Args:
+            max_items (int): max number of models kept in memory
+            max_bytes (int): max estimated memory footprint of all models
+        """
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._loading: dict = {}
+        self._nbytes = 0
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def configure(self, max_items: Optional[int] = None,
+                  max_bytes: Optional[int] = None) -> None:
+        with self._lock:
+            if max_items is not None:
+                self.max_items = int(max_items)
+            if max_bytes is not None:
+                self.max_bytes = int(max_bytes)
+            self._evict()
+
+    def get(self, model_id: Hashable, version: Any = None,
+            count_miss: bool = True) -> Any:
+        """ Get cached model or None on miss (or version mismatch)
+
+        Args:
+            count_miss (bool): False if miss is followed by `get_or_load`,
+                which counts it
+        """
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is None or entry[0] != version:
+                self.misses += int(count_miss)
+                return None
+            self._entries.move_to_end(model_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, model_id: Hashable, version: Any, model: Any,
+            nbytes: Optional[int] = None) -> None:
+        if nbytes is None:
+            nbytes = estimate_nbytes(model)
+        with self._lock:
+            self._pop(model_id)
+            if nbytes > self.max_bytes or self.max_items < 1:
+                # Would evict everything else and still not fit
+                self.evictions += 1
+                return
+            self._entries[model_id] = (version, model, nbytes)
+            self._nbytes += nbytes
+            self._evict()
+
+    def get_or_load(self, model_id: Hashable, version: Any,
+                    loader: Callable[[], Any],
+                    sizer: Callable[[Any], int] = estimate_nbytes) -> Any:
+        """ Get cached model or load it with `loader`
+
+        Concurrent misses for the same model wait for a single load
+        instead of fetching the same artifact several times.
+
+        Args:
+            model_id (Hashable): model ID
+            version (Any): model version, e.g. `updatedTimeS`
+            loader (Callable): no-arg function returning loaded model
+            sizer (Callable): function estimating model size in bytes
+        """
+        model = self.get(model_id, version)
+        if model is not None:
+            return model
+
+        with self._lock:
+            key = (model_id, version)
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        try:
+            with load_lock:
+                # Someone may have loaded it while we were waiting
+                with self._lock:
+                    entry = self._entries.get(model_id)
+                    if entry is not None and entry[0] == version:
+                        self._entries.move_to_end(model_id)
+                        return entry[1]
+                model = loader()
+                self.put(model_id, version, model, sizer(model))
+                return model
+        finally:
+            with self._lock:
+                if self._loading.get(key) is load_lock:
+                    del self._loading[key]
+
+    def invalidate(self, model_id: Hashable) -> None:
+        with self._lock:
+            if self._pop(model_id):
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "items": len(self._entries),
+                "bytes": self._nbytes,
+                "max_items": self.max_items,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _pop(self, model_id: Hashable) -> bool:
+        entry = self._entries.pop(model_id, None)
+        if entry is None:
+            return False
+        self._nbytes -= entry[2]
+        return True
+
+    def _evict(self) -> None:
+        while self._entries and (len(self._entries) > self.max_items or
+                                 self._nbytes > self.max_bytes):
+            _, entry = self._entries.popitem(last=False)
+            self._nbytes -= entry[2]
+            self.evictions += 1
+
+
+class PredictionCache():
+    # Whitespace never gets into tokens of word analyzers
+    _SPACES = re.compile(r"\s+")
+
+    def __init__(self, max_items: int = 100000) -> None:
+        """ Cache of predicted labels keyed by model and normalized text
+
+        In-process LRU tier, optionally backed by a shared Mongo tier
+        with TTL index. Keys include model version (`updatedTimeS`),
+        so retrained models never get stale predictions.
+
+        Args:
+            max_items (int): max number of predictions kept in memory
+        """
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self.enabled = True
+        self.max_items = max_items
+        self.lowercase = True
+        self.dao = None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+    def configure(self, enabled: bool = True,
+                  max_items: Optional[int] = None,
+                  lowercase: bool = True,
+                  dao=None, **_) -> None:
+        """
+        Args:
+            enabled (bool): whether to cache at all
+            max_items (int, optional): size of in-process tier
+            lowercase (bool): whether case is ignored by models
+            dao (MongoDAO, optional): collection of shared tier,
+                its TTL index is created by `init_daos`
+        """
+        with self._lock:
+            self.enabled = enabled
+            self.lowercase = lowercase
+            if max_items is not None:
+                self.max_items = int(max_items)
+            self.dao = dao
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+    def normalize(self, text: str) -> str:
+        text = self._SPACES.sub(" ", str(text)).strip()
+        return text.lower() if self.lowercase else text
+
+    def key(self, model_id: str, version: Any, text: str) -> str:
+        digest = hashlib.sha1(self.normalize(text).encode("utf-8"))
+        return f"{model_id}:{version!r}:{digest.hexdigest()}"
+
+    def get_many(self, model_id: str, version: Any,
+                 texts: List[str]) -> Dict[int, str]:
+        """ Cached predictions by index of text """
+        if not self.enabled:
+            return {}
+        keys = [self.key(model_id, version, text) for text in texts]
+        found, missing = {}, {}
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[i] = self._entries[key]
+                else:
+                    missing.setdefault(key, []).append(i)
+            self.hits += len(found)
+
+        if missing and self.dao is not None:
+            try:
+                shared = {doc["_id"]: doc["prediction"] for doc in
+                          self.dao.find_by_keys(list(missing))}
+            except Exception as e:
+                logging.getLogger(__name__).warning(
+                    f"Shared prediction cache is unavailable: {e!r}")
+                shared = {}
+            self._put_local(shared)
+            shared_hits = 0
+            for key, prediction in shared.items():
+                for i in missing.pop(key):
+                    found[i] = prediction
+                    shared_hits += 1
+            with self._lock:
+                self.shared_hits += shared_hits
+
+        with self._lock:
+            self.misses += sum(len(idx) for idx in missing.values())
+        return found
+
+    def put_many(self, model_id: str, version: Any, texts: List[str],
+                 predictions: List[str]) -> None:
+        if not self.enabled:
+            return
+        entries = {self.key(model_id, version, text): str(prediction)
+                   for text, prediction in zip(texts, predictions)}
+        self._put_local(entries)
+        if self.dao is not None and entries:
+            now = datetime.datetime.utcnow()
+            try:
+                self.dao.bulk_set_by_keys({
+                    key: {"model_id": model_id, "prediction": prediction,
+                          "createdAt": now}
+                    for key, prediction in entries.items()})
+            except Exception as e:
+                logging.getLogger(__name__).warning(
+                    f"Shared prediction cache is unavailable: {e!r}")
+
+    def get(self, model_id: str, version: Any, text: str) -> Optional[str]:
+        return self.get_many(model_id, version, [text]).get(0)
+
+    def put(self, model_id: str, version: Any, text: str,
+            prediction: str) -> None:
+        self.put_many(model_id, version, [text], [prediction])
+
+    def invalidate(self, model_id: str) -> None:
+        prefix = f"{model_id}:"
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+        if self.dao is not None:
+            self.dao.remove_many({"model_id": model_id})
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.shared_hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "shared": self.dao is not None,
+                "items": len(self._entries),
+                "max_items": self.max_items,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.shared_hits) / total
+                if total else 0.0,
+            }
+
+    def _put_local(self, entries: Dict[str, str]) -> None:
+        with self._lock:
+            for key, prediction in entries.items():
+                self._entries[key] = prediction
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._entries.popitem(last=False)
+
+
+# Process-wide caches, configured from `cfg.cache` in api.endpoints
+model_cache = ModelCache()
+prediction_cache = PredictionCache()
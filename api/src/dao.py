@@ -2,8 +2,13 @@ import pymongo
 import bson
 import minio
 from minio.error import S3Error
-from typing import Iterable, Any
+from typing import Dict, Iterable, Iterator, Any, Optional
+from contextlib import contextmanager
 import io
+import os
+import threading
+import urllib3
+from api.src.metrics import DAO_BYTES, dao_call, instrumented
 
 
 class MongoError(Exception):
@@ -11,72 +16,259 @@ class MongoError(Exception):
         super().__init__(message)
 
 
+class VersionConflictError(MongoError):
+    def __init__(self, message):
+        super().__init__(message)
+
+
 class MinioError(Exception):
     def __init__(self, message):
         super().__init__(message)
 
 
 class MongoDAO:
-    def __init__(self, host: str, port: str, db: str, collection: str) -> None:
+    def __init__(self, host: str, port: str, db: str, collection: str,
+                 client: Optional[pymongo.MongoClient] = None) -> None:
         """
         Basic class for data access in MongoDB.
         Args:
-            address (str):  Mongo cluster address.
-                            Example: mongodb://localhost:27017/
+            host (str): Mongo host
+            port (str): Mongo port
             db (str): Database name
             collection (str): Collection to access
+            client (pymongo.MongoClient, optional): shared client to use.
+                Shared clients are not closed on `shutdown`
         """
-        self.address = f"mongodb://{host}/{port}",
-        self.client = pymongo.MongoClient(self.address)
+        self.address = f"mongodb://{host}:{port}/"
+        self._owns_client = client is None
+        self.client = pymongo.MongoClient(self.address) \
+            if client is None else client
         self.db = self.client[db]
         self.collection = self.db[collection]
 
     def with_collection(self, collection: str) -> None:
         self.collection = self.db[collection]
 
+    @instrumented("mongo")
     def find_by_id(self, _id):
         # Exception handling here
         if _id is None:
             return None
         return self.collection.find_one({"_id": bson.ObjectId(_id)})
 
+    @instrumented("mongo")
     def remove_by_id(self, _id: str) -> None:
         self.collection.delete_one({"_id": bson.ObjectId(_id)})
 
-    def _add(self, _id: str, document: dict) -> str:
-        document["_id"] = bson.ObjectId(_id)
-        new_item = self.collection.insert_one(document=document)
-        return str(new_item.inserted_id)
+    @instrumented("mongo")
+    def pop_by_id(self, _id: str) -> Optional[dict]:
+        """ Remove document, returning it
+
+        Returns:
+            dict: removed document, None if there was none
+        """
+        return self.collection.find_one_and_delete(
+            {"_id": bson.ObjectId(_id)})
+
+    @instrumented("mongo")
+    def update_by_id(self, _id: str, fields: dict) -> int:
+        """ Set fields of existing document
 
-    def _update(self, _id: str, new_document: dict):
-        # Handle not found
-        return self.collection.update_one({_id: bson.ObjectId(_id)},
-                                          {"$set": new_document}).upserted_id
+        Returns:
+            int: number of matched documents
+        """
+        return self.collection.update_one({"_id": bson.ObjectId(_id)},
+                                          {"$set": fields}).matched_count
+
+    @instrumented("mongo")
+    def increment_by_id(self, _id: str, field: str, value=1) -> int:
+        return self.collection.update_one({"_id": bson.ObjectId(_id)},
+                                          {"$inc": {field: value}}
+                                          ).matched_count
+
+    @staticmethod
+    def _upsert_op(document: dict, on_insert: Optional[dict]) -> dict:
+        update = {"$set": document}
+        if on_insert:
+            # Same field in both operators is a conflict for Mongo
+            update["$setOnInsert"] = {k: v for k, v in on_insert.items()
+                                      if k not in document}
+        return update
+
+    @instrumented("mongo")
+    def upsert(self, _id: str, document: dict,
+               on_insert: Optional[dict] = None) -> Optional[str]:
+        """ Insert or update document in a single round trip
+
+        Args:
+            _id (str): document ID
+            document (dict): fields to set
+            on_insert (dict, optional): fields to set only if document
+                is created, e.g. `createdTimeS`
+
+        Returns:
+            str: document ID, None if write was not acknowledged
+        """
+        result = self.collection.update_one(
+            {"_id": bson.ObjectId(_id)},
+            self._upsert_op(document, on_insert), upsert=True)
+        return str(_id) if result.acknowledged else None
+
+    @instrumented("mongo")
+    def upsert_previous(self, _id: str, document: dict,
+                        on_insert: Optional[dict] = None,
+                        expected: Optional[dict] = None) -> Optional[dict]:
+        """ Same as `upsert`, but atomically returns document before update
+
+        Args:
+            expected (dict, optional): conditions stored document must
+                match, e.g. its version. It is then only updated, not created
+
+        Returns:
+            dict: previous document, None if document is created
+                (or doesn't match `expected`)
+        """
+        return self.collection.find_one_and_update(
+            {"_id": bson.ObjectId(_id), **(expected or {})},
+            self._upsert_op(document, on_insert), upsert=expected is None,
+            return_document=pymongo.ReturnDocument.BEFORE)
+
+    @instrumented("mongo")
+    def bulk_upsert(self, documents: Dict[str, dict],
+                    on_insert: Optional[dict] = None) -> dict:
+        """ Upsert many documents in a single round trip
+
+        Args:
+            documents (Dict[str, dict]): document ID to fields to set
+            on_insert (dict, optional): fields to set only on insert
+
+        Returns:
+            dict: numbers of inserted, matched and modified documents
+        """
+        if not documents:
+            return {"upserted": 0, "matched": 0, "modified": 0}
+        result = self.collection.bulk_write(
+            [pymongo.UpdateOne({"_id": bson.ObjectId(_id)},
+                               self._upsert_op(document, on_insert),
+                               upsert=True)
+             for _id, document in documents.items()],
+            ordered=False)
+        return {"upserted": result.upserted_count,
+                "matched": result.matched_count,
+                "modified": result.modified_count}
 
-    # Я в курсе, что монга сама умеет в upsert, но не хочу
-    def upsert(self, _id: str, document: dict):
-        if self.find_by_id(_id) is None:
-            return self._add(_id, document)
-        return self._update(_id, document)
+    @instrumented("mongo")
+    def find_by_keys(self, keys: Iterable[str]):
+        """ Find documents with string (not ObjectId) `_id`s """
+        return self.collection.find({"_id": {"$in": list(keys)}})
+
+    @instrumented("mongo")
+    def bulk_set_by_keys(self, documents: Dict[str, dict]) -> None:
+        """ Upsert documents with string (not ObjectId) `_id`s """
+        if not documents:
+            return
+        self.collection.bulk_write(
+            [pymongo.UpdateOne({"_id": key}, {"$set": document},
+                               upsert=True)
+             for key, document in documents.items()],
+            ordered=False)
+
+    @instrumented("mongo")
+    def increment_by_key(self, key: str, field: str, value=1,
+                         upsert: bool = True,
+                         on_insert: Optional[dict] = None,
+                         filter: Optional[dict] = None) -> Optional[int]:
+        """ Atomically add to field of document with string `_id`
+
+        Args:
+            filter (dict, optional): more conditions document must match
+
+        Returns:
+            int: new value, None if there is no matching document and
+                it is not created (no upsert, or document with the same
+                `_id` doesn't match `filter`)
+        """
+        update: dict = {"$inc": {field: value}}
+        if on_insert:
+            update["$setOnInsert"] = on_insert
+        try:
+            doc = self.collection.find_one_and_update(
+                {"_id": key, **(filter or {})}, update, upsert=upsert,
+                return_document=pymongo.ReturnDocument.AFTER)
+        except pymongo.errors.DuplicateKeyError:
+            return None
+        return None if doc is None else doc.get(field)
+
+    @instrumented("mongo")
+    def update_by_key(self, key: str, fields: dict,
+                      filter: Optional[dict] = None) -> int:
+        """ Set fields of existing document with string `_id`
+
+        Returns:
+            int: number of matched documents
+        """
+        return self.collection.update_one({"_id": key, **(filter or {})},
+                                          {"$set": fields}).matched_count
+
+    @instrumented("mongo")
+    def remove_many(self, filter: dict) -> int:
+        return self.collection.delete_many(filter).deleted_count
 
     def shutdown(self):
-        self.client.close()
+        if self._owns_client:
+            self.client.close()
 
-    def list_documents(self, limit=100):
-        return self.collection.find(limit=limit)
+    def ensure_indexes(self, indexes: list) -> None:
+        """ Create indexes if missing
+
+        Args:
+            indexes (list): list of index keys, e.g. [[("field", -1)], ...]
+        """
+        for keys in indexes:
+            self.collection.create_index(keys)
+
+    def ensure_ttl_index(self, field: str, expire_after_s: int) -> None:
+        """ Make Mongo remove documents `expire_after_s` after `field` date """
+        self.collection.create_index(field, expireAfterSeconds=expire_after_s)
+
+    @instrumented("mongo")
+    def list_documents(self, limit=100, filter=None, sort=None,
+                       projection=None):
+        return self.collection.find(filter=filter, projection=projection,
+                                    sort=sort, limit=limit)
 
 
 class MinioDAO:
-    def __init__(self, host: str, user: str, password: str,
-                 port: str, bucket: str) -> None:
+    # Buckets known to exist, so we pay `bucket_exists` once per process
+    _known_buckets: set = set()
 
+    def __init__(self, host: str, user: str, password: str,
+                 port: str, bucket: str,
+                 client: Optional[minio.Minio] = None,
+                 part_size: int = 0,
+                 num_parallel_uploads: int = 3) -> None:
+        """
+        Basic class for data access in MinIO.
+        Args:
+            part_size (int): multipart upload part size, 0 means auto
+            num_parallel_uploads (int): parts uploaded in parallel
+        """
         self.host = host
+        self.part_size = part_size
+        self.num_parallel_uploads = num_parallel_uploads
         self.client = minio.Minio(f"{host}:{port}",
                                   access_key=user, secret_key=password,
-                                  secure=False)
+                                  secure=False) if client is None else client
+        self.port = port
+        self.ensure_bucket(bucket)
+
+    def ensure_bucket(self, bucket: str) -> None:
+        key = (self.host, self.port, bucket)
+        if key in MinioDAO._known_buckets:
+            return
         if not self.client.bucket_exists(bucket_name=bucket):
             self.client.make_bucket(bucket_name=bucket)
-        self.port = port
+        MinioDAO._known_buckets.add(key)
 
     def list_bucket_items(self, bucket: str) -> Iterable[Any]:
         try:
@@ -84,36 +276,237 @@ class MinioDAO:
         except S3Error as e:
             raise e
 
+    @instrumented("minio")
     def save_to_bucket(self, bucket: str, path_in_bucket: str,
                        path_to_save_from: str):
-        return self.client.fput_object(bucket_name=bucket,
-                                       object_name=path_in_bucket,
-                                       file_path=path_to_save_from)
+        DAO_BYTES.inc(os.path.getsize(path_to_save_from),
+                      dao="minio", direction="out")
+        return self.client.fput_object(
+            bucket_name=bucket,
+            object_name=path_in_bucket,
+            file_path=path_to_save_from,
+            part_size=self.part_size,
+            num_parallel_uploads=self.num_parallel_uploads)
 
+    @instrumented("minio")
     def remove_from_bucket(self, bucket: str, path_in_bucket: str) -> None:
         self.client.remove_object(bucket_name=bucket,
                                   object_name=path_in_bucket)
 
+    @contextmanager
+    def get_stream(self, bucket: str, path_in_bucket: str,
+                   offset: int = 0, length: int = 0):
+        """ File-like stream of object (or its range), nothing is buffered
+
+        Usage:
+            with dao.get_stream(bucket, path) as stream:
+                pd.read_csv(stream)
+
+        Args:
+            offset (int): start of range in bytes
+            length (int): length of range in bytes, 0 means till the end
+        """
+        with dao_call("minio", "get_stream"):
+            response = self.client.get_object(bucket_name=bucket,
+                                              object_name=path_in_bucket,
+                                              offset=offset, length=length)
+        DAO_BYTES.inc(int(response.headers.get("Content-Length", 0)),
+                      dao="minio", direction="in")
+        try:
+            yield response
+        finally:
+            response.close()
+            response.release_conn()
+
+    def iter_chunks(self, bucket: str, path_in_bucket: str,
+                    chunk_size: int = 1024 * 1024) -> Iterator[bytes]:
+        with self.get_stream(bucket, path_in_bucket) as response:
+            yield from response.stream(chunk_size)
+
+    def get_range(self, bucket: str, path_in_bucket: str,
+                  offset: int, length: int) -> bytes:
+        with self.get_stream(bucket, path_in_bucket,
+                             offset, length) as response:
+            return response.read()
+
     def get_from_bucket(self, bucket: str, path_in_bucket: str):
-        response = None
+        """ Whole object in memory. Prefer `get_stream` or `download`
+        for big objects """
         try:
-            response = self.client.get_object(bucket_name=bucket,
-                                              object_name=path_in_bucket)
-            data = io.BytesIO()
-            data.write(response.read())
+            with self.get_stream(bucket, path_in_bucket) as response:
+                data = io.BytesIO()
+                for chunk in response.stream(1024 * 1024):
+                    data.write(chunk)
             data.seek(0)
             return data
         except S3Error as e:
             if e.code == "NoSuchKey":
-                response = None
-            else:
-                raise e
-        finally:
-            if response is not None:
-                response.close()
-                response.release_conn()
+                return None
+            raise e
+
+    @instrumented("minio")
+    def download(self, bucket: str, path_in_bucket: str,
+                 path_to_save_to: str) -> None:
+        self.client.fget_object(bucket_name=bucket,
+                                object_name=path_in_bucket,
+                                file_path=path_to_save_to)
+        DAO_BYTES.inc(os.path.getsize(path_to_save_to),
+                      dao="minio", direction="in")
+
+    @instrumented("minio")
+    def stat(self, bucket: str, path_in_bucket: str):
+        """ Object metadata (etag, size, ...) or None if there is no object """
+        try:
+            return self.client.stat_object(bucket_name=bucket,
+                                           object_name=path_in_bucket)
+        except S3Error as e:
+            if e.code == "NoSuchKey":
+                return None
+            raise e
+
+    def exists(self, bucket: str, path_in_bucket: str) -> bool:
+        return self.stat(bucket, path_in_bucket) is not None
 
     def get_full_path(self, bucket: str, path_in_bucket: str):
-        if self.get_from_bucket(bucket, path_in_bucket) is None:
+        if not self.exists(bucket, path_in_bucket):
             raise MinioError(f"Not found {bucket}/{path_in_bucket}")
         return f"{self.host}/{self.port}/{bucket}/{path_in_bucket}"
+
+
+# Process-wide clients. pymongo and urllib3 pools are not fork-safe,
+# so clients inherited from the parent process are dropped and recreated.
+_shared_lock = threading.RLock()
+_shared_pid: Optional[int] = None
+_shared_clients: dict = {}
+
+
+def _shared_client(name: str, factory):
+    global _shared_pid
+    with _shared_lock:
+        if _shared_pid != os.getpid():
+            _shared_clients.clear()
+            MinioDAO._known_buckets.clear()
+            _shared_pid = os.getpid()
+        if name not in _shared_clients:
+            _shared_clients[name] = factory()
+        return _shared_clients[name]
+
+
+def get_mongo_dao(cfg, collection: Optional[str] = None) -> MongoDAO:
+    """ MongoDAO on top of process-wide pooled client
+
+    Args:
+        cfg (DictConfig): common config
+        collection (str, optional): collection name.
+            Defaults to `cfg.mongo.models_collection`
+    """
+    mongo_cfg = cfg.mongo
+    client = _shared_client("mongo", lambda: pymongo.MongoClient(
+        f"mongodb://{mongo_cfg.host}:{mongo_cfg.port}/",
+        maxPoolSize=mongo_cfg.get("max_pool_size", 100),
+        connect=False))
+    return MongoDAO(mongo_cfg.host, mongo_cfg.port, mongo_cfg.dbname,
+                    collection or mongo_cfg.models_collection, client=client)
+
+
+class AsyncMongoDAO:
+    def __init__(self, collection) -> None:
+        """ Reads of the async serving path over Motor collection """
+        self.collection = collection
+
+    async def find_by_id(self, _id):
+        if _id is None:
+            return None
+        with dao_call("mongo", "find_by_id"):
+            return await self.collection.find_one({"_id": bson.ObjectId(_id)})
+
+
+def get_async_mongo_dao(cfg,
+                        collection: Optional[str] = None) -> AsyncMongoDAO:
+    """ AsyncMongoDAO on top of process-wide Motor client
+
+    Motor is needed only by `asgi_app.py`, so it is imported here.
+    """
+    mongo_cfg = cfg.mongo
+
+    def factory():
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(
+            f"mongodb://{mongo_cfg.host}:{mongo_cfg.port}/",
+            maxPoolSize=mongo_cfg.get("max_pool_size", 100))
+
+    client = _shared_client("motor", factory)
+    return AsyncMongoDAO(client[mongo_cfg.dbname][
+        collection or mongo_cfg.models_collection])
+
+
+def get_minio_dao(cfg, bucket: str) -> MinioDAO:
+    """ MinioDAO on top of process-wide pooled client
+
+    Args:
+        cfg (DictConfig): common config
+        bucket (str): bucket to make sure exists
+    """
+    minio_cfg = cfg.minio
+
+    def factory():
+        http_client = _shared_client("minio_http", lambda: urllib3.PoolManager(
+            timeout=urllib3.Timeout(connect=minio_cfg.get("connect_timeout", 5),
+                                    read=minio_cfg.get("read_timeout", 300)),
+            maxsize=minio_cfg.get("pool_size", 10),
+            retries=urllib3.Retry(total=3, backoff_factor=0.2,
+                                  status_forcelist=[500, 502, 503, 504])))
+        return minio.Minio(f"{minio_cfg.host}:{minio_cfg.server_port}",
+                           access_key=minio_cfg.root_user,
+                           secret_key=minio_cfg.root_password,
+                           secure=False, http_client=http_client)
+
+    client = _shared_client("minio", factory)
+    return MinioDAO(host=minio_cfg.host, port=minio_cfg.server_port,
+                    user=minio_cfg.root_user,
+                    password=minio_cfg.root_password,
+                    bucket=bucket, client=client,
+                    part_size=minio_cfg.get("upload_part_size", 0),
+                    num_parallel_uploads=minio_cfg.get("upload_parallelism",
+                                                       3))
+
+
+# Indexes backing model listing (keyset pagination, filters) and warm-up
+MODEL_INDEXES = [
+    [("createdTimeS", pymongo.DESCENDING), ("_id", pymongo.DESCENDING)],
+    [("model_type", pymongo.ASCENDING), ("createdTimeS", pymongo.DESCENDING),
+     ("_id", pymongo.DESCENDING)],
+    [("test_score.accuracy", pymongo.DESCENDING)],
+    [("train_score.accuracy", pymongo.DESCENDING)],
+    [("updatedTimeS", pymongo.DESCENDING)],
+    [("predictCount", pymongo.DESCENDING)],
+]
+
+
+def init_daos(cfg) -> None:
+    """ Create shared clients and make sure buckets exist (e.g. post fork) """
+    get_mongo_dao(cfg).ensure_indexes(MODEL_INDEXES)
+    predictions_cfg = cfg.cache.predictions
+    if predictions_cfg.enabled and predictions_cfg.shared:
+        dao = get_mongo_dao(cfg, cfg.mongo.prediction_cache_collection)
+        dao.ensure_indexes([[("model_id", pymongo.ASCENDING)]])
+        dao.ensure_ttl_index("createdAt", predictions_cfg.ttl_s)
+    get_minio_dao(cfg, cfg.minio.models_bucket)
+    get_minio_dao(cfg, cfg.minio.datasets_bucket)
+
+
+def shutdown_daos() -> None:
+    """ Close shared clients of this process """
+    with _shared_lock:
+        if _shared_pid != os.getpid():
+            _shared_clients.clear()
+            return
+        for name in ("mongo", "motor"):
+            mongo_client = _shared_clients.pop(name, None)
+            if mongo_client is not None:
+                mongo_client.close()
+        _shared_clients.pop("minio", None)
+        http_client = _shared_clients.pop("minio_http", None)
+        if http_client is not None:
+            http_client.clear()
+        MinioDAO._known_buckets.clear()
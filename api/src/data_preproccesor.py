@@ -1,37 +1,125 @@
 # Here you can find anything related to data downloading and processing
-import gdown  # Don't know better way to download dataset
-from typing import List
+from typing import Iterator, List, Optional, Tuple
 import zipfile
 import logging
 import pandas as pd
-from sklearn.model_selection import train_test_split
 from omegaconf import DictConfig
 from hydra.utils import to_absolute_path
 import os
+import shutil
+import tempfile
+from contextlib import contextmanager
 import numpy as np
-from api.src.dao import MinioDAO
+from api.src.dao import get_minio_dao
 from typing import AnyStr
 
 
-def get_train_test_data(cfg: DictConfig) -> List[np.ndarray]:
-    minio_dao = MinioDAO(cfg.minio.host, cfg.minio.root_user,
-                         cfg.minio.root_password, cfg.minio.server_port,
-                         cfg.minio.datasets_bucket)
+def ensure_dataset(cfg: DictConfig, minio_dao=None) -> str:
+    """ Make sure dataset is uploaded to MinIO
 
-    data = minio_dao.get_from_bucket(cfg.minio.datasets_bucket,
-                                     cfg.dataset.minio_path)
-    if data is None:
+    Args:
+        cfg (DictConfig): common config
+        minio_dao (MinioDAO, optional): DAO to use
+
+    Returns:
+        str: ETag of dataset object, i.e. its version
+    """
+    if minio_dao is None:
+        minio_dao = get_minio_dao(cfg, cfg.minio.datasets_bucket)
+    stat = minio_dao.stat(cfg.minio.datasets_bucket, cfg.dataset.minio_path)
+    if stat is None:
         out_path = to_absolute_path(cfg.dataset.out_path)
         if not os.path.exists(out_path):
             loader = DataLoader(cfg)
             loader.download()
         minio_dao.save_to_bucket(cfg.minio.datasets_bucket,
                                  cfg.dataset.minio_path, out_path)
+        stat = minio_dao.stat(cfg.minio.datasets_bucket,
+                              cfg.dataset.minio_path)
+    return stat.etag.strip('"')
+
+
+def get_dataset(cfg: DictConfig) -> Tuple[np.ndarray, np.ndarray, str]:
+    """ Get preprocessed texts and targets, parsing CSV only once per version
+
+    Args:
+        cfg (DictConfig): common config
+
+    Returns:
+        (np.ndarray, np.ndarray, str): texts, targets and dataset version
+    """
+    minio_dao = get_minio_dao(cfg, cfg.minio.datasets_bucket)
+    etag = ensure_dataset(cfg, minio_dao)
+
+    cache = DatasetCache(to_absolute_path(cfg.dataset.cache_dir))
+    data = cache.load(etag)
+    if data is None:
+        with minio_dao.get_stream(cfg.minio.datasets_bucket,
+                                  cfg.dataset.minio_path) as s3_obj:
+            preprocessor = TrainDataPreprocessor(obj=s3_obj)
+            data = preprocessor.prepare_columns()
+        cache.save(etag, *data)
+    return data[0], data[1], etag
+
+
+def get_train_test_data(cfg: DictConfig) -> List[np.ndarray]:
+    from sklearn.model_selection import train_test_split
+    texts, target, _ = get_dataset(cfg)
+    return train_test_split(texts, target,
+                            train_size=cfg.dataset.train_size,
+                            random_state=cfg.dataset.seed)  # type:ignore
+
+
+def stable_test_mask(ids: pd.Index, test_size: float,
+                     seed: int = 0) -> np.ndarray:
+    """ Whether row goes to test split, by stable hash of its ID
+
+    Unlike random split, assignment doesn't depend on row order, chunking
+    or dataset size, so it is the same for every pass and every run.
+
+    Args:
+        ids (pd.Index): row IDs
+        test_size (float): share of rows to put into test split
+        seed (int): changes assignment of all rows
+
+    Returns:
+        np.ndarray: boolean mask of test rows
+    """
+    hashes = pd.util.hash_pandas_object(
+        pd.Series(ids, dtype=object), index=False,
+        hash_key=f"{seed % 10 ** 16:016d}").to_numpy()
+    return (hashes % 1000000) < test_size * 1000000
+
+
+@contextmanager
+def dataset_chunks(cfg: DictConfig, chunk_size: Optional[int] = None):
+    """ Prepared dataset frames streamed from MinIO chunk by chunk
+
+    Usage:
+        with dataset_chunks(cfg) as chunks:
+            for df in chunks:
+                ...
+    """
+    minio_dao = get_minio_dao(cfg, cfg.minio.datasets_bucket)
+    ensure_dataset(cfg, minio_dao)
+    with minio_dao.get_stream(cfg.minio.datasets_bucket,
+                              cfg.dataset.minio_path) as s3_obj:
+        yield TrainDataPreprocessor(obj=s3_obj).iter_frames(
+            chunk_size or cfg.dataset.chunk_size)
 
-    s3_obj = minio_dao.get_from_bucket(cfg.minio.datasets_bucket,
-                                       cfg.dataset.minio_path)
-    preprocessor = TrainDataPreprocessor(obj=s3_obj)
-    return preprocessor.prepare_data(cfg.dataset.train_size, cfg.dataset.seed)
+
+def dataset_classes(cfg: DictConfig) -> np.ndarray:
+    """ All labels of dataset, reading only the target column """
+    minio_dao = get_minio_dao(cfg, cfg.minio.datasets_bucket)
+    ensure_dataset(cfg, minio_dao)
+    classes: set = set()
+    with minio_dao.get_stream(cfg.minio.datasets_bucket,
+                              cfg.dataset.minio_path) as s3_obj:
+        with pd.read_csv(s3_obj, usecols=["Category"],
+                         chunksize=cfg.dataset.chunk_size) as reader:
+            for df in reader:
+                classes.update(df["Category"].unique().tolist())
+    return np.array(sorted(classes))
 
 
 class DataLoader():
@@ -52,6 +140,7 @@ class DataLoader():
         if not os.path.exists(out_dir):
             os.mkdir(out_dir)
 
+        import gdown  # Don't know better way to download dataset
         try:
             if self.cfg.dataset.is_zip:
                 path = to_absolute_path(self.cfg.dataset.zip_path)
@@ -102,7 +191,30 @@ class TrainDataPreprocessor():
     def prepare_data(self,
                      train_size: float = 0.75,
                      seed=0XDEAD) -> List[np.ndarray]:
+        from sklearn.model_selection import train_test_split
+        df = self.prepare_frame()
+        return train_test_split(df[['title&description']],
+                                df['Category'],
+                                train_size=train_size,
+                                random_state=seed)  # type:ignore
 
+    def prepare_columns(self) -> Tuple[np.ndarray, np.ndarray]:
+        """ Get texts and targets as plain numpy arrays """
+        df = self.prepare_frame()
+        return (df['title&description'].to_numpy(dtype=object),
+                df['Category'].to_numpy())
+
+    def prepare_frame(self) -> pd.DataFrame:
+        return self._prepare(self._read_csv())
+
+    def iter_frames(self, chunk_size: int) -> Iterator[pd.DataFrame]:
+        """ Prepared frames of at most `chunk_size` rows, memory is bounded
+        by chunk size, not by dataset size """
+        with self._read_csv(chunksize=chunk_size) as reader:
+            for df in reader:
+                yield self._prepare(df)
+
+    def _read_csv(self, **kwargs):
         if (self.path is None and self.obj is None):
             raise ValueError("No path or object is be provided")
         if self.path is None and self.obj is None:
@@ -110,12 +222,14 @@ class TrainDataPreprocessor():
 
         f_in = self.path if self.path else self.obj
         try:
-            df = pd.read_csv(f_in, index_col=0)  # type:ignore
+            return pd.read_csv(f_in, index_col=0, **kwargs)  # type:ignore
         except Exception as e:
             raise Exception(f"F_in type is {str(type(f_in))}. \
                             Original message: " +
                             getattr(e, "message", repr(e)))
 
+    @staticmethod
+    def _prepare(df: pd.DataFrame) -> pd.DataFrame:
         df.fillna("", inplace=True)
 
         if "title" not in df.keys():
@@ -129,8 +243,55 @@ class TrainDataPreprocessor():
 
         df['title&description'] = df['title'].str[:] + \
             ' \\\n' + df['description'].str[:]
+        return df
 
-        return train_test_split(df[['title&description']],
-                                df['Category'],
-                                train_size=train_size,
-                                random_state=seed)  # type:ignore
+
+class DatasetCache():
+    # Texts are stored as one NUL-separated UTF-8 blob: splitting it back
+    # is a single C-level call, unlike parsing CSV or unpickling strings
+    SEP = "\x00"
+
+    def __init__(self, cache_dir: str) -> None:
+        """ Local cache of preprocessed datasets keyed by MinIO ETag
+
+        Args:
+            cache_dir (str): directory to keep datasets in
+        """
+        self.cache_dir = cache_dir
+
+    def _dir(self, etag: str) -> str:
+        return os.path.join(self.cache_dir, etag)
+
+    def load(self, etag: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        path = self._dir(etag)
+        if not os.path.exists(os.path.join(path, "codes.npy")):
+            return None
+        classes = np.load(os.path.join(path, "classes.npy"))
+        codes = np.load(os.path.join(path, "codes.npy"))
+        blob = np.load(os.path.join(path, "texts.npy"))
+        texts = np.array(blob.tobytes().decode("utf-8").split(self.SEP)
+                         if len(codes) else [], dtype=object)
+        return texts, classes[codes]
+
+    def save(self, etag: str, texts: np.ndarray, target: np.ndarray) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir)
+        try:
+            blob = self.SEP.join(str(t).replace(self.SEP, "")
+                                 for t in texts).encode("utf-8")
+            np.save(os.path.join(tmp_dir, "texts.npy"),
+                    np.frombuffer(blob, dtype=np.uint8))
+            if target.dtype == object:
+                target = target.astype(str)
+            classes, codes = np.unique(target, return_inverse=True)
+            np.save(os.path.join(tmp_dir, "classes.npy"), classes)
+            np.save(os.path.join(tmp_dir, "codes.npy"),
+                    codes.astype(np.int32))
+            # Entry becomes visible only when fully written
+            os.replace(tmp_dir, self._dir(etag))
+        except OSError:
+            # Concurrent trainings may have already cached this version
+            if self.load(etag) is None:
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,154 @@
+# Predicting with several models at once: shared transforms and aggregation
+import hashlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+AGGREGATES = ("vote", "average", "split")
+
+
+def vectorizer_fingerprint(pipeline) -> str:
+    """ Hash of fitted vectorizer, models with equal ones share features
+
+    Covers vectorizer class, params and fitted state (vocabulary, idf_),
+    so two fits on the same data with the same config match.
+
+    Args:
+        pipeline (sklearn.pipeline.Pipeline): fitted pipeline
+
+    Returns:
+        str: hex digest
+    """
+    vectorizer = pipeline.steps[0][1]
+    digest = hashlib.sha1()
+    digest.update(type(vectorizer).__name__.encode())
+    digest.update(repr(sorted(vectorizer.get_params().items())).encode())
+    vocabulary = getattr(vectorizer, "vocabulary_", None)
+    if vocabulary is not None:
+        digest.update("\n".join(sorted(vocabulary,
+                                       key=vocabulary.get)).encode())
+    if getattr(vectorizer, "use_idf", False):
+        digest.update(np.ascontiguousarray(vectorizer.idf_).tobytes())
+    return digest.hexdigest()
+
+
+def predict_shared(trainers: Dict[str, object], fingerprints: Dict[str, str],
+                   texts: Sequence[str], with_scores: bool = False,
+                   assigned: Optional[Sequence[str]] = None) -> tuple:
+    """ Predict with every model, vectorizing texts once per fingerprint
+
+    Args:
+        trainers (Dict[str, ModelTrainer]): model ID to trainer
+        fingerprints (Dict[str, str]): model ID to vectorizer fingerprint,
+            models without one get their own transform
+        texts (Sequence[str]): texts to predict for
+        with_scores (bool): whether to return scores as well
+        assigned (Sequence[str], optional): model ID per text, if given
+            every model predicts its assigned texts only
+
+    Returns:
+        (dict, int): model ID to (predictions, scores or None) and
+            number of transforms made
+    """
+    data = np.array(texts, dtype=object)
+    groups: "OrderedDict[str, List[str]]" = OrderedDict()
+    for _id in trainers:
+        groups.setdefault(fingerprints.get(_id) or _id, []).append(_id)
+
+    results: dict = {}
+    for ids in groups.values():
+        if assigned is None:
+            features = trainers[ids[0]].transform(data)
+            rows = {_id: slice(None) for _id in ids}
+        else:
+            # Transform the texts of the group once, then take model rows
+            owner = np.asarray(assigned, dtype=object)
+            group = np.flatnonzero(np.isin(owner, ids))
+            features = trainers[ids[0]].transform(data[group])
+            rows = {_id: np.flatnonzero(owner[group] == _id) for _id in ids}
+        for _id in ids:
+            trainer = trainers[_id]
+            model_features = features[rows[_id]]
+            results[_id] = (trainer.predict_features(model_features),
+                            trainer.scores_features(model_features)
+                            if with_scores else None)
+    return results, len(groups)
+
+
+def scatter(assigned: Sequence[str], values: Dict[str, Sequence]) -> list:
+    """ Per text values from per model ones, in the order of texts
+
+    Args:
+        assigned (Sequence[str]): model ID per text
+        values (Dict[str, Sequence]): model ID to values for its texts
+
+    Returns:
+        list: value per text
+    """
+    remaining = {_id: iter(model_values)
+                 for _id, model_values in values.items()}
+    return [next(remaining[_id]) for _id in assigned]
+
+
+def vote(predictions: List[Sequence], weights: Sequence[float]) -> list:
+    """ Weighted majority of labels per text, ties go to earlier models """
+    voted = []
+    for labels in zip(*predictions):
+        totals: "OrderedDict[str, float]" = OrderedDict()
+        for label, weight in zip(labels, weights):
+            totals[label] = totals.get(label, 0.0) + weight
+        voted.append(max(totals, key=totals.get))  # type: ignore
+    return voted
+
+
+def score_matrix(scores: np.ndarray) -> np.ndarray:
+    """ Scores with column per class, binary decision_function expanded """
+    scores = np.asarray(scores, dtype=float)
+    if scores.ndim == 1:
+        return np.stack([-scores, scores], axis=1)
+    return scores
+
+
+def average(classes: List[Sequence], scores: List[np.ndarray],
+            weights: Sequence[float]) -> tuple:
+    """ Weighted mean of model scores aligned by class labels
+
+    Scores are used as models return them, so mix models with comparable
+    scores, e.g. of the same type.
+
+    Returns:
+        (list, list, np.ndarray): predictions, classes and mean scores
+    """
+    labels = list(OrderedDict.fromkeys(str(c) for cs in classes for c in cs))
+    column = {label: i for i, label in enumerate(labels)}
+    total = None
+    for model_classes, model_scores, weight in zip(classes, scores, weights):
+        matrix = score_matrix(model_scores)
+        aligned = np.zeros((matrix.shape[0], len(labels)))
+        aligned[:, [column[str(c)] for c in model_classes]] = matrix
+        aligned *= weight
+        total = aligned if total is None else total + aligned
+    mean = total / float(sum(weights))  # type: ignore
+    return [labels[i] for i in mean.argmax(axis=1)], labels, mean
+
+
+def split(texts: Sequence[str], model_ids: Sequence[str],
+          weights: Sequence[float], salt: str = "") -> list:
+    """ Model serving every text in traffic split, stable for the same text
+
+    Args:
+        salt (str): e.g. ensemble name, to split differently per ensemble
+
+    Returns:
+        list: model ID per text
+    """
+    bounds = np.cumsum(np.asarray(weights, dtype=float))
+    assigned = []
+    for text in texts:
+        digest = hashlib.sha1(f"{salt}:{text}".encode("utf-8")).digest()
+        point = int.from_bytes(digest[:8], "big") / 2 ** 64 * bounds[-1]
+        assigned.append(model_ids[min(int(np.searchsorted(bounds, point,
+                                                          side="right")),
+                                      len(model_ids) - 1)])
+    return assigned
@@ -0,0 +1,71 @@
+# Classification metrics from confusion matrices, compact to store with model
+from typing import Sequence
+
+import numpy as np
+
+
+def confusion(y_true: Sequence, y_pred: Sequence,
+              labels: np.ndarray) -> np.ndarray:
+    """ Confusion matrix, rows are true labels and columns predicted ones
+
+    Args:
+        labels (np.ndarray): sorted labels, including all true and predicted
+
+    Returns:
+        np.ndarray: int64 matrix of shape (len(labels), len(labels))
+    """
+    n = len(labels)
+    true_idx = np.searchsorted(labels, np.asarray(y_true))
+    pred_idx = np.searchsorted(labels, np.asarray(y_pred))
+    return np.bincount(true_idx * n + pred_idx,
+                       minlength=n * n).reshape(n, n)
+
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    return np.divide(numerator, denominator, dtype=float,
+                     out=np.zeros(len(numerator)), where=denominator > 0)
+
+
+def report(matrix: np.ndarray, labels: Sequence,
+           predict_s: float = 0.0) -> dict:
+    """ Accuracy, per-class precision/recall/F1 and throughput
+
+    Per-class values are lists aligned with "classes", so a report of
+    a few dozen classes takes a few KB of Mongo document.
+
+    Args:
+        matrix (np.ndarray): confusion matrix (see `confusion`)
+        labels (Sequence): labels of matrix rows and columns
+        predict_s (float): time spent predicting the rows
+
+    Returns:
+        dict: metrics, "accuracy" is kept for filters and indexes
+    """
+    hits = np.diag(matrix)
+    support = matrix.sum(axis=1)
+    predicted = matrix.sum(axis=0)
+    rows = int(support.sum())
+    precision = _ratio(hits, predicted)
+    recall = _ratio(hits, support)
+    f1 = _ratio(2 * precision * recall, precision + recall)
+    return {
+        "accuracy": float(hits.sum() / max(rows, 1)),
+        "macro_f1": float(f1.mean()) if len(f1) else 0.0,
+        "weighted_f1": float(f1 @ support / max(rows, 1)),
+        "rows": rows,
+        "rows_per_s": rows / predict_s if predict_s > 0 else None,
+        "classes": [str(label) for label in labels],
+        "precision": precision.tolist(),
+        "recall": recall.tolist(),
+        "f1": f1.tolist(),
+        "support": support.tolist(),
+        "confusion": matrix.tolist(),
+    }
+
+
+def evaluate(y_true: Sequence, y_pred: Sequence, classes: Sequence,
+             predict_s: float = 0.0) -> dict:
+    """ Report of predictions, labels are model classes and true ones """
+    y_true = np.asarray(y_true)
+    labels = np.union1d(np.asarray(classes), y_true)
+    return report(confusion(y_true, y_pred, labels), labels, predict_s)
@@ -0,0 +1,171 @@
+# Fitted vectorizers and TF-IDF matrices shared across model trainings
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+import joblib
+import numpy as np
+import scipy.sparse as sp
+from hydra.utils import instantiate, to_absolute_path
+from omegaconf import DictConfig, OmegaConf
+
+from api.src.dao import get_minio_dao
+from api.src.data_preproccesor import ensure_dataset, get_dataset
+
+
+class Features(NamedTuple):
+    key: str
+    vectorizer: object
+    X_train: sp.csr_matrix
+    X_test: sp.csr_matrix
+    y_train: np.ndarray
+    y_test: np.ndarray
+
+
+class FeatureStore():
+    FILES = ("vectorizer.joblib", "X_train.npz", "X_test.npz",
+             "y_train.npy", "y_test.npy")
+
+    # Last computed features are kept in memory by all stores of the process
+    _memo: "OrderedDict[str, Features]" = OrderedDict()
+    _memo_lock = threading.Lock()
+
+    def __init__(self, cfg: DictConfig) -> None:
+        """ Store of fitted vectorizers and their train/test matrices
+
+        Features are keyed by vectorizer config, dataset version (ETag)
+        and split settings, so trainings which differ only in classifier
+        params reuse the same fitted TF-IDF.
+        Levels: process memory -> local disk -> MinIO -> compute.
+
+        Args:
+            cfg (DictConfig): common config
+        """
+        self.cfg = cfg
+        self.bucket = cfg.minio.datasets_bucket
+        self.prefix = cfg.dataset.get("features_path", "features/")
+        self.cache_dir = os.path.join(
+            to_absolute_path(cfg.dataset.cache_dir), "features")
+        self.memory_items = cfg.dataset.get("features_memory_items", 1)
+
+    def key(self, vectorizer_cfg: DictConfig, dataset_version: str) -> str:
+        spec = {
+            "vectorizer": OmegaConf.to_container(vectorizer_cfg, resolve=True)
+            if isinstance(vectorizer_cfg, DictConfig) else vectorizer_cfg,
+            "dataset": dataset_version,
+            "train_size": self.cfg.dataset.train_size,
+            "seed": self.cfg.dataset.seed,
+        }
+        return hashlib.sha1(json.dumps(spec, sort_keys=True).encode()
+                            ).hexdigest()
+
+    def get(self, vectorizer_cfg: DictConfig, timer=None) -> Features:
+        """ Get (or fit and store) features for vectorizer config
+
+        Args:
+            vectorizer_cfg (DictConfig): hydra config of vectorizer
+            timer (StageTimer, optional): timer to collect durations of
+                download/parse/split/vectorize stages to
+        """
+        run = timer.run if timer is not None else \
+            (lambda stage, func, *args: func(*args))
+        minio_dao = get_minio_dao(self.cfg, self.bucket)
+        key = self.key(vectorizer_cfg,
+                       run("download", ensure_dataset, self.cfg, minio_dao))
+
+        with self._memo_lock:
+            if key in self._memo:
+                self._memo.move_to_end(key)
+                return self._memo[key]
+
+        local_dir = os.path.join(self.cache_dir, key)
+        if not os.path.exists(local_dir):
+            if not self._download(minio_dao, key, local_dir):
+                self._compute(vectorizer_cfg, key, local_dir, run)
+                self._upload(minio_dao, key, local_dir)
+        features = self._load(key, local_dir)
+
+        with self._memo_lock:
+            self._memo[key] = features
+            while len(self._memo) > self.memory_items:
+                self._memo.popitem(last=False)
+        return features
+
+    def _compute(self, vectorizer_cfg: DictConfig, key: str,
+                 local_dir: str, run) -> None:
+        from sklearn.model_selection import train_test_split
+        # Dataset is parsed while streamed from MinIO
+        texts, target, _ = run("parse", get_dataset, self.cfg)
+        X_train, X_test, y_train, y_test = run(
+            "split", lambda: train_test_split(
+                texts, target,
+                train_size=self.cfg.dataset.train_size,
+                random_state=self.cfg.dataset.seed))
+        vectorizer = instantiate(vectorizer_cfg)
+        X_train = run("vectorize", vectorizer.fit_transform, X_train)
+        X_test = run("vectorize", vectorizer.transform, X_test)
+
+        def write(tmp_dir):
+            joblib.dump(vectorizer, os.path.join(tmp_dir, "vectorizer.joblib"))
+            sp.save_npz(os.path.join(tmp_dir, "X_train.npz"),
+                        sp.csr_matrix(X_train), compressed=False)
+            sp.save_npz(os.path.join(tmp_dir, "X_test.npz"),
+                        sp.csr_matrix(X_test), compressed=False)
+            np.save(os.path.join(tmp_dir, "y_train.npy"), y_train)
+            np.save(os.path.join(tmp_dir, "y_test.npy"), y_test)
+        self._write_atomic(local_dir, write)
+
+    def _download(self, minio_dao, key: str, local_dir: str) -> bool:
+        prefix = f"{self.prefix}{key}/"
+        # vectorizer is uploaded last, so its presence marks complete entry
+        if minio_dao.stat(self.bucket, prefix + self.FILES[0]) is None:
+            return False
+
+        def write(tmp_dir):
+            for name in self.FILES:
+                minio_dao.download(self.bucket, prefix + name,
+                                   os.path.join(tmp_dir, name))
+        self._write_atomic(local_dir, write)
+        return True
+
+    def _upload(self, minio_dao, key: str, local_dir: str) -> None:
+        prefix = f"{self.prefix}{key}/"
+        for name in reversed(self.FILES):
+            minio_dao.save_to_bucket(self.bucket, prefix + name,
+                                     os.path.join(local_dir, name))
+
+    def _load(self, key: str, local_dir: str) -> Features:
+        return Features(
+            key=key,
+            vectorizer=joblib.load(os.path.join(local_dir,
+                                                "vectorizer.joblib")),
+            X_train=sp.load_npz(os.path.join(local_dir, "X_train.npz")),
+            X_test=sp.load_npz(os.path.join(local_dir, "X_test.npz")),
+            y_train=np.load(os.path.join(local_dir, "y_train.npy"),
+                            allow_pickle=True),
+            y_test=np.load(os.path.join(local_dir, "y_test.npy"),
+                           allow_pickle=True),
+        )
+
+    @staticmethod
+    def _write_atomic(local_dir: str, write) -> None:
+        parent = os.path.dirname(local_dir)
+        os.makedirs(parent, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(dir=parent)
+        try:
+            write(tmp_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        try:
+            os.replace(tmp_dir, local_dir)
+        except OSError:
+            # Concurrent trainings may have already stored this entry
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.exists(local_dir):
+                raise
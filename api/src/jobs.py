@@ -0,0 +1,455 @@
+# Background jobs: training runs in a process pool, status lives in Mongo
+import logging
+import multiprocessing
+import threading
+import time
+import traceback
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+from typing import Optional, Set
+
+import bson
+from omegaconf import DictConfig
+
+from api.src.dao import get_mongo_dao
+from api.src.metrics import STAGE_SECONDS
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobError(Exception):
+    def __init__(self, stage: str, message: str):
+        super().__init__(message)
+        self.stage = stage
+        self.message = message
+
+
+class JobQueueFull(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+
+
+def jobs_dao(cfg: DictConfig):
+    return get_mongo_dao(cfg, cfg.mongo.jobs_collection)
+
+
+class StageTimer():
+    def __init__(self) -> None:
+        """ Collects durations of job stages, tags failures with stage """
+        self.timings: dict = {}
+
+    def run(self, stage: str, func, *args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        except JobError:
+            raise
+        except Exception as e:
+            raise JobError(stage, f"Error occured while {stage}. "
+                           "Original message: " +
+                           getattr(e, "message", repr(e)))
+        finally:
+            self.add(stage, time.time() - start)
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+
+def train_model(cfg: DictConfig, model_type: str, params: dict,
+                logger=None, timer: Optional[StageTimer] = None) -> dict:
+    """ Fit model on shared features, score it and save it
+
+    Args:
+        cfg (DictConfig): common config
+        model_type (str): model type from model.yaml
+        params (dict): model params
+        logger (logging.Logger, optional): logger to pass to trainer
+        timer (StageTimer, optional): timer to collect stage durations to
+
+    Raises:
+        JobError: with failed stage name
+
+    Returns:
+        dict: model ID and scores
+    """
+    # Heavy imports are needed in job processes only
+    from api.src.feature_store import FeatureStore
+    from api.src.trainer import ModelTrainer
+
+    timer = timer or StageTimer()
+    logger = logger or logging.getLogger(__name__)
+    model_cfg = cfg[model_type]
+    trainer = timer.run("init", ModelTrainer, model_cfg.model,
+                        model_cfg.tfidf, model_params=params,
+                        load_model=False, model_obj=None, common_cfg=cfg,
+                        model_type=model_type, logger=logger)
+    features = timer.run("features", FeatureStore(cfg).get, model_cfg.tfidf,
+                         timer)
+    timer.run("fitting", trainer.fit_features, features.X_train,
+              features.y_train, features.vectorizer)
+    # Train and test matrices are the ones cached by FeatureStore for fit
+    scores = timer.run("scoring", trainer.evaluate_features,
+                       {"train": (features.X_train, features.y_train),
+                        "test": (features.X_test, features.y_test)},
+                       cfg.jobs.get("eval_n_jobs", 2),
+                       cfg.jobs.get("eval_chunk_size", 20000))
+    train_score, test_score = scores["train"], scores["test"]
+    _id = timer.run("saving", trainer.save_model, None,
+                    train_score, test_score)
+    timer.add("upload", trainer.artifact["upload_time_s"])  # type: ignore
+    return {"model_id": _id,
+            "train_score": train_score,
+            "test_score": test_score}
+
+
+def train_streaming(cfg: DictConfig, model_type: str, params: dict,
+                    logger=None, timer: Optional[StageTimer] = None) -> dict:
+    """ Fit incremental model chunk by chunk straight from MinIO stream
+
+    Rows are split by stable hash of row ID and shuffled within chunk.
+    Vectorizer must be stateless (e.g. HashingVectorizer), so memory is
+    bounded by `cfg.dataset.chunk_size`, not by dataset size.
+
+    Args:
+        cfg (DictConfig): common config
+        model_type (str): incremental model type from model.yaml
+        params (dict): model params
+        logger (logging.Logger, optional): logger to pass to trainer
+        timer (StageTimer, optional): timer to collect stage durations to
+
+    Raises:
+        JobError: with failed stage name
+
+    Returns:
+        dict: model ID, scores and number of train rows
+    """
+    import numpy as np
+    from api.src.data_preproccesor import dataset_chunks, dataset_classes, \
+        stable_test_mask
+    from api.src.evaluation import confusion, report
+    from api.src.trainer import ModelTrainer
+
+    timer = timer or StageTimer()
+    logger = logger or logging.getLogger(__name__)
+    model_cfg = cfg[model_type]
+    if not model_cfg.get("incremental", False):
+        raise JobError("init", f"Model type {model_type} doesn't support "
+                       "incremental training")
+    trainer = timer.run("init", ModelTrainer, model_cfg.model,
+                        model_cfg.tfidf, model_params=params,
+                        load_model=False, model_obj=None, common_cfg=cfg,
+                        model_type=model_type, logger=logger)
+    classes = timer.run("classes", dataset_classes, cfg)
+    test_size = 1 - cfg.dataset.train_size
+    rng = np.random.default_rng(cfg.dataset.seed)
+
+    def chunks():
+        with dataset_chunks(cfg) as frames:
+            while True:
+                df = timer.run("parse", next, frames, None)
+                if df is None:
+                    return
+                yield (df["title&description"].to_numpy(dtype=object),
+                       df["Category"].to_numpy(),
+                       stable_test_mask(df.index, test_size,
+                                        cfg.dataset.seed))
+
+    seen = 0
+
+    def fit():
+        nonlocal seen
+        for _ in range(cfg.dataset.get("stream_epochs", 1)):
+            for texts, target, is_test in chunks():
+                train_idx = rng.permutation(np.flatnonzero(~is_test))
+                if not len(train_idx):
+                    continue
+                features = timer.run("vectorize", trainer.transform,
+                                     texts[train_idx])
+                timer.run("fitting", trainer.partial_fit_features,
+                          features, target[train_idx], classes)
+                seen += len(train_idx)
+
+    def score():
+        # Confusion matrices of chunks add up, classes cover all labels
+        labels = np.unique(classes)
+        matrices = np.zeros((2, len(labels), len(labels)), dtype=np.int64)
+        predict_s = np.zeros(2)
+        for texts, target, is_test in chunks():
+            features = trainer.transform(texts)
+            for split, mask in enumerate((~is_test, is_test)):
+                if not mask.any():
+                    continue
+                start = time.perf_counter()
+                predictions = trainer.predict_features(features[mask])
+                predict_s[split] += time.perf_counter() - start
+                matrices[split] += confusion(target[mask], predictions,
+                                             labels)
+        return (report(matrices[0], labels, predict_s[0]),
+                report(matrices[1], labels, predict_s[1]))
+
+    trainer.measure_fit(fit, trace_memory=False)
+    start = time.time()
+    train_score, test_score = timer.run("scoring", score)
+    trainer.stats["score_time_s"] = time.time() - start
+    _id = timer.run("saving", trainer.save_model, None,
+                    train_score, test_score,
+                    {"incrementalSamples": seen, "streaming": True})
+    timer.add("upload", trainer.artifact["upload_time_s"])  # type: ignore
+    return {"model_id": _id,
+            "train_score": train_score,
+            "test_score": test_score,
+            "train_rows": seen}
+
+
+def _fit_candidate(model_class, params: dict, X_train, y_train,
+                   X_test, y_test):
+    from hydra.utils import instantiate
+    from api.src.evaluation import evaluate
+
+    model = instantiate(model_class, **params)
+    start = time.time()
+    model.fit(X_train, y_train)
+    fitted = time.time()
+    # Candidates already run in parallel, splits are scored one by one
+    scores = []
+    for X, y in ((X_train, y_train), (X_test, y_test)):
+        predict_start = time.perf_counter()
+        predictions = model.predict(X)
+        scores.append(evaluate(y, predictions, model.classes_,
+                               time.perf_counter() - predict_start))
+    train_score, test_score = scores
+    stats = {"fit_time_s": fitted - start,
+             "score_time_s": time.time() - fitted}
+    return model, train_score, test_score, stats
+
+
+def sweep_models(cfg: DictConfig, model_type: str, grid: dict,
+                 top_k: int = 1, logger=None,
+                 timer: Optional[StageTimer] = None) -> dict:
+    """ Fit every candidate of params grid in parallel on shared features
+
+    Every candidate's scores are recorded in Mongo, only `top_k` best
+    by test accuracy are saved as models.
+
+    Args:
+        cfg (DictConfig): common config
+        model_type (str): model type from model.yaml
+        grid (dict): sklearn-style params grid, e.g. {'C': [0.1, 1.0]}
+        top_k (int): number of best models to save
+        logger (logging.Logger, optional): logger to pass to trainer
+        timer (StageTimer, optional): timer to collect stage durations to
+
+    Raises:
+        JobError: with failed stage name
+
+    Returns:
+        dict: sweep ID and saved models
+    """
+    from joblib import Parallel, delayed
+    from sklearn.model_selection import ParameterGrid
+    from api.src.feature_store import FeatureStore
+    from api.src.trainer import ModelTrainer
+
+    timer = timer or StageTimer()
+    logger = logger or logging.getLogger(__name__)
+    model_cfg = cfg[model_type]
+    candidates = timer.run("init", lambda: list(ParameterGrid(grid)))
+    if len(candidates) > cfg.jobs.sweep_max_candidates:
+        raise JobError("init", f"Too many candidates: {len(candidates)} > "
+                       f"{cfg.jobs.sweep_max_candidates}")
+
+    features = timer.run("features", FeatureStore(cfg).get, model_cfg.tfidf,
+                         timer)
+    # joblib memmaps big arrays, so workers share feature matrices
+    fitted = timer.run("fitting", Parallel(n_jobs=cfg.jobs.sweep_n_jobs),
+                       (delayed(_fit_candidate)(
+                           model_cfg.model, params,
+                           features.X_train, features.y_train,
+                           features.X_test, features.y_test)
+                        for params in candidates))
+
+    ranking = sorted(range(len(candidates)),
+                     key=lambda i: fitted[i][2]["accuracy"], reverse=True)
+    best = []
+    for i in ranking[:top_k]:
+        model, train_score, test_score, stats = fitted[i]
+        trainer = ModelTrainer(model_cfg.model, model_cfg.tfidf,
+                               model_params=candidates[i], load_model=False,
+                               model_obj=None, common_cfg=cfg,
+                               model_type=model_type, logger=logger)
+        trainer.use_fitted(model, features.vectorizer)
+        trainer.stats.update(stats)
+        _id = timer.run("saving", trainer.save_model, None,
+                        train_score, test_score)
+        best.append({"model_id": _id, "params": candidates[i],
+                     "test_score": test_score})
+    saved = {i: entry["model_id"] for i, entry in zip(ranking, best)}
+    ranks = {i: rank for rank, i in enumerate(ranking)}
+
+    sweep_id = str(bson.ObjectId())
+    dao = get_mongo_dao(cfg, cfg.mongo.sweeps_collection)
+    timer.run("recording", dao.bulk_upsert, {
+        str(bson.ObjectId()): {
+            "sweep_id": sweep_id,
+            "model_type": model_type,
+            "params": params,
+            "train_score": fitted[i][1],
+            "test_score": fitted[i][2],
+            "rank": ranks[i],
+            "model_id": saved.get(i),
+        } for i, params in enumerate(candidates)
+    }, on_insert={"createdTimeS": time.time()})
+    return {"sweep_id": sweep_id,
+            "candidates": len(candidates),
+            "best": best}
+
+
+def run_job(cfg: DictConfig, job_id: str, func, *args) -> dict:
+    """ Run job function in worker process and record status in Mongo
+
+    `func` gets common config, logger and StageTimer before `args`
+
+    Returns:
+        dict: stage timings, to be observed by parent process
+    """
+    dao = jobs_dao(cfg)
+    started = time.time()
+    dao.update_by_id(job_id, {"status": RUNNING, "startedTimeS": started})
+    timer = StageTimer()
+    logger = logging.getLogger(__name__)
+    try:
+        result = func(cfg, *args, logger=logger, timer=timer)
+    except Exception as e:
+        stage = getattr(e, "stage", None)
+        logger.error(f"Job {job_id} failed: {traceback.format_exc()}")
+        dao.update_by_id(job_id, {
+            "status": FAILED,
+            "stage": stage,
+            "error": getattr(e, "message", repr(e)),
+            "timings": timer.timings,
+            "finishedTimeS": time.time(),
+            "durationS": time.time() - started,
+        })
+        return timer.timings
+    dao.update_by_id(job_id, {
+        "status": DONE,
+        "result": result,
+        "timings": timer.timings,
+        "finishedTimeS": time.time(),
+        "durationS": time.time() - started,
+    })
+    return timer.timings
+
+
+class JobManager():
+    def __init__(self, cfg: DictConfig) -> None:
+        """ Bounded process pool for long-running jobs (training, ...)
+
+        Pool is created lazily, so every gunicorn worker gets its own
+        after fork.
+
+        Args:
+            cfg (DictConfig): common config, `cfg.jobs` is used for pool
+        """
+        self.cfg = cfg
+        self.max_workers = cfg.jobs.max_workers
+        self.max_queued = cfg.jobs.max_queued
+        self.start_method = cfg.jobs.get("start_method", "spawn")
+        # "thread" keeps jobs in this process, e.g. for benchmarks with fakes
+        self.executor = cfg.jobs.get("executor", "process")
+        self._lock = threading.Lock()
+        self._executor: Optional[Executor] = None
+        self._pending = 0
+        self._futures: Set[Future] = set()
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None and self.executor == "thread":
+            self._executor = ThreadPoolExecutor(self.max_workers)
+        elif self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context(self.start_method))
+        return self._executor
+
+    def submit(self, kind: str, payload: dict, func, *args) -> str:
+        """ Record job as queued and submit it to the pool
+
+        Args:
+            kind (str): job kind, e.g. 'train'
+            payload (dict): request payload to keep with job
+            func: top-level (picklable) job function, see `run_job`
+            args: positional args of `func`
+
+        Raises:
+            JobQueueFull: if there are too many unfinished jobs
+
+        Returns:
+            str: job ID
+        """
+        with self._lock:
+            if self._pending >= self.max_queued:
+                raise JobQueueFull(
+                    f"Too many unfinished jobs ({self._pending})")
+            self._pending += 1
+
+        try:
+            job_id = str(bson.ObjectId())
+            jobs_dao(self.cfg).upsert(job_id, {
+                "kind": kind,
+                "payload": payload,
+                "status": QUEUED,
+                "createdTimeS": time.time(),
+            })
+            with self._lock:
+                future = self._get_executor().submit(
+                    run_job, self.cfg, job_id, func, *args)
+                self._futures.add(future)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        future.add_done_callback(lambda f: self._on_done(job_id, kind, f))
+        return job_id
+
+    def _on_done(self, job_id: str, kind: str, future: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+            self._futures.discard(future)
+        if not future.cancelled() and future.exception() is None:
+            # Jobs run in other processes, so their metrics are observed here
+            for stage, seconds in (future.result() or {}).items():
+                STAGE_SECONDS.observe(seconds, operation=kind, stage=stage)
+            return
+        # Worker died (or pool was shut down) before recording status
+        error = "Cancelled" if future.cancelled() \
+            else repr(future.exception())
+        try:
+            jobs_dao(self.cfg).update_by_id(job_id, {
+                "status": FAILED,
+                "error": error,
+                "finishedTimeS": time.time(),
+            })
+        except Exception:
+            logging.getLogger(__name__).exception(
+                f"Unable to record failure of job {job_id}")
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+            futures = list(self._futures)
+        if executor is None:
+            return
+        try:
+            executor.shutdown(wait=False, cancel_futures=True)
+        except TypeError:
+            # No `cancel_futures` before Python 3.9, running jobs go on
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
@@ -0,0 +1,269 @@
+# Sklearn-free inference of fitted TF-IDF + linear classifier pipelines
+import re
+import unicodedata
+import zlib
+from typing import Iterable, List, Optional
+
+import numpy as np
+import scipy.sparse as sp
+
+LITE_FORMAT = 1
+
+
+def lite_path(path_in_bucket: str) -> str:
+    """ Bucket path of lite artifact exported next to the pipeline one """
+    stem = path_in_bucket.rsplit(".", 1)[0]
+    return f"{stem}.lite.pk"
+
+
+def is_lite(obj) -> bool:
+    return isinstance(obj, dict) and obj.get("format") == LITE_FORMAT
+
+
+def _term_hash(term: bytes) -> int:
+    # Two C checksums are fast enough per token, matches are verified anyway
+    return (zlib.crc32(term) << 32) | zlib.adler32(term)
+
+
+def export_lite(pipeline) -> Optional[dict]:
+    """ Arrays and params to predict with `LitePipeline`
+
+    Supported are word analyzers of `CountVectorizer`/`TfidfVectorizer`
+    without custom callables, followed by a linear classifier
+    (`LinearSVC`, `LogisticRegression`, ...).
+
+    Args:
+        pipeline (sklearn.pipeline.Pipeline): fitted pipeline
+
+    Returns:
+        Optional[dict]: lite artifact, None if pipeline is not supported
+    """
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.linear_model._base import LinearClassifierMixin
+
+    if len(pipeline.steps) != 2:
+        return None
+    vectorizer, model = pipeline.steps[0][1], pipeline.steps[1][1]
+    if not isinstance(vectorizer, CountVectorizer) or \
+       not isinstance(model, LinearClassifierMixin) or \
+       vectorizer.analyzer != "word" or vectorizer.input != "content" or \
+       vectorizer.preprocessor is not None or \
+       vectorizer.tokenizer is not None or \
+       vectorizer.strip_accents not in (None, "ascii", "unicode"):
+        return None
+
+    terms = [b""] * len(vectorizer.vocabulary_)
+    for term, idx in vectorizer.vocabulary_.items():
+        terms[idx] = term.encode("utf-8")
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    np.cumsum([len(term) for term in terms], out=offsets[1:])
+    hashes = np.array([_term_hash(term) for term in terms], dtype=np.uint64)
+    order = np.argsort(hashes, kind="stable")
+
+    use_idf = getattr(vectorizer, "use_idf", False)
+    coef = model.coef_
+    if sp.issparse(coef):
+        coef = coef.toarray()
+    stop_words = vectorizer.get_stop_words()
+    return {
+        "format": LITE_FORMAT,
+        "params": {
+            "lowercase": vectorizer.lowercase,
+            "strip_accents": vectorizer.strip_accents,
+            "token_pattern": vectorizer.token_pattern,
+            "ngram_range": tuple(vectorizer.ngram_range),
+            "stop_words": sorted(stop_words) if stop_words else None,
+            "binary": vectorizer.binary,
+            "dtype": np.dtype(vectorizer.dtype).str,
+            "norm": getattr(vectorizer, "norm", None),
+            "use_idf": use_idf,
+            "sublinear_tf": getattr(vectorizer, "sublinear_tf", False),
+        },
+        "vocab_bytes": np.frombuffer(b"".join(terms), dtype=np.uint8),
+        "vocab_offsets": offsets,
+        "vocab_hashes": hashes[order],
+        "vocab_order": order.astype(np.int64),
+        "idf": np.asarray(vectorizer.idf_) if use_idf else None,
+        "coef": np.ascontiguousarray(coef),
+        "intercept": np.asarray(model.intercept_),
+        "classes": np.asarray(model.classes_),
+    }
+
+
+def _strip_accents_unicode(text: str) -> str:
+    try:
+        text.encode("ASCII", errors="strict")
+        return text
+    except UnicodeEncodeError:
+        normalized = unicodedata.normalize("NFKD", text)
+        return "".join(c for c in normalized if not unicodedata.combining(c))
+
+
+def _strip_accents_ascii(text: str) -> str:
+    normalized = unicodedata.normalize("NFKD", text)
+    return normalized.encode("ASCII", "ignore").decode("ASCII")
+
+
+class LiteVectorizer():
+    def __init__(self, artifact: dict) -> None:
+        """ Tokenizes like sklearn `CountVectorizer` and applies TF-IDF """
+        self.params = params = artifact["params"]
+        self.vocab_bytes = artifact["vocab_bytes"]
+        self._vocab_view = memoryview(self.vocab_bytes)
+        self.vocab_offsets = artifact["vocab_offsets"]
+        self.vocab_hashes = artifact["vocab_hashes"]
+        self.vocab_order = artifact["vocab_order"]
+        self.idf = artifact["idf"]
+        self.n_features = len(self.vocab_offsets) - 1
+        self.dtype = np.dtype(params["dtype"])
+        self.token_pattern = re.compile(params["token_pattern"])
+        self.stop_words = frozenset(params["stop_words"] or ())
+        self.strip_accents = {
+            "unicode": _strip_accents_unicode,
+            "ascii": _strip_accents_ascii,
+        }.get(params["strip_accents"])
+
+    def analyze(self, text: str) -> List[str]:
+        """ Same terms as `CountVectorizer.build_analyzer()` gives """
+        if self.params["lowercase"]:
+            text = text.lower()
+        if self.strip_accents is not None:
+            text = self.strip_accents(text)
+        tokens = self.token_pattern.findall(text)
+        if self.stop_words:
+            tokens = [token for token in tokens
+                      if token not in self.stop_words]
+        min_n, max_n = self.params["ngram_range"]
+        if max_n == 1:
+            return tokens
+        original = tokens
+        if min_n == 1:
+            tokens = list(original)
+            min_n += 1
+        else:
+            tokens = []
+        for n in range(min_n, min(max_n + 1, len(original) + 1)):
+            for i in range(len(original) - n + 1):
+                tokens.append(" ".join(original[i:i + n]))
+        return tokens
+
+    def lookup(self, terms: Iterable[str]) -> dict:
+        """ Vocabulary index of every known term """
+        terms = [term.encode("utf-8") for term in set(terms)]
+        if not terms or not self.n_features:
+            return {}
+        hashes = np.array([_term_hash(term) for term in terms],
+                          dtype=np.uint64)
+        positions = np.minimum(np.searchsorted(self.vocab_hashes, hashes),
+                               self.n_features - 1)
+        candidates = np.flatnonzero(self.vocab_hashes[positions] == hashes)
+        ids = self.vocab_order[positions[candidates]]
+        starts = self.vocab_offsets[ids].tolist()
+        ends = self.vocab_offsets[ids + 1].tolist()
+        found = {}
+        for i, idx, start, end in zip(candidates.tolist(), ids.tolist(),
+                                      starts, ends):
+            term = terms[i]
+            if self._vocab_view[start:end] != term:
+                idx = self._resolve_collision(term, int(positions[i]))
+                if idx is None:
+                    continue
+            found[term.decode("utf-8")] = idx
+        return found
+
+    def _resolve_collision(self, term: bytes, pos: int) -> Optional[int]:
+        """ Scan all vocabulary terms with the same hash """
+        term_hash = self.vocab_hashes[pos]
+        while pos < self.n_features and self.vocab_hashes[pos] == term_hash:
+            idx = int(self.vocab_order[pos])
+            start, end = self.vocab_offsets[idx:idx + 2]
+            if self._vocab_view[start:end] == term:
+                return idx
+            pos += 1
+        return None
+
+    def transform(self, texts: Iterable[str]) -> sp.csr_matrix:
+        docs = [self.analyze(text) for text in texts]
+        vocabulary = self.lookup(term for doc in docs for term in doc)
+        indices: list = []
+        values: list = []
+        indptr = [0]
+        for doc in docs:
+            counts: dict = {}
+            for term in doc:
+                idx = vocabulary.get(term)
+                if idx is not None:
+                    counts[idx] = counts.get(idx, 0) + 1
+            indices.extend(counts.keys())
+            values.extend(counts.values())
+            indptr.append(len(indices))
+
+        X = sp.csr_matrix((np.array(values, dtype=self.dtype),
+                           np.array(indices, dtype=np.int32),
+                           np.array(indptr, dtype=np.int64)),
+                          shape=(len(docs), self.n_features))
+        X.sort_indices()
+        if self.params["binary"]:
+            X.data.fill(1)
+        if self.params["sublinear_tf"]:
+            np.log(X.data, X.data)
+            X.data += 1
+        if self.params["use_idf"]:
+            X.data *= self.idf[X.indices]
+        if self.params["norm"] in ("l1", "l2"):
+            rows = np.repeat(np.arange(X.shape[0]), np.diff(X.indptr))
+            weights = np.abs(X.data) if self.params["norm"] == "l1" \
+                else X.data * X.data
+            norms = np.bincount(rows, weights=weights, minlength=X.shape[0])
+            if self.params["norm"] == "l2":
+                norms = np.sqrt(norms)
+            norms[norms == 0] = 1
+            X.data /= norms[rows]
+        return X
+
+    def get_params(self) -> dict:
+        return dict(self.params)
+
+
+class LiteLinearModel():
+    def __init__(self, artifact: dict) -> None:
+        """ Decision function and predict of sklearn linear classifiers """
+        self.coef_ = artifact["coef"]
+        self.intercept_ = artifact["intercept"]
+        self.classes_ = artifact["classes"]
+
+    def decision_function(self, X) -> np.ndarray:
+        scores = np.asarray(X @ self.coef_.T) + self.intercept_
+        return scores.ravel() if scores.shape[1] == 1 else scores
+
+    def predict(self, X) -> np.ndarray:
+        scores = self.decision_function(X)
+        if scores.ndim == 1:
+            return self.classes_[(scores > 0).astype(int)]
+        return self.classes_[scores.argmax(axis=1)]
+
+    def get_params(self) -> dict:
+        return {}
+
+
+class LitePipeline():
+    def __init__(self, artifact: dict) -> None:
+        """ Pipeline-like predictor over artifact made by `export_lite`
+
+        Args:
+            artifact (dict): lite artifact, e.g. loaded with joblib
+        """
+        self.steps = [("vectorizer", LiteVectorizer(artifact)),
+                      ("model", LiteLinearModel(artifact))]
+
+    def transform(self, texts: Iterable[str]) -> sp.csr_matrix:
+        return self.steps[0][1].transform(texts)
+
+    def predict(self, texts: Iterable[str]) -> np.ndarray:
+        return self.steps[1][1].predict(self.transform(texts))
+
+    def decision_function(self, texts: Iterable[str]) -> np.ndarray:
+        return self.steps[1][1].decision_function(self.transform(texts))
+
+    def get_params(self) -> dict:
+        return {"lite": True, **self.steps[0][1].get_params()}
@@ -0,0 +1,226 @@
+# Process-local metrics rendered in Prometheus text exposition format
+import functools
+import resource
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Tuple
+
+# Seconds, from a sub-millisecond cache hit to a long training stage
+TIME_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+
+
+def _format_labels(labelnames: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{str(value)}"'
+             for name, value in zip(labelnames, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter():
+    def __init__(self, name: str, help: str,
+                 labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, value: float = 1, **labels) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in self._values.items():
+                lines.append(f"{self.name}"
+                             f"{_format_labels(self.labelnames, key)} "
+                             f"{_format_value(value)}")
+        return lines
+
+
+class Histogram():
+    def __init__(self, name: str, help: str,
+                 labelnames: Tuple[str, ...] = (),
+                 buckets: Iterable[float] = TIME_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts, sum, count]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """ Observe duration of `with` block in seconds """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self, **labels) -> dict:
+        """ Cumulative bucket counts, sum and count of one label set """
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            counts, total_sum, total_count = self._values.get(
+                key, [[0] * len(self.buckets), 0, 0])
+            buckets, cumulative = OrderedDict(), 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                buckets[_format_value(bound)] = cumulative
+            buckets["+Inf"] = total_count
+        return {"buckets": buckets, "count": total_count, "sum": total_sum,
+                "mean": total_sum / total_count if total_count else 0.0}
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = {key: (list(entry[0]), entry[1], entry[2])
+                      for key, entry in self._values.items()}
+        names = self.labelnames + ("le",)
+        for key, (counts, total_sum, total_count) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket"
+                             f"{_format_labels(names, key + (bound,))} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_bucket"
+                         f"{_format_labels(names, key + ('+Inf',))} "
+                         f"{total_count}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} "
+                         f"{_format_value(float(total_sum))}")
+            lines.append(f"{self.name}_count{labels} {total_count}")
+        return lines
+
+
+class Gauge():
+    def __init__(self, name: str, help: str,
+                 collect: Callable[[], Dict[tuple, float]],
+                 labelnames: Tuple[str, ...] = ()) -> None:
+        """ Gauge which values are collected on render
+
+        Args:
+            collect (Callable): returns label values tuple -> value
+        """
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}",
+                 f"# TYPE {self.name} gauge"]
+        for key, value in self.collect().items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} "
+                         f"{_format_value(value)}")
+        return lines
+
+
+class Registry():
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._metrics: "OrderedDict[str, object]" = OrderedDict()
+
+    def register(self, metric):
+        """ Add metric, metric with the same name is replaced """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            try:
+                lines.extend(metric.render())  # type: ignore
+            except Exception as e:
+                lines.append(f"# {metric.name} is unavailable: "  # type: ignore
+                             f"{e!r}")
+        return "\n".join(lines) + "\n"
+
+
+# Metrics are per process, e.g. per gunicorn worker
+registry = Registry()
+STAGE_SECONDS = registry.register(Histogram(
+    "mlops_stage_seconds", "Duration of request and job stages",
+    ("operation", "stage")))
+DAO_CALLS = registry.register(Counter(
+    "mlops_dao_calls_total", "Number of Mongo/MinIO calls", ("dao", "op")))
+DAO_SECONDS = registry.register(Histogram(
+    "mlops_dao_seconds", "Duration of Mongo/MinIO calls", ("dao", "op")))
+DAO_BYTES = registry.register(Counter(
+    "mlops_dao_bytes_total", "Bytes transferred to/from MinIO",
+    ("dao", "direction")))
+
+
+@contextmanager
+def dao_call(dao: str, op: str):
+    """ Count and time a DAO call """
+    DAO_CALLS.inc(dao=dao, op=op)
+    with DAO_SECONDS.time(dao=dao, op=op):
+        yield
+
+
+def instrumented(dao: str):
+    """ Decorator counting and timing calls of DAO method """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with dao_call(dao, func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def process_memory() -> Dict[str, int]:
+    """ Resident memory of this process, bytes
+
+    `private` is what every additional gunicorn worker costs, `shared` are
+    pages inherited from preloading master or mapped from the same files.
+    Without /proc (not Linux) only `peak_rss` is known.
+    """
+    fields = {"Rss": "rss", "Pss": "pss",
+              "Shared_Clean": "shared", "Shared_Dirty": "shared",
+              "Private_Clean": "private", "Private_Dirty": "private"}
+    memory: Dict[str, int] = {}
+    try:
+        with open("/proc/self/smaps_rollup") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name in fields:
+                    kind = fields[name]
+                    # Values are in kB
+                    memory[kind] = memory.get(kind, 0) + \
+                        int(value.split()[0]) * 1024
+    except OSError:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        memory["peak_rss"] = rss if sys.platform == "darwin" else rss * 1024
+    return memory
@@ -0,0 +1,165 @@
+# Model loading and request parsing shared by Flask (app.py) and ASGI apps
+import json
+import logging
+import time
+
+from omegaconf import DictConfig
+
+from api.src.artifacts import ArtifactStore
+from api.src.cache import estimate_nbytes, model_cache, prediction_cache
+from api.src.dao import get_mongo_dao
+from api.src.metrics import STAGE_SECONDS
+from api.src.trainer import ModelTrainer
+
+
+class ModelLoadError(Exception):
+    def __init__(self, message, code):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+
+def configure_prediction_cache(cfg: DictConfig) -> None:
+    prediction_cache.configure(
+        dao=get_mongo_dao(cfg, cfg.mongo.prediction_cache_collection)
+        if cfg.cache.predictions.shared else None,
+        **cfg.cache.predictions)
+
+
+def load_trainer(cfg: DictConfig, doc, classname, vectorizer,
+                 mmap: bool = True, lite: bool = True,
+                 logger=None) -> ModelTrainer:
+    """ Fetch pickled pipeline from MinIO and wrap it into ModelTrainer
+
+    Args:
+        cfg (DictConfig): common config
+        doc (dict): model document from Mongo
+        classname: model config
+        vectorizer: vectorizer config
+        mmap (bool): whether arrays may be read-only memory-mapped
+        lite (bool): whether sklearn-free lite artifact may be loaded,
+            if `artifacts.serve_lite` is set and model has one
+
+    Raises:
+        ModelLoadError: with HTTP code to respond with
+    """
+    logger = logger or logging.getLogger(__name__)
+    store = ArtifactStore(cfg, logger)
+    start = time.time()
+    try:
+        if lite and cfg.artifacts.get("serve_lite", False) and doc.get("lite"):
+            artifacts = [doc["lite"]]
+        else:
+            artifacts = doc.get("blobs") or [{**(doc.get("artifact") or {}),
+                                              "minio_path": doc["minio_path"]}]
+        paths = [store.fetch(artifact["minio_path"], artifact.get("etag"))
+                 for artifact in artifacts]
+    except Exception as e:
+        raise ModelLoadError("Error occured while getting model from MinIO. \
+            Original message: " + getattr(e, "message", repr(e)), 404)
+    fetched = time.time()
+    STAGE_SECONDS.observe(fetched - start, operation="load_model",
+                          stage="minio_fetch")
+
+    try:
+        mmap_mode = None
+        if mmap:
+            for i, artifact in enumerate(artifacts):
+                paths[i], mmap_mode = store.mappable(paths[i], artifact)
+        # Pipeline saved as blobs is put together from its steps
+        model_obj = [(artifact["name"], path)
+                     for artifact, path in zip(artifacts, paths)] \
+            if "name" in artifacts[0] else paths[0]
+        trainer = ModelTrainer(classname, vectorizer,
+                               model_params=None,
+                               load_model=True,
+                               model_obj=model_obj,
+                               common_cfg=cfg,
+                               model_type=doc["model_type"],
+                               logger=logger,
+                               mmap_mode=mmap_mode)
+    except Exception as e:
+        raise ModelLoadError("Unable to init trainer. Original message: "
+                             + getattr(e, "message", repr(e)), 400)
+    STAGE_SECONDS.observe(time.time() - fetched, operation="load_model",
+                          stage="unpickle")
+
+    try:
+        get_mongo_dao(cfg).update_by_id(doc["_id"], {
+            "artifact.fetch_time_s": fetched - start,
+            "artifact.load_time_s": time.time() - fetched,
+        })
+    except Exception as e:
+        logger.warning("Unable to record model load time: " +
+                       getattr(e, "message", repr(e)))
+    return trainer
+
+
+def get_model_doc(cfg: DictConfig, _id):
+    """ Find model document by ID
+
+    Raises:
+        ModelLoadError: with HTTP code to respond with
+    """
+    try:
+        mongo_dao = get_mongo_dao(cfg)
+        doc = mongo_dao.find_by_id(_id)
+    except Exception as e:
+        raise ModelLoadError("Error occured while Mongo reaching. \
+            Original message: " + getattr(e, "message", repr(e)), 408)
+    if doc is None:
+        raise ModelLoadError("Not found any model by provided ID", 404)
+    return doc
+
+
+def get_trainer(cfg: DictConfig, _id, doc=None, logger=None):
+    """ Find model by ID and get its trainer from cache (or MinIO)
+
+    Args:
+        cfg (DictConfig): common config
+        _id (str): model ID
+        doc (dict, optional): model document if it is already found
+
+    Raises:
+        ModelLoadError: with HTTP code to respond with
+
+    Returns:
+        (dict, ModelTrainer): model document and trainer
+    """
+    if doc is None:
+        doc = get_model_doc(cfg, _id)
+
+    try:
+        # Можно, конечно, достать из монги все,
+        # Я просто люблю страдать
+        model_cfg = cfg[doc["model_type"]]
+        classname = model_cfg.model
+        vectorizer = model_cfg.tfidf
+    except Exception as e:
+        raise ModelLoadError("Error occured while config init. \
+            Original message: " + getattr(e, "message", repr(e)), 400)
+
+    trainer = model_cache.get_or_load(
+        _id, doc.get("updatedTimeS"),
+        lambda: load_trainer(cfg, doc, classname, vectorizer, logger=logger),
+        sizer=lambda trainer: estimate_nbytes(trainer.pipeline))
+    return doc, trainer
+
+
+def parse_batch_texts(mimetype: str, body: str) -> list:
+    """ Get texts from JSON body ({"texts": [...]}) or NDJSON body
+
+    Every NDJSON line is either a JSON string or an object with "text".
+    """
+    if mimetype in ("application/x-ndjson", "application/jsonlines"):
+        texts = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            texts.append(item["text"] if isinstance(item, dict) else item)
+        return texts
+    texts = json.loads(body)["texts"]
+    if not isinstance(texts, list):
+        raise ValueError("'texts' should be a list of strings")
+    return texts
@@ -0,0 +1,59 @@
+# Boot time of an API process, reported once the app is ready to serve
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from api.src.metrics import STAGE_SECONDS
+
+# Needed only for training, serving processes should not load them at boot
+TRAINING_MODULES = ("gdown", "hydra", "pandas", "sklearn.model_selection")
+
+
+class StartupTimer():
+    def __init__(self) -> None:
+        """ Splits time since its creation into named boot stages """
+        self.start = self._last = time.perf_counter()
+        self.stages: "OrderedDict[str, float]" = OrderedDict()
+        self.summary: dict = {}
+
+    def mark(self, stage: str) -> None:
+        """ Attribute time since previous mark to `stage` """
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def report(self, budget_s: Optional[float] = None,
+               logger=None) -> dict:
+        """ Log boot stages and warn if the boot took longer than budget
+
+        Returns:
+            dict: total and per stage seconds, loaded training-only modules
+        """
+        logger = logger or logging.getLogger(__name__)
+        total = time.perf_counter() - self.start
+        for stage, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, operation="startup", stage=stage)
+        self.summary = {
+            "total_s": total,
+            "stages": dict(self.stages),
+            "budget_s": budget_s,
+            "over_budget": budget_s is not None and total > budget_s,
+            "training_modules": [name for name in TRAINING_MODULES
+                                 if name in sys.modules],
+        }
+        stages = ", ".join(f"{stage} {seconds:.3f}s"
+                           for stage, seconds in self.stages.items())
+        logger.warning(f"Started in {total:.3f}s ({stages})")
+        if self.summary["over_budget"]:
+            logger.warning(f"Startup took {total:.3f}s, over budget of "
+                           f"{budget_s}s")
+        if self.summary["training_modules"]:
+            logger.warning("Training-only modules were imported at startup: " +
+                           ", ".join(self.summary["training_modules"]))
+        return self.summary
+
+
+# Created on first import, app.py imports it before anything heavy
+startup = StartupTimer()
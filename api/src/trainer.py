@@ -1,13 +1,18 @@
-from typing import Iterable, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional
 import numpy as np
-from sklearn.pipeline import make_pipeline
 import joblib
-from api.src.dao import MinioDAO, MongoDAO, MongoError
+from api.src.dao import VersionConflictError, get_mongo_dao
+from api.src.artifacts import ArtifactStore, compact_pipeline
+from api.src.cache import model_cache, prediction_cache, estimate_nbytes
+from api.src.ensemble import vectorizer_fingerprint
+from api.src.evaluation import evaluate
+from api.src.lite import LitePipeline, export_lite, is_lite, lite_path
 from omegaconf import DictConfig
 import bson
 import time
-from hydra.utils import instantiate
-import tempfile
+import resource
+import tracemalloc
 
 
 # Стырила из гиста:
@@ -25,22 +30,43 @@ class ModelTrainer():
                  model_obj=None,
                  model_type="linearSVC",
                  logger=None,
+                 mmap_mode=None,
                  ) -> None:
         """ Object of this class trains your model
 
         Args:
             model_class (class of sklearn.base.BaseEstimator): classname
             hyperparameters (dict): dictionary of hyperparameters for model
+            model_obj (str or list, optional): path to load pipeline from,
+                or list of (step name, path) of pipeline saved as blobs
+            mmap_mode (str, optional): joblib mmap_mode to load model with
         """
         self.common_cfg = common_cfg
         if load_model and model_obj is None:
             raise AttributeError("No model object provided to load from")
 
         self.params = model_params
-        if load_model:
-            self.pipeline = joblib.load(model_obj)
+        # Fit/score durations and fit peak memory, stored with model
+        self.stats: dict = {}
+        self.artifact: Optional[dict] = None
+        # Bumped on every save, e.g. by incremental updates
+        self.version = 0
+        if load_model and isinstance(model_obj, list):
+            # Steps saved as separate blobs, see ArtifactStore.save_blobs
+            from sklearn.pipeline import Pipeline
+            self.pipeline = Pipeline(
+                [(name, joblib.load(path, mmap_mode=mmap_mode))
+                 for name, path in model_obj])
+            self.params = self.pipeline.get_params()
+        elif load_model:
+            self.pipeline = joblib.load(model_obj, mmap_mode=mmap_mode)
+            if is_lite(self.pipeline):
+                self.pipeline = LitePipeline(self.pipeline)
             self.params = self.pipeline.get_params()
         else:
+            # Training-only, workers serving predictions never import these
+            from hydra.utils import instantiate
+            from sklearn.pipeline import make_pipeline
             self.model = instantiate(model_class, **self.params)
             self.pipeline = make_pipeline(instantiate(vectorizer), self.model)
         if logger:
@@ -60,7 +86,103 @@ class ModelTrainer():
             _train_data = train_data.reshape(-1,)
         else:
             _train_data = train_data
-        self.pipeline.fit(_train_data, train_target)
+        self.measure_fit(self.pipeline.fit, _train_data, train_target)
+
+    def fit_features(self, train_features, train_target: np.ndarray,
+                     vectorizer) -> None:
+        """ fit model on already vectorized data
+
+        Args:
+            train_features (scipy.sparse.csr_matrix): train feature matrix
+            train_target (numpy.array): train target
+            vectorizer: vectorizer fitted on train data,
+                becomes the first step of pipeline
+        """
+        self.measure_fit(self.model.fit, train_features, train_target)
+        self.use_fitted(self.model, vectorizer)
+
+    def measure_fit(self, fit, *args, trace_memory: bool = True) -> None:
+        """ Run fit recording its duration and memory peak
+
+        Args:
+            trace_memory (bool): whether to record peak of traced memory.
+                Tracing slows down pure Python code (e.g. tokenization),
+                otherwise peak RSS of the whole process is recorded
+        """
+        started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif trace_memory and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        start = time.time()
+        try:
+            fit(*args)
+        finally:
+            self.stats["fit_time_s"] = time.time() - start
+            if trace_memory:
+                self.stats["fit_peak_bytes"] = \
+                    tracemalloc.get_traced_memory()[1]
+            else:
+                # kilobytes on Linux
+                self.stats["peak_rss_bytes"] = resource.getrusage(
+                    resource.RUSAGE_SELF).ru_maxrss * 1024
+            if started_tracing:
+                tracemalloc.stop()
+
+    def _add_score_time(self, start: float) -> None:
+        self.stats["score_time_s"] = self.stats.get("score_time_s", 0.0) + \
+            time.time() - start
+
+    def partial_fit(self, train_data: np.ndarray,
+                    train_target: np.ndarray) -> dict:
+        """ update model in place with a new batch of labeled texts
+
+        Vectorizer is not refitted, so it should be stateless
+        (e.g. HashingVectorizer) or have a frozen vocabulary.
+
+        Args:
+            train_data (np.ndarray): 1d array of texts
+            train_target (np.ndarray): labels
+
+        Raises:
+            AttributeError: if model doesn't support `partial_fit`
+
+        Returns:
+            dict: accuracy on the batch before update (progressive validation)
+        """
+        model = self.pipeline.steps[-1][1]
+        if not hasattr(model, "partial_fit"):
+            raise AttributeError(f"{step_fullname(model)} doesn't support "
+                                 "incremental updates")
+        features = self.transform(train_data)
+        score = {"accuracy": model.score(features, train_target)}
+        # Runs in request threads: tracemalloc is process-wide, so starting
+        # and stopping it here would race with concurrent fits
+        self.measure_fit(model.partial_fit, features, train_target,
+                         trace_memory=False)
+        return score
+
+    def partial_fit_features(self, train_features, train_target: np.ndarray,
+                             classes: Optional[np.ndarray] = None) -> None:
+        """ update model with already vectorized batch
+
+        Args:
+            classes (np.ndarray, optional): all labels, required by
+                the first call on unfitted model
+        """
+        self.pipeline.steps[-1][1].partial_fit(train_features, train_target,
+                                               classes=classes)
+
+    def use_fitted(self, model, vectorizer) -> None:
+        """ use already fitted model and vectorizer, e.g. from a sweep
+
+        Args:
+            model (sklearn.base.BaseEstimator): fitted model
+            vectorizer: vectorizer the model was fitted on
+        """
+        from sklearn.pipeline import make_pipeline
+        self.model = model
+        self.pipeline = make_pipeline(vectorizer, self.model)
 
     def predict(self, test_data: np.ndarray) -> None:
         """predict on trained model
@@ -70,15 +192,120 @@ class ModelTrainer():
         """
         return self.pipeline.predict(test_data)
 
+    def transform(self, test_data: np.ndarray):
+        """ vectorize texts with all steps but the model """
+        for _, step in self.pipeline.steps[:-1]:
+            test_data = step.transform(test_data)
+        return test_data
+
+    def predict_features(self, test_features) -> np.ndarray:
+        return self.pipeline.steps[-1][1].predict(test_features)
+
+    def scores_features(self, test_features) -> np.ndarray:
+        return self._scores(self.pipeline.steps[-1][1], test_features)
+
+    def predict_chunked(self, test_data: np.ndarray, chunk_size: int,
+                        with_scores: bool = False):
+        """predict on trained model chunk by chunk
+
+        Every chunk is vectorized and classified with a single call,
+        so batch cost is dominated by sparse algebra, not Python overhead.
+
+        Args:
+            test_data (np.ndarray): 1d array of texts
+            chunk_size (int): max number of texts per vectorized call
+            with_scores (bool): whether to return
+                decision_function (or predict_proba) scores as well
+
+        Returns:
+            (np.ndarray, Optional[np.ndarray]): predictions and scores
+        """
+        chunk_size = max(int(chunk_size), 1)
+        model = self.pipeline.steps[-1][1]
+        predictions, scores = [], []
+        for start in range(0, len(test_data), chunk_size):
+            chunk = self.transform(test_data[start:start + chunk_size])
+            predictions.append(model.predict(chunk))
+            if with_scores:
+                scores.append(self._scores(model, chunk))
+
+        if not predictions:
+            return np.array([]), (np.empty((0, len(self.classes())))
+                                  if with_scores else None)
+        return (np.concatenate(predictions),
+                np.concatenate(scores) if with_scores else None)
+
+    @staticmethod
+    def _scores(model, features):
+        if hasattr(model, "decision_function"):
+            return model.decision_function(features)
+        return model.predict_proba(features)
+
+    def classes(self) -> np.ndarray:
+        return self.pipeline.steps[-1][1].classes_
+
     def score(self, test_data: Iterable, ground_truth: Iterable) -> dict:
         if len(test_data.shape) > 1:  # type: ignore
             _test_data = test_data.reshape(-1,)  # type: ignore
         else:
             _test_data = test_data
+        start = time.time()
+        accuracy = self.pipeline.score(_test_data, ground_truth)
+        self._add_score_time(start)
         return {
-            "accuracy": self.pipeline.score(_test_data, ground_truth)
+            "accuracy": accuracy
         }
 
+    def score_features(self, test_features, ground_truth: Iterable) -> dict:
+        start = time.time()
+        accuracy = self.pipeline.steps[-1][1].score(test_features,
+                                                    ground_truth)
+        self._add_score_time(start)
+        return {
+            "accuracy": accuracy
+        }
+
+    def evaluate_features(self, splits: Dict[str, tuple], n_jobs: int = 2,
+                          chunk_size: int = 20000) -> Dict[str, dict]:
+        """ Evaluation report of every split on already vectorized data
+
+        Row chunks of all splits are predicted concurrently, sparse algebra
+        of sklearn linear models runs without GIL.
+
+        Args:
+            splits (Dict[str, tuple]): split name to (features, ground truth),
+                e.g. matrices the model was fitted on
+            n_jobs (int): number of predicting threads
+            chunk_size (int): max number of rows per predict call
+
+        Returns:
+            Dict[str, dict]: split name to report
+                (see `api.src.evaluation.report`)
+        """
+        model = self.pipeline.steps[-1][1]
+        chunk_size = max(int(chunk_size), 1)
+
+        def predict(features):
+            start = time.perf_counter()
+            return model.predict(features), time.perf_counter() - start
+
+        start = time.time()
+        reports = {}
+        with ThreadPoolExecutor(max(int(n_jobs), 1)) as pool:
+            futures = {name: [pool.submit(predict, features[i:i + chunk_size])
+                              for i in range(0, features.shape[0],
+                                             chunk_size)]
+                       for name, (features, _) in splits.items()}
+            for name, (_, ground_truth) in splits.items():
+                results = [future.result() for future in futures[name]]
+                predictions = np.concatenate(
+                    [p for p, _ in results] or [np.empty(0, dtype=int)])
+                reports[name] = evaluate(ground_truth, predictions,
+                                         self.classes(),
+                                         sum(s for _, s in results))
+        self._add_score_time(start)
+        return reports
+
     def get_model_params(self):
         """ Getter of params
 
@@ -112,48 +339,107 @@ class ModelTrainer():
         """
         return self.pipeline
 
+    def _drop_cached_predictions(self, _id: str) -> None:
+        """ Predictions of previous version are unreachable (keys hold
+        version), drop them not to wait for TTL """
+        prediction_cache.invalidate(_id)
+        predictions_cfg = self.common_cfg.cache.predictions
+        if not predictions_cfg.shared or prediction_cache.dao is not None:
+            return
+        # Training jobs run in separate processes with unconfigured cache
+        try:
+            get_mongo_dao(self.common_cfg,
+                          self.common_cfg.mongo.prediction_cache_collection
+                          ).remove_many({"model_id": _id})
+        except Exception as e:
+            self.logger.warning(f"Unable to drop cached predictions: {e!r}")
+
     def save_model(self, idx: Optional[str] = None, 
-                   train_score=None, test_score=None):
+                   train_score=None, test_score=None,
+                   extra: Optional[dict] = None,
+                   expected_version: Optional[int] = None):
         """_summary_
 
         Args:
             idx (str, optional): _description_. Defaults to None.
+            extra (dict, optional): more fields to store with model
+            expected_version (int, optional): version stored model must
+                still have, e.g. the one it was loaded with
 
         Raises:
-            MongoError: _description_
+            VersionConflictError: if stored model has other version
+            Exception: of Mongo or MinIO, saved blobs are released
         """
         is_created = False if idx is not None else True
         _id = str(bson.ObjectId()) if is_created else idx
-        path = self.model_path_template.format(_id)
 
         bucket = self.common_cfg.minio.models_bucket
-        minio_dao = MinioDAO(host=self.common_cfg.minio.host,
-                             port=self.common_cfg.minio.server_port,
-                             user=self.common_cfg.minio.root_user,
-                             password=self.common_cfg.minio.root_password,
-                             bucket=bucket)
-
-        with tempfile.NamedTemporaryFile() as fp:
-            joblib.dump(self.pipeline, fp.name)
-            minio_dao.save_to_bucket(bucket, path, fp.name)
-        mongo_cfg = self.common_cfg.mongo
-        mongo_dao = MongoDAO(mongo_cfg.host, mongo_cfg.port, mongo_cfg.dbname,
-                             mongo_cfg.models_collection)
-
-        found = mongo_dao.find_by_id(_id)
-        createdTimeS = found["createdTimeS"] if found else time.time()
-
-        metadata = {
-            "minio_bucket": bucket,
-            "minio_path": path,
-            "model_type": self.model_type,
-            "params": self.get_model_params(),
-            "createdTimeS": createdTimeS,
-            "updatedTimeS": time.time(),
-            "train_score": train_score,
-            "test_score": test_score
-        }
-        self.logger.warning(str(metadata))
-        if mongo_dao.upsert(_id, metadata) is None:  # type: ignore
-            raise MongoError(f"Upsert is failed for {_id}")
+        store = ArtifactStore(self.common_cfg, self.logger)
+        path, blobs, lite = None, None, None
+        # Copy, fitted vectorizer may be shared with FeatureStore
+        pipeline = compact_pipeline(self.pipeline, store.float32)
+        try:
+            if store.content_addressed:
+                blobs = store.save_blobs(pipeline, compact=False)
+                artifact = store.summary(blobs)
+            else:
+                path = self.model_path_template.format(_id)
+                artifact = store.save(pipeline, path, compact=False)
+            self.artifact = artifact
+            if self.common_cfg[self.model_type].get("lite", False):
+                # Weights are the same (e.g. float32) as the saved ones
+                exported = export_lite(pipeline)
+                if exported is not None and store.content_addressed:
+                    lite = store.save_blob(exported)
+                elif exported is not None:
+                    lite = {"minio_path": lite_path(path),
+                            **store.save(exported, lite_path(path),
+                                         compact=False)}
+
+            metadata = {
+                "minio_bucket": bucket,
+                "minio_path": path,
+                "blobs": blobs,
+                "model_type": self.model_type,
+                "params": self.get_model_params(),
+                "updatedTimeS": time.time(),
+                "train_score": train_score,
+                "test_score": test_score,
+                "artifact": artifact,
+                "lite": lite,
+                "vectorizer_fingerprint": vectorizer_fingerprint(pipeline),
+                "stats": {**self.stats,
+                          "memory_bytes": estimate_nbytes(pipeline)},
+                "version": self.version + 1,
+                **(extra or {}),
+            }
+            self.logger.warning(str(metadata))
+            # Previous document is returned atomically, so artifacts
+            # released below are never the ones of a concurrent save
+            expected = None
+            if expected_version is not None:
+                # Documents saved before versioning have no version
+                expected = {"version": expected_version
+                            if expected_version != 1 else {"$in": [1, None]}}
+            previous = get_mongo_dao(self.common_cfg).upsert_previous(
+                _id, metadata, on_insert={"createdTimeS": time.time()},
+                expected=expected)
+            if expected is not None and previous is None:
+                raise VersionConflictError(
+                    f"Model {_id} was updated or removed, "
+                    f"expected version {expected_version}")
+        except Exception:
+            # References taken so far would keep blobs forever
+            store.release(store.blobs_of({"blobs": blobs, "lite": lite}))
+            raise
+        model_cache.invalidate(_id)
+        if not is_created:
+            self._drop_cached_predictions(_id)
+        if previous is not None:
+            try:
+                store.remove_artifacts(previous, keep=metadata)
+            except Exception as e:
+                self.logger.warning("Unable to release previous artifacts: "
+                                    f"{e!r}")
+        self.version += 1
         return _id
@@ -0,0 +1,137 @@
+# Preloading models at service startup and readiness reporting
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import numpy as np
+from omegaconf import DictConfig
+
+from api.src.dao import get_mongo_dao
+
+
+class TrafficCounter():
+    def __init__(self, cfg: DictConfig, flush_interval: float = 30) -> None:
+        """ Counts predictions per model, flushes them to Mongo in batches
+
+        Counts are stored in `predictCount` of model documents and used
+        to pick the most popular models to warm up.
+
+        Args:
+            cfg (DictConfig): common config
+            flush_interval (float): seconds between flushes
+        """
+        self.cfg = cfg
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._counts: Counter = Counter()
+        self._last_flush = time.time()
+
+    def hit(self, _id: str, count: int = 1) -> None:
+        with self._lock:
+            self._counts[_id] += count
+            if time.time() - self._last_flush < self.flush_interval:
+                return
+            counts, self._counts = self._counts, Counter()
+            self._last_flush = time.time()
+        self._flush(counts)
+
+    def flush(self) -> None:
+        with self._lock:
+            counts, self._counts = self._counts, Counter()
+            self._last_flush = time.time()
+        self._flush(counts)
+
+    def _flush(self, counts: Counter) -> None:
+        dao = get_mongo_dao(self.cfg)
+        for _id, count in counts.items():
+            try:
+                dao.increment_by_id(_id, "predictCount", count)
+            except Exception as e:
+                logging.getLogger(__name__).warning(
+                    f"Unable to flush traffic of {_id}: {e!r}")
+
+
+class WarmUp():
+    def __init__(self, cfg: DictConfig,
+                 load: Callable[[str], object], logger=None) -> None:
+        """ Preloads selected models into memory in background
+
+        Args:
+            cfg (DictConfig): common config, `cfg.warmup` is used
+            load (Callable): function loading model trainer by ID
+        """
+        self.cfg = cfg
+        self.warmup_cfg = cfg.warmup
+        self.load = load
+        self.logger = logger or logging.getLogger(__name__)
+        self.ready = threading.Event()
+        self.summary: dict = {"status": "pending"}
+
+    def select_models(self) -> List[str]:
+        """ Pinned models, then most recent, then most popular ones """
+        warmup_cfg = self.warmup_cfg
+        ids = [str(_id) for _id in warmup_cfg.get("pinned", [])]
+        dao = get_mongo_dao(self.cfg)
+        for field, limit in (("updatedTimeS", warmup_cfg.most_recent),
+                             ("predictCount", warmup_cfg.top_by_traffic)):
+            if limit <= 0:
+                continue
+            docs = dao.list_documents(limit=limit,
+                                      sort=[(field, -1)],
+                                      projection={"_id": 1})
+            ids.extend(str(doc["_id"]) for doc in docs)
+        return list(dict.fromkeys(ids))
+
+    def _warm(self, _id: str) -> float:
+        start = time.time()
+        trainer = self.load(_id)
+        # First call initializes lazy sklearn/numpy code paths
+        trainer.predict(np.array([self.warmup_cfg.dummy_text]))
+        return time.time() - start
+
+    def run(self) -> dict:
+        """ Load selected models, readiness is set after it
+
+        Returns:
+            dict: summary, also kept in `summary`
+        """
+        if not self.warmup_cfg.enabled:
+            self.summary = {"status": "disabled"}
+            self.ready.set()
+            return self.summary
+        start = time.time()
+        loaded, failed = {}, {}
+        try:
+            ids = self.select_models()
+            with ThreadPoolExecutor(self.warmup_cfg.parallelism) as pool:
+                futures = {_id: pool.submit(self._warm, _id) for _id in ids}
+                for _id, future in futures.items():
+                    try:
+                        loaded[_id] = future.result()
+                    except Exception as e:
+                        failed[_id] = getattr(e, "message", repr(e))
+            status = "done"
+        except Exception as e:
+            self.logger.warning("Warm-up failed: " +
+                                getattr(e, "message", repr(e)))
+            status = "failed"
+        self.summary = {
+            "status": status,
+            "loaded": loaded,
+            "failed": failed,
+            "durationS": time.time() - start,
+        }
+        self.logger.warning(f"Warm-up finished: {self.summary}")
+        self.ready.set()
+        return self.summary
+
+    def start(self) -> None:
+        """ Run warm-up in background thread, readiness is set after it """
+        if not self.warmup_cfg.enabled:
+            self.run()
+            return
+        self.summary = {"status": "running"}
+        threading.Thread(target=self.run, name="warmup", daemon=True).start()
@@ -1,11 +1,46 @@
+from api.src.startup import startup
+import atexit
+import gc
 from flask import Flask
-from api.endpoints import api, cfg
+from api.endpoints import api, cfg, logger, job_manager, traffic, warmup
+from api.src.dao import init_daos, shutdown_daos
 
 app = Flask(__name__)
 
 app.config["BUNDLE_ERRORS"] = True
 api.init_app(app)
+startup.mark("init_app")
+
+
+def boot() -> None:
+    """ Connect to storages, warm models up and register shutdown hooks
+
+    Not done on import: job pool processes started with spawn import
+    this module again as `__mp_main__`. Called by gunicorn hooks,
+    see gunicorn.conf.py
+    """
+    try:
+        init_daos(cfg)
+    except Exception as e:
+        logger.warning("Unable to init DAOs at startup, will retry lazily: "
+                       + getattr(e, "message", repr(e)))
+    startup.mark("init_daos")
+    if cfg.flask.get("preload", False):
+        # Under gunicorn this runs in master: models are loaded before fork
+        # and shared copy-on-write by workers. Frozen objects are never
+        # touched by GC, so workers don't dirty their pages
+        warmup.run()
+        shutdown_daos()
+        gc.freeze()
+        startup.mark("warmup")
+    else:
+        warmup.start()
+    startup.report(cfg.flask.get("startup_budget_s"), logger)
+    atexit.register(shutdown_daos)
+    atexit.register(job_manager.shutdown)
+    atexit.register(traffic.flush)
 
 
 if __name__ == "__main__":
+    boot()
     app.run(host=cfg.flask.host, port=cfg.flask.port, debug=True)
@@ -0,0 +1,223 @@
+import os
+import tempfile
+import threading
+from types import SimpleNamespace
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import joblib
+import mongomock
+import numpy as np
+from omegaconf import OmegaConf
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+
+from api.src import serving
+from api.src.artifacts import ArtifactStore, compact_pipeline
+from api.src.dao import MongoDAO
+from configurator import get_config
+
+TEXTS = ["гараж кирпичный", "телефон новый", "гараж охрана", "телефон чехол",
+         "гараж бокс", "телефон новый в чехле"]
+LABELS = [0, 1, 0, 1, 0, 1]
+
+
+class FakeMinio():
+    def __init__(self) -> None:
+        self.objects: dict = {}
+        self.uploads = 0
+
+    def stat(self, bucket, path_in_bucket):
+        return self.objects.get(path_in_bucket)
+
+    def save_to_bucket(self, bucket, path_in_bucket, path):
+        self.uploads += 1
+        self.objects[path_in_bucket] = SimpleNamespace(etag=f'"{self.uploads}"')
+        return self.objects[path_in_bucket]
+
+    def remove_from_bucket(self, bucket, path_in_bucket):
+        self.objects.pop(path_in_bucket, None)
+
+
+def refs_dao() -> MongoDAO:
+    return MongoDAO("mock", "27017", "mlopsdb", "blobs",
+                    client=mongomock.MongoClient())
+
+
+def blob_store(cache_dir: str) -> ArtifactStore:
+    return ArtifactStore(OmegaConf.create({
+        "minio": {"models_bucket": "models"},
+        "mongo": {"blobs_collection": "blobs"},
+        "artifacts": {"cache_dir": cache_dir, "content_addressed": True,
+                      "release_wait_s": 5}}))
+
+
+class FakeModels():
+    def __init__(self) -> None:
+        self.updates: dict = {}
+
+    def update_by_id(self, _id, fields):
+        self.updates.setdefault(_id, {}).update(fields)
+
+
+class TestArtifactStore(TestCase):
+    def test_compact_pipeline_copies(self):
+        pipeline = make_pipeline(TfidfVectorizer(max_features=3),
+                                 LogisticRegression()).fit(TEXTS, LABELS)
+        vectorizer, model = pipeline.steps[0][1], pipeline.steps[1][1]
+        # Not set by scikit-learn >= 1.6
+        had_stop_words = hasattr(vectorizer, "stop_words_")
+
+        compacted = compact_pipeline(pipeline, float32=True)
+        self.assertEqual(hasattr(vectorizer, "stop_words_"), had_stop_words)
+        self.assertFalse(hasattr(compacted.steps[0][1], "stop_words_"))
+        self.assertEqual((vectorizer.idf_.dtype, model.coef_.dtype),
+                         (np.float64, np.float64))
+        self.assertEqual((compacted.steps[0][1].idf_.dtype,
+                          compacted.steps[1][1].coef_.dtype),
+                         (np.float32, np.float32))
+        self.assertEqual(compacted.predict(TEXTS).tolist(), LABELS)
+
+        compacted = compact_pipeline(pipeline)
+        self.assertEqual(compacted.steps[1][1].coef_.dtype, np.float64)
+        self.assertIs(compacted.steps[1][1].coef_, model.coef_)
+
+    def test_save_and_load_metadata(self):
+        pipeline = make_pipeline(TfidfVectorizer(),
+                                 LogisticRegression()).fit(TEXTS * 50,
+                                                           LABELS * 50)
+        minio, models = FakeMinio(), FakeModels()
+        cfg = get_config()
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch("api.src.artifacts.get_minio_dao", lambda *a: minio), \
+                patch("api.src.serving.get_mongo_dao", lambda *a: models):
+            cfg.artifacts.cache_dir = cache_dir
+            cfg.artifacts.float32 = True
+            store = ArtifactStore(cfg)
+            sizes = {}
+            for compress in ("none", "zlib"):
+                store.compress = compress
+                artifact = store.save(pipeline, f"{compress}.pk")
+                local_path = store.fetch(f"{compress}.pk", artifact["etag"])
+                self.assertEqual(artifact["size_bytes"],
+                                 os.path.getsize(local_path))
+                self.assertEqual((artifact["compress"], artifact["float32"]),
+                                 (compress, True))
+                self.assertGreaterEqual(artifact["dump_time_s"], 0)
+                sizes[compress] = artifact["size_bytes"]
+            self.assertLess(sizes["zlib"], sizes["none"])
+            self.assertEqual(pipeline.steps[1][1].coef_.dtype, np.float64)
+
+            doc = {"_id": "a", "model_type": "logreg",
+                   "minio_path": "zlib.pk", "artifact": artifact}
+            trainer = serving.load_trainer(cfg, doc, cfg.logreg.model,
+                                           cfg.logreg.tfidf, lite=False)
+        self.assertEqual(trainer.pipeline.steps[1][1].coef_.dtype,
+                         np.float32)
+        self.assertEqual(trainer.predict_chunked(
+            np.array(TEXTS, dtype=object), 4, False)[0].tolist(), LABELS)
+        self.assertEqual(set(models.updates["a"]),
+                         {"artifact.fetch_time_s", "artifact.load_time_s"})
+
+    def test_compressed_artifact_is_unpacked_for_mmap(self):
+        pipeline = make_pipeline(TfidfVectorizer(), LogisticRegression())
+        pipeline.fit(["гараж кирпичный", "телефон новый", "гараж охрана",
+                      "телефон чехол"], [0, 1, 0, 1])
+        with tempfile.TemporaryDirectory() as cache_dir:
+            store = ArtifactStore(OmegaConf.create({
+                "minio": {"models_bucket": "models"},
+                "artifacts": {"cache_dir": cache_dir, "mmap_mode": "r",
+                              "mmap_unpack": True}}))
+            local_path = os.path.join(cache_dir, "model.pk.etag")
+            joblib.dump(pipeline, local_path, compress=("zlib", 3))
+
+            path, mmap_mode = store.mappable(local_path, {"compress": "zlib"})
+            self.assertEqual((path, mmap_mode), (f"{local_path}.raw", "r"))
+            loaded = joblib.load(path, mmap_mode=mmap_mode)
+            self.assertIsInstance(loaded.steps[-1][1].coef_, np.memmap)
+            self.assertEqual(loaded.predict(["гараж"]).tolist(), [0])
+
+            store.mmap_unpack = False
+            self.assertEqual(store.mappable(local_path, {"compress": "zlib"}),
+                             (local_path, None))
+
+    def test_blobs_are_deduplicated_and_refcounted(self):
+        texts, labels = ["гараж кирпичный", "телефон новый"], [0, 1]
+        vectorizer = TfidfVectorizer().fit(texts)
+        minio, refs = FakeMinio(), refs_dao()
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch("api.src.artifacts.get_minio_dao", lambda *a: minio), \
+                patch("api.src.artifacts.get_mongo_dao", lambda *a: refs):
+            store = blob_store(cache_dir)
+            features = vectorizer.transform(texts)
+            docs = [{"blobs": store.save_blobs(make_pipeline(
+                vectorizer, LogisticRegression(C=C).fit(features, labels)))}
+                for C in (1.0, 1.0, 0.1)]
+            # Vectorizer is uploaded once, equal models share their blob
+            self.assertEqual(minio.uploads, 3)
+            self.assertTrue(all(blob["deduplicated"]
+                                for blob in docs[1]["blobs"]))
+            self.assertEqual([blob["minio_path"] for blob in docs[0]["blobs"]],
+                             [blob["minio_path"] for blob in docs[1]["blobs"]])
+
+            store.remove_artifacts(docs[0])
+            store.remove_artifacts(docs[2])
+            self.assertEqual(len(minio.objects), 2)
+            store.remove_artifacts(docs[1])
+            self.assertEqual(minio.objects, {})
+            self.assertEqual(refs.collection.count_documents({}), 0)
+
+    def test_blob_saved_while_released(self):
+        minio, refs = FakeMinio(), refs_dao()
+        remove = minio.remove_from_bucket
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch("api.src.artifacts.get_minio_dao", lambda *a: minio), \
+                patch("api.src.artifacts.get_mongo_dao", lambda *a: refs):
+            store = blob_store(cache_dir)
+            blob = store.save_blob({"weights": [1.0, 2.0]})
+            saved = []
+
+            def remove_while_saving(bucket, path_in_bucket):
+                # Same bytes are saved again while the object is removed
+                saver = threading.Thread(target=lambda: saved.append(
+                    store.save_blob({"weights": [1.0, 2.0]})))
+                saver.start()
+                saver.join(0.2)
+                self.assertTrue(saver.is_alive())
+                remove(bucket, path_in_bucket)
+                saved.append(saver)
+
+            with patch.object(minio, "remove_from_bucket",
+                              remove_while_saving):
+                self.assertEqual(store.release([blob]), [blob["minio_path"]])
+            saved.pop(0).join(5)
+            self.assertFalse(saved[0]["deduplicated"])
+            self.assertIn(blob["minio_path"], minio.objects)
+            self.assertEqual(refs.find_by_keys([blob["minio_path"]])[0]
+                             ["refs"], 1)
+
+    def test_failed_save_releases_blobs(self):
+        minio, refs = FakeMinio(), refs_dao()
+        save_to_bucket = minio.save_to_bucket
+
+        def fail_second(bucket, path_in_bucket, path):
+            if minio.uploads:
+                raise ConnectionError("MinIO is gone")
+            return save_to_bucket(bucket, path_in_bucket, path)
+
+        pipeline = make_pipeline(TfidfVectorizer(),
+                                 LogisticRegression()).fit(TEXTS, LABELS)
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch("api.src.artifacts.get_minio_dao", lambda *a: minio), \
+                patch("api.src.artifacts.get_mongo_dao", lambda *a: refs), \
+                patch.object(minio, "save_to_bucket", fail_second):
+            store = blob_store(cache_dir)
+            with self.assertRaises(ConnectionError):
+                store.save_blobs(pipeline)
+        self.assertEqual(minio.objects, {})
+        self.assertEqual(refs.collection.count_documents({}), 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,274 @@
+# Async serving of predictions, run with: uvicorn asgi_app:app --workers 2
+# Training and model management routes are served by app.py
+from api.src.startup import startup
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import numpy as np
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from api.src.batching import AsyncMicroBatcher
+from api.src.cache import model_cache, prediction_cache
+from api.src.dao import get_async_mongo_dao, init_daos, shutdown_daos
+from api.src.metrics import STAGE_SECONDS, process_memory, registry
+from api.src.serving import ModelLoadError, configure_prediction_cache, \
+    get_trainer, parse_batch_texts
+from api.src.warmup import TrafficCounter, WarmUp
+from configurator import get_config
+from logger import create_logger
+
+logger = create_logger()
+startup.mark("imports")
+cfg = get_config()
+startup.mark("config")
+model_cache.configure(**cfg.cache.models)
+configure_prediction_cache(cfg)
+traffic = TrafficCounter(cfg, cfg.warmup.traffic_flush_s)
+warmup = WarmUp(cfg, lambda _id: get_trainer(cfg, _id, logger=logger)[1],
+                logger)
+asgi_cfg = cfg.asgi
+batcher = AsyncMicroBatcher(**cfg.batching)
+registry.register(batcher.histogram)
+# CPU-bound predicts and blocking I/O don't wait for each other
+predict_pool = ThreadPoolExecutor(asgi_cfg.predict_workers,
+                                  thread_name_prefix="predict")
+io_pool = ThreadPoolExecutor(asgi_cfg.io_workers, thread_name_prefix="io")
+inflight = 0
+
+
+def failed(message: str, code: int) -> JSONResponse:
+    return JSONResponse({"status": "Failed", "message": message}, code)
+
+
+async def run_in(pool, func, *args):
+    return await asyncio.get_running_loop().run_in_executor(
+        pool, functools.partial(func, *args))
+
+
+async def cache_call(func, *args):
+    # Shared tier of prediction cache talks to Mongo synchronously
+    if prediction_cache.dao is None:
+        return func(*args)
+    return await run_in(io_pool, func, *args)
+
+
+def bounded(handler):
+    """ Reject predictions above `asgi.max_inflight` with 503 """
+    @functools.wraps(handler)
+    async def wrapper(request: Request):
+        global inflight
+        if inflight >= asgi_cfg.max_inflight:
+            return failed("Too many predictions in flight, retry later", 503)
+        inflight += 1
+        try:
+            return await handler(request)
+        finally:
+            inflight -= 1
+    return wrapper
+
+
+async def find_model(_id: str, operation: str) -> dict:
+    """ Same as `api.src.serving.get_model_doc`, but with Motor
+
+    Raises:
+        ModelLoadError: with HTTP code to respond with
+    """
+    try:
+        with STAGE_SECONDS.time(operation=operation, stage="mongo_lookup"):
+            doc = await get_async_mongo_dao(cfg).find_by_id(_id)
+    except Exception as e:
+        raise ModelLoadError("Error occured while Mongo reaching. \
+            Original message: " + getattr(e, "message", repr(e)), 408)
+    if doc is None:
+        raise ModelLoadError("Not found any model by provided ID", 404)
+    io_pool.submit(traffic.hit, _id)
+    return doc
+
+
+async def find_trainer(_id: str, doc: dict, operation: str):
+    """ Cached trainer, loaded in I/O pool on miss
+
+    Raises:
+        ModelLoadError: with HTTP code to respond with
+    """
+    with STAGE_SECONDS.time(operation=operation, stage="model_load"):
+        trainer = model_cache.get(_id, doc.get("updatedTimeS"),
+                                  count_miss=False)
+        if trainer is None:
+            _, trainer = await run_in(io_pool, get_trainer, cfg, _id, doc,
+                                      logger)
+    return trainer
+
+
+def predict_texts(trainer, texts: list) -> list:
+    with STAGE_SECONDS.time(operation="predict", stage="vectorize"):
+        features = trainer.transform(np.array(texts, dtype=object))
+    with STAGE_SECONDS.time(operation="predict", stage="classify"):
+        predictions = trainer.predict_features(features)
+    with STAGE_SECONDS.time(operation="predict", stage="serialize"):
+        return [str(p) for p in predictions]
+
+
+@bounded
+async def model_predict(request: Request):
+    _id = request.path_params["_id"]
+    try:
+        text = (await request.json())["text"]
+    except Exception as e:
+        return failed("Bad request. Expected JSON with 'text'. \
+            Original message: " + getattr(e, "message", repr(e)), 400)
+    try:
+        doc = await find_model(_id, "predict")
+    except ModelLoadError as e:
+        return failed(e.message, e.code)
+
+    version = doc.get("updatedTimeS")
+    with STAGE_SECONDS.time(operation="predict", stage="cache_lookup"):
+        cached = await cache_call(prediction_cache.get, _id, version, text)
+    if cached is None:
+        try:
+            trainer = await find_trainer(_id, doc, "predict")
+        except ModelLoadError as e:
+            return failed(e.message, e.code)
+        try:
+            cached = await batcher.predict_async(
+                (_id, version), text,
+                lambda texts: run_in(predict_pool, predict_texts,
+                                     trainer, texts))
+        except IndexError:
+            return failed("Model made no predictions", 401)
+        except Exception as e:
+            return failed("Unable to predict for text. Original message: "
+                          + getattr(e, "message", repr(e)), 401)
+        await cache_call(prediction_cache.put, _id, version, text, cached)
+    return JSONResponse({
+        "status": "OK",
+        "message": "Model succesfully predicted!",
+        "prediction": cached,
+    }, 201)
+
+
+@bounded
+async def model_predict_batch(request: Request):
+    _id = request.path_params["_id"]
+    try:
+        texts = parse_batch_texts(
+            request.headers.get("content-type", "").split(";")[0].strip(),
+            (await request.body()).decode("utf-8"))
+        with_scores = request.query_params.get("scores", "false").lower() \
+            in ("1", "true", "yes")
+    except Exception as e:
+        return failed("Bad request. Expected JSON with 'texts' list \
+                or NDJSON. Original message: "
+                      + getattr(e, "message", repr(e)), 400)
+    try:
+        doc = await find_model(_id, "predict_batch")
+    except ModelLoadError as e:
+        return failed(e.message, e.code)
+
+    # Scores are not cached, only labels
+    version = doc.get("updatedTimeS")
+    with STAGE_SECONDS.time(operation="predict_batch", stage="cache_lookup"):
+        cached = {} if with_scores else await cache_call(
+            prediction_cache.get_many, _id, version, texts)
+    missing = [i for i in range(len(texts)) if i not in cached]
+    predictions = [cached.get(i) for i in range(len(texts))]
+
+    result = {
+        "status": "OK",
+        "message": "Model succesfully predicted!",
+        "predictions": predictions,
+    }
+    if not missing and not with_scores:
+        return JSONResponse(result, 201)
+
+    try:
+        trainer = await find_trainer(_id, doc, "predict_batch")
+    except ModelLoadError as e:
+        return failed(e.message, e.code)
+    chunk_size = cfg[doc["model_type"]].get("predict_chunk_size", 10000)
+    missing_texts = [texts[i] for i in missing]
+    try:
+        with STAGE_SECONDS.time(operation="predict_batch", stage="predict"):
+            predicted, scores = await run_in(
+                predict_pool, trainer.predict_chunked,
+                np.array(missing_texts, dtype=object), chunk_size,
+                with_scores)
+    except Exception as e:
+        return failed("Unable to predict for texts. Original message: "
+                      + getattr(e, "message", repr(e)), 401)
+    predicted = [str(p) for p in predicted]
+    for i, prediction in zip(missing, predicted):
+        predictions[i] = prediction
+    await cache_call(prediction_cache.put_many, _id, version, missing_texts,
+                     predicted)
+    if with_scores:
+        result["classes"] = [str(c) for c in trainer.classes()]
+        result["scores"] = scores.tolist()  # type:ignore
+    return JSONResponse(result, 201)
+
+
+async def health(request: Request):
+    ready = warmup.ready.is_set()
+    return JSONResponse({
+        "status": "OK" if ready else "Warming up",
+        "ready": ready,
+        "warmup": warmup.summary,
+        "startup": startup.summary,
+        "memory": process_memory(),
+        "inflight": inflight,
+    }, 201 if ready else 503)
+
+
+async def cache_stats(request: Request):
+    return JSONResponse({"models": model_cache.stats(),
+                         "predictions": prediction_cache.stats()}, 201)
+
+
+async def batching_stats(request: Request):
+    return JSONResponse(batcher.stats(), 201)
+
+
+async def metrics(request: Request):
+    return Response(registry.render(), 200,
+                    media_type="text/plain; version=0.0.4")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        await run_in(io_pool, init_daos, cfg)
+    except Exception as e:
+        logger.warning("Unable to init DAOs at startup, will retry lazily: " +
+                       getattr(e, "message", repr(e)))
+    startup.mark("init_daos")
+    warmup.start()
+    startup.report(cfg.flask.get("startup_budget_s"), logger)
+    yield
+    await run_in(io_pool, traffic.flush)
+    predict_pool.shutdown(wait=False)
+    io_pool.shutdown(wait=False)
+    shutdown_daos()
+
+
+app = Starlette(routes=[
+    Route("/models/{_id}/predict", model_predict, methods=["POST"]),
+    Route("/models/{_id}/predict_batch", model_predict_batch,
+          methods=["POST"]),
+    Route("/health", health),
+    Route("/cache/stats", cache_stats),
+    Route("/batching/stats", batching_stats),
+    Route("/metrics", metrics),
+], lifespan=lifespan)
+startup.mark("init_app")
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=asgi_cfg.host, port=asgi_cfg.port,
+                backlog=asgi_cfg.backlog)
@@ -0,0 +1,122 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import bson
+import mongomock
+import numpy as np
+from starlette.applications import Starlette
+from starlette.testclient import TestClient
+
+import asgi_app
+from api.src.dao import AsyncMongoDAO, get_mongo_dao, shutdown_daos
+from api.src.trainer import ModelTrainer
+from benchmarks.fakes import FsMinio
+
+TEXTS = ["гараж кирпичный", "телефон новый", "гараж бокс", "телефон в чехле",
+         "гараж у метро", "телефон б/у"]
+LABELS = ["garage", "phone"] * 3
+
+
+class AsyncCollection():
+    """ Motor-like reads over mongomock collection """
+    def __init__(self, collection) -> None:
+        self.collection = collection
+
+    async def find_one(self, *args, **kwargs):
+        return self.collection.find_one(*args, **kwargs)
+
+
+class TestAsgiApp(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cfg = asgi_app.cfg
+        self.saved_cache_dir = self.cfg.artifacts.cache_dir
+        self.cfg.artifacts.cache_dir = os.path.join(self.root, "artifacts")
+        client = mongomock.MongoClient()
+        self.patches = [
+            patch("pymongo.MongoClient", lambda *args, **kwargs: client),
+            patch("minio.Minio", lambda *args, **kwargs: FsMinio(
+                os.path.join(self.root, "s3"))),
+            patch.object(asgi_app, "get_async_mongo_dao",
+                         lambda cfg: AsyncMongoDAO(AsyncCollection(
+                             get_mongo_dao(cfg).collection))),
+        ]
+        for p in self.patches:
+            p.start()
+        shutdown_daos()
+
+        trainer = ModelTrainer(self.cfg.logreg.model, self.cfg.logreg.tfidf,
+                               model_params={}, common_cfg=self.cfg,
+                               model_type="logreg", logger=asgi_app.logger)
+        trainer.fit(np.array(TEXTS, dtype=object), np.array(LABELS))
+        self.pipeline = trainer.pipeline
+        self._id = trainer.save_model()
+        # Routes only: app lifespan shuts down module-wide pools
+        self.client = TestClient(Starlette(routes=asgi_app.app.routes))
+        self.client.__enter__()
+
+    def tearDown(self):
+        self.client.__exit__(None, None, None)
+        for p in self.patches:
+            p.stop()
+        shutdown_daos()
+        self.cfg.artifacts.cache_dir = self.saved_cache_dir
+        shutil.rmtree(self.root)
+
+    def test_predict(self):
+        for text in TEXTS[:2] * 2:
+            response = self.client.post(f"/models/{self._id}/predict",
+                                        json={"text": text})
+            self.assertEqual(response.status_code, 201, response.json())
+            self.assertEqual(response.json()["prediction"],
+                             self.pipeline.predict([text])[0])
+        response = self.client.post(f"/models/{self._id}/predict",
+                                    json={"texts": TEXTS})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(asgi_app.inflight, 0)
+
+    def test_predict_batch(self):
+        expected = list(self.pipeline.predict(TEXTS))
+        response = self.client.post(f"/models/{self._id}/predict_batch",
+                                    json={"texts": TEXTS})
+        self.assertEqual(response.status_code, 201, response.json())
+        self.assertEqual(response.json()["predictions"], expected)
+
+        response = self.client.post(
+            f"/models/{self._id}/predict_batch", params={"scores": "true"},
+            content="\n".join(json.dumps(text) for text in TEXTS),
+            headers={"content-type": "application/x-ndjson"})
+        self.assertEqual(response.status_code, 201, response.json())
+        self.assertEqual(response.json()["predictions"], expected)
+        self.assertEqual(response.json()["classes"], ["garage", "phone"])
+        np.testing.assert_allclose(response.json()["scores"],
+                                   self.pipeline.decision_function(TEXTS))
+
+    def test_unknown_model(self):
+        for route, body in (("predict", {"text": TEXTS[0]}),
+                            ("predict_batch", {"texts": TEXTS})):
+            response = self.client.post(
+                f"/models/{bson.ObjectId()}/{route}", json=body)
+            self.assertEqual(response.status_code, 404, route)
+            self.assertEqual(response.json()["status"], "Failed")
+
+    def test_inflight_limit(self):
+        limit = asgi_app.asgi_cfg.max_inflight
+        with patch.object(asgi_app, "inflight", limit):
+            for route, body in (("predict", {"text": TEXTS[0]}),
+                                ("predict_batch", {"texts": TEXTS})):
+                response = self.client.post(
+                    f"/models/{self._id}/{route}", json=body)
+                self.assertEqual(response.status_code, 503, route)
+            self.assertEqual(asgi_app.inflight, limit)
+        response = self.client.post(f"/models/{self._id}/predict",
+                                    json={"text": TEXTS[0]})
+        self.assertEqual(response.status_code, 201)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import asyncio
+from unittest import TestCase, main
+from concurrent.futures import ThreadPoolExecutor
+from api.src.batching import AsyncMicroBatcher, MicroBatcher
+
+
+class TestMicroBatcher(TestCase):
+    def test_concurrent_texts_share_batch(self):
+        batcher = MicroBatcher(window_ms=200, max_batch_size=4)
+        calls = []
+
+        def predict(texts):
+            calls.append(len(texts))
+            return [text.upper() for text in texts]
+
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(
+                lambda text: batcher.predict("model", text, predict),
+                ["a", "b", "c", "d"]))
+        self.assertEqual(results, ["A", "B", "C", "D"])
+        self.assertEqual(calls, [4])
+        self.assertEqual(batcher.stats()["batch_size"]["buckets"]["2"], 0)
+        self.assertEqual(batcher.stats()["batch_size"]["buckets"]["4"], 1)
+
+    def test_errors_reach_every_request(self):
+        batcher = MicroBatcher(window_ms=1, max_batch_size=4)
+
+        def predict(texts):
+            raise ValueError("broken model")
+
+        with self.assertRaises(ValueError):
+            batcher.predict("model", "a", predict)
+
+
+class TestAsyncMicroBatcher(TestCase):
+    def test_concurrent_texts_share_batch(self):
+        calls = []
+
+        async def predict(texts):
+            calls.append(len(texts))
+            return [text.upper() for text in texts]
+
+        async def run():
+            batcher = AsyncMicroBatcher(window_ms=50, max_batch_size=3)
+            return await asyncio.gather(*[
+                batcher.predict_async("model", text, predict)
+                for text in "abcd"])
+
+        self.assertEqual(asyncio.run(run()), ["A", "B", "C", "D"])
+        self.assertEqual(calls, [3, 1])
+
+
+if __name__ == '__main__':
+    main()
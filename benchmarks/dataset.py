@@ -0,0 +1,57 @@
+# Synthetic marketplace listings shaped like the real dataset
+import numpy as np
+import pandas as pd
+
+CATEGORIES = {
+    0: "гараж бокс ворота погреб кирпичный охрана свет яма",
+    1: "автомобиль двигатель пробег колеса седан коробка резина салон",
+    2: "квартира комната ремонт этаж балкон санузел кухня метро",
+    3: "телефон экран память зарядка чехол камера батарея смартфон",
+    4: "диван кресло шкаф стол стул кровать матрас комод",
+    5: "куртка пальто ботинки платье джинсы размер кроссовки шапка",
+    6: "ноутбук процессор видеокарта монитор клавиатура диск мышь",
+    7: "коляска игрушки конструктор велосипед самокат кроватка",
+}
+COMMON = ("продам срочно недорого отличное состояние торг возможен "
+          "доставка новый б/у самовывоз обмен звоните пишите оригинал")
+
+
+def make_listings(n_rows: int, seed: int = 0,
+                  duplicate_share: float = 0.2) -> pd.DataFrame:
+    """ Listings with `title`, `description` and `Category` columns
+
+    Args:
+        n_rows (int): number of listings
+        seed (int): random seed, same seed gives the same dataset
+        duplicate_share (float): share of reposted (duplicate) listings
+
+    Returns:
+        pd.DataFrame: listings
+    """
+    rng = np.random.default_rng(seed)
+    common = np.array(COMMON.split())
+    vocab = {c: np.array(words.split()) for c, words in CATEGORIES.items()}
+    categories = rng.integers(0, len(CATEGORIES), n_rows)
+    titles, descriptions = [], []
+    for i, category in enumerate(categories):
+        if i and rng.random() < duplicate_share:
+            j = int(rng.integers(0, i))
+            categories[i] = categories[j]
+            titles.append(titles[j])
+            descriptions.append(descriptions[j])
+            continue
+        words = vocab[category]
+        titles.append(" ".join(rng.choice(words, 3)))
+        description = np.concatenate([rng.choice(words, 8),
+                                      rng.choice(common, 6)])
+        rng.shuffle(description)
+        descriptions.append(" ".join(description))
+    return pd.DataFrame({"title": titles, "description": descriptions,
+                         "Category": categories})
+
+
+def make_texts(n_texts: int, seed: int = 1) -> list:
+    """ Unique texts to predict for, so prediction cache is not hit """
+    df = make_listings(n_texts, seed, duplicate_share=0)
+    return [f"{title} {description} {i}" for i, (title, description)
+            in enumerate(zip(df["title"], df["description"]))]
@@ -0,0 +1,122 @@
+# In-process stand-ins for Mongo (mongomock) and MinIO (local filesystem)
+import hashlib
+import io
+import os
+import shutil
+import types
+
+import minio
+import pymongo
+from minio.error import S3Error
+
+
+class _Response(io.BytesIO):
+    """ Mimics urllib3 response returned by `Minio.get_object` """
+
+    def __init__(self, data: bytes) -> None:
+        super().__init__(data)
+        self.headers = {"Content-Length": str(len(data))}
+
+    def stream(self, amt: int = 64 * 1024):
+        while True:
+            chunk = self.read(amt)
+            if not chunk:
+                break
+            yield chunk
+
+    def release_conn(self) -> None:
+        pass
+
+
+class FsMinio():
+    def __init__(self, root: str) -> None:
+        """ Subset of `minio.Minio` API used by MinioDAO, objects are files
+
+        Args:
+            root (str): directory to keep buckets in
+        """
+        self.root = root
+
+    def _path(self, bucket_name: str, object_name: str = "") -> str:
+        return os.path.join(self.root, bucket_name, object_name)
+
+    def _check(self, bucket_name: str, object_name: str) -> str:
+        path = self._path(bucket_name, object_name)
+        if not os.path.isfile(path):
+            raise S3Error(code="NoSuchKey", message="Object does not exist",
+                          resource=f"/{bucket_name}/{object_name}",
+                          request_id="", host_id="", response=None,
+                          bucket_name=bucket_name, object_name=object_name)
+        return path
+
+    @staticmethod
+    def _etag(path: str) -> str:
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def bucket_exists(self, bucket_name: str) -> bool:
+        return os.path.isdir(self._path(bucket_name))
+
+    def make_bucket(self, bucket_name: str) -> None:
+        os.makedirs(self._path(bucket_name), exist_ok=True)
+
+    def fput_object(self, bucket_name: str, object_name: str,
+                    file_path: str, **_):
+        path = self._path(bucket_name, object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(file_path, path)
+        return types.SimpleNamespace(etag=self._etag(path),
+                                     object_name=object_name)
+
+    def put_object(self, bucket_name: str, object_name: str, data,
+                   length: int, **_):
+        path = self._path(bucket_name, object_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(data, f)
+        return types.SimpleNamespace(etag=self._etag(path),
+                                     object_name=object_name)
+
+    def get_object(self, bucket_name: str, object_name: str,
+                   offset: int = 0, length: int = 0, **_) -> _Response:
+        with open(self._check(bucket_name, object_name), "rb") as f:
+            f.seek(offset)
+            return _Response(f.read(length) if length else f.read())
+
+    def fget_object(self, bucket_name: str, object_name: str,
+                    file_path: str, **_) -> None:
+        shutil.copyfile(self._check(bucket_name, object_name), file_path)
+
+    def stat_object(self, bucket_name: str, object_name: str, **_):
+        path = self._check(bucket_name, object_name)
+        return types.SimpleNamespace(etag=self._etag(path),
+                                     size=os.path.getsize(path),
+                                     object_name=object_name)
+
+    def remove_object(self, bucket_name: str, object_name: str) -> None:
+        path = self._path(bucket_name, object_name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def list_objects(self, bucket_name: str, **_):
+        bucket_dir = self._path(bucket_name)
+        for root, _, names in os.walk(bucket_dir):
+            for name in names:
+                yield types.SimpleNamespace(object_name=os.path.relpath(
+                    os.path.join(root, name), bucket_dir))
+
+
+def install(root: str) -> None:
+    """ Make DAOs talk to mongomock and FsMinio, call before any DAO is made
+
+    Args:
+        root (str): directory for MinIO objects
+    """
+    import mongomock
+
+    client = mongomock.MongoClient()
+    pymongo.MongoClient = lambda *args, **kwargs: client
+    minio.Minio = lambda *args, **kwargs: FsMinio(root)
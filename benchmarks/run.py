@@ -0,0 +1,236 @@
+""" Benchmarks of the API against in-process stand-ins of Mongo and MinIO
+
+Usage:
+    python -m benchmarks.run --rows 20000 --out benchmark.json
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json
+
+Exit code is 1 if any metric regressed against baseline by more than
+`--tolerance`.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks import fakes
+from benchmarks.dataset import make_listings, make_texts
+
+
+def peak_rss_bytes() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def latency_stats(prefix: str, latencies: list) -> dict:
+    ms = np.array(latencies) * 1000
+    return {
+        f"{prefix}_p50_ms": float(np.percentile(ms, 50)),
+        f"{prefix}_p90_ms": float(np.percentile(ms, 90)),
+        f"{prefix}_p99_ms": float(np.percentile(ms, 99)),
+        f"{prefix}_mean_ms": float(ms.mean()),
+    }
+
+
+def make_client(workdir: str, rows: int, seed: int, extra_overrides: list):
+    """ Generate dataset, install fakes and import the app """
+    csv_path = os.path.join(workdir, "data.csv")
+    make_listings(rows, seed).to_csv(csv_path)
+    overrides = [
+        f"dataset.out_path={csv_path}",
+        f"dataset.cache_dir={os.path.join(workdir, 'cache')}",
+        f"artifacts.cache_dir={os.path.join(workdir, 'artifacts')}",
+        "warmup.enabled=false",
+        # Jobs must see the same in-process fakes
+        "jobs.executor=thread",
+    ] + extra_overrides
+    os.environ["CONFIG_OVERRIDES"] = " ".join(overrides)
+    # Overrides point to a fresh workdir, cached config would never be reused
+    os.environ["CONFIG_CACHE"] = "0"
+    fakes.install(os.path.join(workdir, "minio"))
+
+    from app import app, boot
+    boot()
+    return app.test_client()
+
+
+def train(client, model_type: str, params: dict,
+          timeout: float = 3600) -> tuple:
+    """ Submit /models/add and wait for the job
+
+    Returns:
+        (str, float, dict): model ID, wall time and job stage timings
+    """
+    start = time.perf_counter()
+    response = client.post("/models/add", json={"type": model_type,
+                                                "params": repr(params)})
+    if response.status_code != 202:
+        raise RuntimeError(f"Unable to submit training: {response.json}")
+    job_id = response.json["job_id"]
+    while time.perf_counter() - start < timeout:
+        job = client.get(f"/jobs/{job_id}").json
+        if job.get("status") in ("done", "failed"):
+            break
+        time.sleep(0.05)
+    else:
+        raise TimeoutError(f"Training job {job_id} is not finished")
+    elapsed = time.perf_counter() - start
+    if job["status"] != "done":
+        raise RuntimeError(f"Training failed: {job.get('error')}")
+    return job["result"]["model_id"], elapsed, job.get("timings", {})
+
+
+def bench_predict(client_factory, model_id: str, texts: list,
+                  concurrency: int) -> dict:
+    def predict(text):
+        client = client_factory()
+        start = time.perf_counter()
+        response = client.post(f"/models/{model_id}/predict",
+                               json={"text": text})
+        if response.status_code != 201:
+            raise RuntimeError(f"Predict failed: {response.json}")
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(predict, texts))
+    elapsed = time.perf_counter() - start
+    return {**latency_stats("predict", latencies),
+            "predict_requests_per_s": len(texts) / elapsed}
+
+
+def bench_batch(client, model_id: str, texts: list, batch_size: int) -> dict:
+    latencies = []
+    for i in range(0, len(texts), batch_size):
+        start = time.perf_counter()
+        response = client.post(f"/models/{model_id}/predict_batch",
+                               json={"texts": texts[i:i + batch_size]})
+        if response.status_code != 201:
+            raise RuntimeError(f"Batch predict failed: {response.json}")
+        latencies.append(time.perf_counter() - start)
+    return {**latency_stats("batch", latencies),
+            "batch_texts_per_s": len(texts) / sum(latencies)}
+
+
+def compare(metrics: dict, baseline: dict, tolerance: float) -> dict:
+    """ Relative change of every metric, `_per_s` ones are better bigger
+
+    Returns:
+        dict: metric -> {"baseline", "current", "change", "regressed"}
+    """
+    report = {}
+    for name, base in baseline.items():
+        current = metrics.get(name)
+        if current is None or not base:
+            continue
+        change = (current - base) / base
+        worse = -change if name.endswith("_per_s") else change
+        report[name] = {"baseline": base, "current": current,
+                        "change": change, "regressed": worse > tolerance}
+    return report
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="mlops-bench-")
+    client = make_client(workdir, args.rows, args.seed, args.override)
+    from app import app
+
+    metrics, timings = {}, {}
+    _, metrics["train_cold_s"], timings["train_cold"] = train(
+        client, args.model_type, {"C": 1.0})
+    # Same vectorizer config, so fitted features are reused
+    model_id, metrics["train_warm_s"], timings["train_warm"] = train(
+        client, args.model_type, {"C": 0.5})
+    metrics["train_peak_rss_bytes"] = peak_rss_bytes()
+
+    texts = make_texts(args.requests + args.batches * args.batch_size,
+                       args.seed + 1)
+    start = time.perf_counter()
+    client.post(f"/models/{model_id}/predict", json={"text": "прогрев"})
+    metrics["predict_first_ms"] = (time.perf_counter() - start) * 1000
+    metrics.update(bench_predict(app.test_client, model_id,
+                                 texts[:args.requests], args.concurrency))
+    metrics.update(bench_batch(client, model_id, texts[args.requests:],
+                               args.batch_size))
+    metrics["peak_rss_bytes"] = peak_rss_bytes()
+
+    return {
+        "meta": {
+            "rows": args.rows,
+            "seed": args.seed,
+            "model_type": args.model_type,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "batches": args.batches,
+            "batch_size": args.batch_size,
+            "overrides": args.override,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.time(),
+        },
+        "metrics": metrics,
+        "timings": timings,
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rows", type=int, default=20000,
+                        help="synthetic dataset size")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--model-type", default="linearSVC")
+    parser.add_argument("--requests", type=int, default=500,
+                        help="number of single predictions")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="threads sending single predictions")
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--override", action="append", default=[],
+                        help="hydra config override, e.g. batching.enabled=false")
+    parser.add_argument("--out", default="benchmark.json",
+                        help="path to write results JSON to")
+    parser.add_argument("--baseline", help="results JSON to compare with")
+    parser.add_argument("--save-baseline", help="path to store results as "
+                        "the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    regressed = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["metrics"]
+        results["comparison"] = compare(results["metrics"], baseline,
+                                        args.tolerance)
+        regressed = [name for name, entry in results["comparison"].items()
+                     if entry["regressed"]]
+        results["regressed"] = regressed
+
+    text = json.dumps(results, indent=2, ensure_ascii=False)
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, "w") as f:
+            f.write(text)
+
+    # App logs go to stdout too, so only a summary is printed
+    comparison = results.get("comparison", {})
+    for name, value in results["metrics"].items():
+        line = f"{name:>24}: {value:.4g}"
+        if name in comparison:
+            entry = comparison[name]
+            line += f" ({entry['change']:+.1%} vs baseline" + \
+                (", REGRESSED)" if entry["regressed"] else ")")
+        print(line)
+    return 1 if regressed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
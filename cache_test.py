@@ -0,0 +1,60 @@
+from unittest import TestCase, main
+import numpy as np
+from api.src.cache import ModelCache, PredictionCache
+
+
+class TestModelCache(TestCase):
+    def test_hit_miss_and_version(self):
+        cache = ModelCache(max_items=2, max_bytes=1024)
+        loads = []
+
+        def loader():
+            loads.append(1)
+            return "model"
+
+        self.assertEqual(cache.get_or_load("a", 1, loader, len), "model")
+        self.assertEqual(cache.get_or_load("a", 1, loader, len), "model")
+        self.assertEqual(len(loads), 1)
+        # Retrained model has another updatedTimeS
+        cache.get_or_load("a", 2, loader, len)
+        self.assertEqual(len(loads), 2)
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+
+    def test_eviction_by_count_and_bytes(self):
+        cache = ModelCache(max_items=2, max_bytes=100)
+        cache.put("a", 0, np.zeros(5), 40)
+        cache.put("b", 0, np.zeros(5), 40)
+        cache.get("a", 0)
+        cache.put("c", 0, np.zeros(5), 40)
+        self.assertIsNone(cache.get("b", 0))
+        self.assertIsNotNone(cache.get("a", 0))
+        cache.put("d", 0, np.zeros(5), 90)
+        self.assertEqual(cache.stats()["items"], 1)
+        self.assertEqual(cache.stats()["evictions"], 3)
+
+    def test_invalidate(self):
+        cache = ModelCache()
+        cache.put("a", 0, "model", 1)
+        cache.invalidate("a")
+        self.assertIsNone(cache.get("a", 0))
+        self.assertEqual(cache.stats()["bytes"], 0)
+
+
+class TestPredictionCache(TestCase):
+    def test_normalized_versioned_keys(self):
+        cache = PredictionCache(max_items=2)
+        cache.put("a", 1, "Selling  iPhone ", "phones")
+        self.assertEqual(cache.get("a", 1, "selling iphone"), "phones")
+        # Retrained model has another version
+        self.assertIsNone(cache.get("a", 2, "selling iphone"))
+        found = cache.get_many("a", 1, ["x", "SELLING IPHONE"])
+        self.assertEqual(found, {1: "phones"})
+        cache.invalidate("a")
+        self.assertIsNone(cache.get("a", 1, "selling iphone"))
+        self.assertEqual(cache.stats()["hits"], 2)
+
+
+if __name__ == '__main__':
+    main()
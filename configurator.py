@@ -1,10 +1,55 @@
-from hydra import initialize, compose
+from omegaconf import DictConfig, OmegaConf
+import glob
+import hashlib
+import logging
 import os
 
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_DIR = os.path.join(ROOT_DIR, "configs")
+
+
+def _cache_path(overrides: list) -> str:
+    """ Resolved config file keyed by config sources and overrides """
+    digest = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(CONFIG_DIR, "*.yaml"))):
+        digest.update(os.path.basename(path).encode())
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    digest.update(repr(overrides).encode())
+    cache_dir = os.getenv("CONFIG_CACHE_DIR",
+                          os.path.join(ROOT_DIR, ".config_cache"))
+    return os.path.join(cache_dir, f"config.{digest.hexdigest()[:16]}.yaml")
+
+
+def _compose(overrides: list) -> DictConfig:
+    # Hydra is slow to import and compose, only done on cache miss
+    from hydra import initialize, compose
+    from hydra.core.global_hydra import GlobalHydra
+    # gunicorn.conf.py composes config before the app is imported
+    if not GlobalHydra.instance().is_initialized():
+        initialize(version_base=None, config_path="./configs")
+    return compose("config.yaml", overrides=overrides)
+
 
 def get_config():
-    initialize(version_base=None, config_path="./configs")
-    cfg = compose("config.yaml")
+    # e.g. CONFIG_OVERRIDES="warmup.enabled=false jobs.executor=thread"
+    overrides = os.getenv("CONFIG_OVERRIDES", "").split()
+    use_cache = os.getenv("CONFIG_CACHE", "1") != "0"
+    path = _cache_path(overrides) if use_cache else ""
+    if use_cache and os.path.exists(path):
+        cfg = OmegaConf.load(path)
+        OmegaConf.set_struct(cfg, True)
+    else:
+        cfg = _compose(overrides)
+        if use_cache:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(OmegaConf.to_yaml(cfg, resolve=True))
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logging.warning(f"Unable to cache resolved config: {e!r}")
     if os.getenv("RUNTIME_DC"):
         cfg.minio.host = os.environ["MINIO_HOST"]
         cfg.mongo.host = os.environ["MONGO_HOST"]
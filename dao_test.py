@@ -0,0 +1,170 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import bson
+import mongomock
+from minio.error import S3Error
+
+from api.src.dao import MinioDAO, MongoDAO, get_mongo_dao, shutdown_daos
+from benchmarks.fakes import FsMinio
+from configurator import get_config
+
+
+class TestMongoDAO(TestCase):
+    def setUp(self):
+        self.dao = MongoDAO("mock", "27017", "mlopsdb", "models",
+                            client=mongomock.MongoClient())
+
+    def test_upsert(self):
+        _id = str(bson.ObjectId())
+        self.assertEqual(self.dao.upsert(_id, {"version": 1},
+                                         on_insert={"createdTimeS": 1.0}),
+                         _id)
+        # createdTimeS is kept on update, fields set by both are updated
+        self.dao.upsert(_id, {"version": 2, "updatedTimeS": 2.0},
+                        on_insert={"createdTimeS": 2.0, "updatedTimeS": 0.0})
+        doc = self.dao.find_by_id(_id)
+        self.assertEqual(
+            (doc["version"], doc["createdTimeS"], doc["updatedTimeS"]),
+            (2, 1.0, 2.0))
+        self.assertEqual(self.dao.collection.count_documents({}), 1)
+
+    def test_bulk_upsert(self):
+        ids = [str(bson.ObjectId()) for _ in range(3)]
+        self.assertEqual(self.dao.bulk_upsert({}),
+                         {"upserted": 0, "matched": 0, "modified": 0})
+        self.dao.upsert(ids[0], {"score": 0.0},
+                        on_insert={"createdTimeS": 1.0})
+
+        result = self.dao.bulk_upsert(
+            {_id: {"score": i / 2} for i, _id in enumerate(ids)},
+            on_insert={"createdTimeS": 5.0})
+        self.assertEqual(result, {"upserted": 2, "matched": 1,
+                                  "modified": 0})
+        docs = {str(doc["_id"]): doc for doc in self.dao.list_documents()}
+        self.assertEqual([(docs[_id]["score"], docs[_id]["createdTimeS"])
+                          for _id in ids],
+                         [(0.0, 1.0), (0.5, 5.0), (1.0, 5.0)])
+
+    def test_upsert_previous(self):
+        _id = str(bson.ObjectId())
+        self.assertIsNone(self.dao.upsert_previous(
+            _id, {"version": 1}, on_insert={"createdTimeS": 1.0}))
+        previous = self.dao.upsert_previous(
+            _id, {"version": 2}, on_insert={"createdTimeS": 2.0})
+        self.assertEqual((previous["version"], previous["createdTimeS"]),
+                         (1, 1.0))
+        self.assertEqual(self.dao.find_by_id(_id)["version"], 2)
+
+    def test_increment_by_key_filter(self):
+        self.assertEqual(self.dao.increment_by_key("blob", "refs", 1), 1)
+        self.assertEqual(self.dao.update_by_key(
+            "blob", {"deleting": 1.0}, filter={"refs": {"$lte": 0}}), 0)
+        self.dao.increment_by_key("blob", "refs", -1)
+        self.assertEqual(self.dao.update_by_key(
+            "blob", {"deleting": 1.0}, filter={"refs": {"$lte": 0}}), 1)
+        # Claimed document is neither updated nor replaced
+        self.assertIsNone(self.dao.increment_by_key(
+            "blob", "refs", 1, filter={"deleting": {"$exists": False}}))
+        self.assertEqual(list(self.dao.find_by_keys(["blob"]))[0]["refs"], 0)
+
+
+class TestMinioDAO(TestCase):
+    bucket = "models"
+    data = bytes(range(256)) * 64
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.dao = MinioDAO("fs", "", "", "", self.bucket,
+                            client=FsMinio(os.path.join(self.root, "s3")))
+        path = os.path.join(self.root, "model.pk")
+        with open(path, "wb") as f:
+            f.write(self.data)
+        self.dao.save_to_bucket(self.bucket, "blobs/model.pk", path)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_stream(self):
+        with self.dao.get_stream(self.bucket, "blobs/model.pk") as stream:
+            self.assertEqual(b"".join(stream.stream(1000)), self.data)
+        # Response is closed on exit
+        self.assertTrue(stream.closed)
+        with self.dao.get_stream(self.bucket, "blobs/model.pk",
+                                 offset=16000) as stream:
+            self.assertEqual(stream.read(), self.data[16000:])
+
+    def test_range(self):
+        self.assertEqual(
+            self.dao.get_range(self.bucket, "blobs/model.pk", 1000, 300),
+            self.data[1000:1300])
+
+    def test_stat(self):
+        stat = self.dao.stat(self.bucket, "blobs/model.pk")
+        self.assertEqual((stat.size, stat.etag),
+                         (len(self.data), hashlib.md5(self.data).hexdigest()))
+        self.assertTrue(self.dao.exists(self.bucket, "blobs/model.pk"))
+
+    def test_missing_object(self):
+        self.assertIsNone(self.dao.stat(self.bucket, "blobs/missing.pk"))
+        self.assertFalse(self.dao.exists(self.bucket, "blobs/missing.pk"))
+        self.assertIsNone(self.dao.get_from_bucket(self.bucket,
+                                                   "blobs/missing.pk"))
+        with self.assertRaises(S3Error):
+            self.dao.get_range(self.bucket, "blobs/missing.pk", 0, 10)
+
+
+class ClosingClient(mongomock.MongoClient):
+    closes = 0
+
+    def close(self):
+        self.closes += 1
+
+
+class TestSharedClients(TestCase):
+    def setUp(self):
+        self.cfg = get_config()
+        self.clients = []
+
+        def connect(*args, **kwargs):
+            self.clients.append(ClosingClient())
+            return self.clients[-1]
+
+        self.patch = patch("pymongo.MongoClient", connect)
+        self.patch.start()
+        shutdown_daos()
+
+    def tearDown(self):
+        shutdown_daos()
+        self.patch.stop()
+
+    def test_pooled_client_is_reused(self):
+        daos = [get_mongo_dao(self.cfg), get_mongo_dao(self.cfg),
+                get_mongo_dao(self.cfg, self.cfg.mongo.jobs_collection)]
+        self.assertEqual(len(self.clients), 1)
+        self.assertTrue(all(dao.client is self.clients[0] for dao in daos))
+        # Shared client outlives DAOs using it
+        daos[0].shutdown()
+        self.assertEqual(self.clients[0].closes, 0)
+
+    def test_fresh_clients_after_fork(self):
+        parent = get_mongo_dao(self.cfg).client
+        with patch("os.getpid", return_value=os.getpid() + 1):
+            # Child drops inherited client without closing parent's sockets
+            shutdown_daos()
+            self.assertEqual(parent.closes, 0)
+            child = get_mongo_dao(self.cfg).client
+            self.assertIsNot(child, parent)
+            self.assertIs(get_mongo_dao(self.cfg).client, child)
+            shutdown_daos()
+            self.assertEqual(child.closes, 1)
+            self.assertIsNot(get_mongo_dao(self.cfg).client, child)
+        self.assertEqual(len(self.clients), 3)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import os
+import tempfile
+from unittest import TestCase, main
+
+import numpy as np
+import pandas as pd
+
+from api.src.data_preproccesor import DatasetCache, stable_test_mask
+
+
+class TestDatasetCache(TestCase):
+    def assert_round_trip(self, texts, target):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = DatasetCache(cache_dir)
+            self.assertIsNone(cache.load("etag"))
+            cache.save("etag", np.array(texts, dtype=object), target)
+            loaded_texts, loaded_target = cache.load("etag")
+            # Only the entry itself is left, no temporary dirs
+            self.assertEqual(os.listdir(cache_dir), ["etag"])
+        self.assertEqual(loaded_texts.tolist(), texts)
+        return loaded_target
+
+    def test_round_trip(self):
+        texts = ["Продам гараж", 'кавычки "и" \'так\'', "строка\nещё\r\n",
+                 "", "tab\tseparated, comma"]
+        target = self.assert_round_trip(texts, np.array([3, 1, 3, 2, 1]))
+        self.assertEqual(target.tolist(), [3, 1, 3, 2, 1])
+        self.assertEqual(target.dtype.kind, "i")
+
+        target = self.assert_round_trip(
+            texts, np.array(["Гаражи", "Телефоны", None, 5, "Гаражи"],
+                            dtype=object))
+        self.assertEqual(target.tolist(),
+                         ["Гаражи", "Телефоны", "None", "5", "Гаражи"])
+
+    def test_empty(self):
+        target = self.assert_round_trip([], np.array([], dtype=int))
+        self.assertEqual(len(target), 0)
+
+    def test_concurrent_save_keeps_entry(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = DatasetCache(cache_dir)
+            cache.save("etag", np.array(["a"], dtype=object), np.array([1]))
+            # Entry exists already, replacing a non-empty dir fails
+            cache.save("etag", np.array(["b"], dtype=object), np.array([2]))
+            self.assertEqual(os.listdir(cache_dir), ["etag"])
+            self.assertEqual(cache.load("etag")[0].tolist(), ["a"])
+
+
+class TestStableTestMask(TestCase):
+    def test_chunking_and_order(self):
+        ids = pd.Index(np.arange(3000))
+        mask = stable_test_mask(ids, 0.25, seed=42)
+        for chunk_size in (7, 100, 4096):
+            chunked = np.concatenate([
+                stable_test_mask(ids[i:i + chunk_size], 0.25, seed=42)
+                for i in range(0, len(ids), chunk_size)])
+            np.testing.assert_array_equal(chunked, mask)
+        order = np.random.default_rng(0).permutation(len(ids))
+        np.testing.assert_array_equal(
+            stable_test_mask(ids[order], 0.25, seed=42), mask[order])
+
+    def test_test_size(self):
+        ids = pd.Index([f"row-{i}" for i in range(20000)])
+        for test_size in (0.0, 0.1, 0.25, 1.0):
+            self.assertAlmostEqual(stable_test_mask(ids, test_size).mean(),
+                                   test_size, delta=0.01)
+        self.assertGreater((stable_test_mask(ids, 0.25, seed=1)
+                            != stable_test_mask(ids, 0.25, seed=2)).mean(),
+                           0.2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+from unittest import TestCase, main
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.svm import LinearSVC
+
+from api.src import ensemble
+
+
+class Trainer():
+    def __init__(self, pipeline) -> None:
+        self.pipeline = pipeline
+        self.transforms = 0
+
+    def transform(self, texts):
+        self.transforms += 1
+        return self.pipeline[:-1].transform(texts)
+
+    def predict_features(self, features):
+        return self.pipeline.steps[-1][1].predict(features)
+
+    def scores_features(self, features):
+        return self.pipeline.steps[-1][1].decision_function(features)
+
+
+class RecordingTrainer(Trainer):
+    def __init__(self, pipeline) -> None:
+        super().__init__(pipeline)
+        self.rows = []
+
+    def predict_features(self, features):
+        self.rows.append(features.shape[0])
+        return super().predict_features(features)
+
+
+class TestEnsemble(TestCase):
+    texts = ["Продам гараж кирпичный", "гараж бокс с ямой",
+             "телефон новый в чехле", "Смартфон: экран и батарея",
+             "диван и кресло", "шкаф, стол, стул!"]
+    labels = [0, 0, 1, 1, 2, 2]
+
+    def test_shared_transform(self):
+        vectorizer = TfidfVectorizer().fit(self.texts)
+        svc = make_pipeline(vectorizer, LinearSVC())
+        logreg = make_pipeline(clone(vectorizer), LogisticRegression())
+        other = make_pipeline(TfidfVectorizer(ngram_range=(1, 2)),
+                              LinearSVC())
+        for pipeline in (svc, logreg, other):
+            pipeline.fit(self.texts, self.labels)
+        trainers = {"svc": Trainer(svc), "logreg": Trainer(logreg),
+                    "other": Trainer(other)}
+        fingerprints = {_id: ensemble.vectorizer_fingerprint(t.pipeline)
+                        for _id, t in trainers.items()}
+        self.assertEqual(fingerprints["svc"], fingerprints["logreg"])
+        self.assertNotEqual(fingerprints["svc"], fingerprints["other"])
+
+        results, transforms = ensemble.predict_shared(
+            trainers, fingerprints, ["гараж", "стол"], with_scores=True)
+        self.assertEqual(transforms, 2)
+        self.assertEqual(trainers["logreg"].transforms, 0)
+        for _id, trainer in trainers.items():
+            np.testing.assert_array_equal(
+                results[_id][0], trainer.pipeline.predict(["гараж", "стол"]))
+
+    def test_split_predicts_assigned_texts(self):
+        vectorizer = TfidfVectorizer().fit(self.texts)
+        pipelines = {_id: make_pipeline(clone(vectorizer), LinearSVC())
+                     for _id in ("a", "b", "c")}
+        trainers = {_id: RecordingTrainer(pipeline.fit(self.texts,
+                                                       self.labels))
+                    for _id, pipeline in pipelines.items()}
+        fingerprints = {"a": "shared", "b": "shared", "c": None}
+        assigned = ensemble.split(self.texts, list(pipelines), [1, 1, 1])
+
+        results, transforms = ensemble.predict_shared(
+            trainers, fingerprints, self.texts, assigned=assigned)
+        self.assertEqual(transforms, 2)
+        # Every model predicts its assigned texts only, once
+        for _id, trainer in trainers.items():
+            self.assertEqual(trainer.rows, [assigned.count(_id)])
+        predictions = ensemble.scatter(
+            assigned, {_id: result[0] for _id, result in results.items()})
+        self.assertEqual(predictions, [
+            pipelines[_id].predict([text])[0]
+            for text, _id in zip(self.texts, assigned)])
+
+    def test_aggregates(self):
+        self.assertEqual(ensemble.vote([["a", "b"], ["b", "b"], ["b", "a"]],
+                                       [2, 1, 0.5]), ["a", "b"])
+        # Binary scores are expanded, classes aligned by label
+        predictions, classes, mean = ensemble.average(
+            [[0, 1], [1, 0, 2]],
+            [np.array([1.0, -1.0]),
+             np.array([[0.0, 1.0, 0.0], [0.0, 0.0, 3.0]])], [1, 1])
+        self.assertEqual(classes, ["0", "1", "2"])
+        self.assertEqual(predictions, ["1", "2"])
+        np.testing.assert_allclose(mean[0], [0, 0.5, 0])
+
+        texts = [str(i) for i in range(1000)]
+        assigned = ensemble.split(texts, ["a", "b"], [3, 1])
+        self.assertEqual(assigned, ensemble.split(texts, ["a", "b"], [3, 1]))
+        self.assertAlmostEqual(assigned.count("a") / len(texts), 0.75,
+                               delta=0.05)
+        self.assertNotIn("b", ensemble.split(texts, ["a", "b"], [1, 0]))
+
+
+if __name__ == '__main__':
+    main()
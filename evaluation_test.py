@@ -0,0 +1,43 @@
+from unittest import TestCase, main
+
+import numpy as np
+from sklearn.metrics import confusion_matrix, precision_recall_fscore_support
+
+from api.src.evaluation import confusion, evaluate, report
+
+
+class TestEvaluation(TestCase):
+    def test_matches_sklearn(self):
+        rng = np.random.default_rng(0)
+        y_true = rng.choice(["a", "b", "c", "d"], 500)
+        # "d" is never predicted, e.g. unseen by model
+        y_pred = np.where(rng.random(500) < 0.7, y_true,
+                          rng.choice(["a", "b", "c"], 500))
+        y_pred[y_pred == "d"] = "a"
+        result = evaluate(y_true, y_pred, ["a", "b", "c"], predict_s=0.5)
+
+        labels = ["a", "b", "c", "d"]
+        self.assertEqual(result["classes"], labels)
+        self.assertEqual(result["confusion"],
+                         confusion_matrix(y_true, y_pred,
+                                          labels=labels).tolist())
+        precision, recall, f1, support = precision_recall_fscore_support(
+            y_true, y_pred, labels=labels, zero_division=0)
+        np.testing.assert_allclose(result["precision"], precision)
+        np.testing.assert_allclose(result["recall"], recall)
+        np.testing.assert_allclose(result["f1"], f1)
+        self.assertEqual(result["support"], support.tolist())
+        self.assertAlmostEqual(result["accuracy"], np.mean(y_true == y_pred))
+        self.assertEqual(result["rows_per_s"], 1000)
+
+    def test_chunks_add_up(self):
+        labels = np.array([0, 1, 2])
+        y_true, y_pred = [0, 1, 2, 2, 1], [0, 2, 2, 2, 1]
+        matrix = confusion(y_true[:2], y_pred[:2], labels) + \
+            confusion(y_true[2:], y_pred[2:], labels)
+        self.assertEqual(report(matrix, labels),
+                         evaluate(y_true, y_pred, labels))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import numpy as np
+from omegaconf import OmegaConf
+
+from api.src.dao import MinioDAO
+from api.src.feature_store import FeatureStore
+from benchmarks.fakes import FsMinio
+from configurator import get_config
+
+TEXTS = np.array(["гараж кирпичный", "телефон новый", "гараж бокс",
+                  "телефон в чехле", "диван кожаный", "диван угловой",
+                  "гараж у метро", "телефон б/у"], dtype=object)
+TARGET = np.array([0, 1, 0, 1, 2, 2, 0, 1])
+
+
+class TestFeatureStore(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cfg = get_config()
+        self.cfg.dataset.cache_dir = os.path.join(self.root, "cache")
+        self.vectorizer_cfg = self.cfg.linearSVC.tfidf
+        self.minio = MinioDAO("fs", "", "", "", self.cfg.minio.datasets_bucket,
+                              client=FsMinio(os.path.join(self.root, "s3")))
+        self.patches = [
+            patch("api.src.feature_store.get_minio_dao",
+                  lambda cfg, bucket: self.minio),
+            patch("api.src.feature_store.ensure_dataset",
+                  lambda cfg, minio_dao: "etag-1"),
+            patch("api.src.feature_store.get_dataset",
+                  side_effect=lambda cfg: (TEXTS, TARGET, None)),
+        ]
+        self.get_dataset = [p.start() for p in self.patches][-1]
+        FeatureStore._memo.clear()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        FeatureStore._memo.clear()
+        shutil.rmtree(self.root)
+
+    def test_levels(self):
+        store = FeatureStore(self.cfg)
+        computed = store.get(self.vectorizer_cfg)
+        self.assertEqual(self.get_dataset.call_count, 1)
+        self.assertEqual(computed.X_train.shape[0] + computed.X_test.shape[0],
+                         len(TEXTS))
+        # Memory of the process, shared by all stores
+        self.assertIs(FeatureStore(self.cfg).get(self.vectorizer_cfg),
+                      computed)
+
+        # Local disk
+        FeatureStore._memo.clear()
+        with patch.object(self.minio, "download") as download:
+            from_disk = store.get(self.vectorizer_cfg)
+        download.assert_not_called()
+        self.assertEqual((from_disk.X_train != computed.X_train).nnz, 0)
+
+        # MinIO, e.g. on another machine
+        FeatureStore._memo.clear()
+        shutil.rmtree(store.cache_dir)
+        from_minio = store.get(self.vectorizer_cfg)
+        self.assertEqual(self.get_dataset.call_count, 1)
+        np.testing.assert_array_equal(from_minio.y_test, computed.y_test)
+        self.assertEqual(from_minio.vectorizer.vocabulary_,
+                         computed.vectorizer.vocabulary_)
+
+    def test_key(self):
+        store = FeatureStore(self.cfg)
+        key = store.key(self.vectorizer_cfg, "etag-1")
+        self.assertEqual(key, store.key(
+            OmegaConf.to_container(self.vectorizer_cfg), "etag-1"))
+        self.assertNotEqual(key, store.key(self.vectorizer_cfg, "etag-2"))
+        self.assertNotEqual(key, store.key(
+            {**OmegaConf.to_container(self.vectorizer_cfg),
+             "ngram_range": [1, 2]}, "etag-1"))
+        self.cfg.dataset.train_size = 0.5
+        self.assertNotEqual(key, store.key(self.vectorizer_cfg, "etag-1"))
+
+
+if __name__ == '__main__':
+    main()
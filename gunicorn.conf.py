@@ -0,0 +1,41 @@
+# Run with: gunicorn -c gunicorn.conf.py app:app
+from configurator import get_config
+
+cfg = get_config()
+
+bind = f"{cfg.flask.host}:{cfg.flask.port}"
+workers = cfg.flask.get("workers", 2)
+threads = cfg.flask.get("threads", 4)
+# Import app and warm models up in master, see app.py
+preload_app = cfg.flask.get("preload", False)
+
+
+def on_starting(server):
+    # Preloaded app is already imported by master
+    if preload_app:
+        from app import boot
+        boot()
+
+
+def post_fork(server, worker):
+    # Clients inherited from master are not fork-safe, build fresh ones
+    from api.src.dao import init_daos
+    try:
+        init_daos(cfg)
+    except Exception as e:
+        server.log.warning(f"Unable to init DAOs in worker {worker.pid}: {e!r}")
+
+
+def post_worker_init(worker):
+    from api.src.metrics import process_memory
+    if not preload_app:
+        from app import boot
+        boot()
+    memory = process_memory()
+    worker.log.info(f"Worker {worker.pid} memory: " + ", ".join(
+        f"{kind} {value / 2 ** 20:.1f}MiB" for kind, value in memory.items()))
+
+
+def worker_exit(server, worker):
+    from api.src.dao import shutdown_daos
+    shutdown_daos()
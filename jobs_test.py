@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import mongomock
+
+from api.src.dao import get_minio_dao, get_mongo_dao, shutdown_daos
+from api.src.feature_store import FeatureStore
+from api.src.jobs import DONE, FAILED, JobManager, jobs_dao, train_model, \
+    train_streaming
+from benchmarks.dataset import make_listings
+from benchmarks.fakes import FsMinio
+from configurator import get_config
+
+
+def blocking_job(cfg, started, release, logger=None, timer=None):
+    started.set()
+    release.wait(10)
+    return {}
+
+
+class TestJobManager(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cfg = get_config()
+        self.cfg.dataset.out_path = os.path.join(self.root, "data.csv")
+        self.cfg.dataset.cache_dir = os.path.join(self.root, "cache")
+        self.cfg.artifacts.cache_dir = os.path.join(self.root, "artifacts")
+        self.cfg.jobs.executor = "thread"
+        make_listings(300, seed=1).to_csv(self.cfg.dataset.out_path)
+        client = mongomock.MongoClient()
+        self.patches = [
+            patch("pymongo.MongoClient", lambda *args, **kwargs: client),
+            patch("minio.Minio", lambda *args, **kwargs: FsMinio(
+                os.path.join(self.root, "s3"))),
+        ]
+        for p in self.patches:
+            p.start()
+        shutdown_daos()
+        FeatureStore._memo.clear()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutdown_daos()
+        FeatureStore._memo.clear()
+        shutil.rmtree(self.root)
+
+    def wait(self, job_id: str, timeout: float = 120) -> dict:
+        start = time.time()
+        while time.time() - start < timeout:
+            job = jobs_dao(self.cfg).find_by_id(job_id)
+            if job["status"] not in ("queued", "running"):
+                return job
+            time.sleep(0.05)
+        self.fail(f"Job {job_id} is not finished")
+
+    def test_train_job_saves_model(self):
+        manager = JobManager(self.cfg)
+        try:
+            job_id = manager.submit("train", {"type": "logreg"},
+                                    train_model, "logreg", {})
+            job = self.wait(job_id)
+        finally:
+            manager.shutdown()
+        self.assertEqual(job["status"], DONE, job.get("error"))
+        self.assertIn("fitting", job["timings"])
+
+        doc = get_mongo_dao(self.cfg).find_by_id(job["result"]["model_id"])
+        self.assertEqual(doc["model_type"], "logreg")
+        self.assertEqual(doc["test_score"], job["result"]["test_score"])
+        bucket = self.cfg.minio.models_bucket
+        minio_dao = get_minio_dao(self.cfg, bucket)
+        for blob in doc["blobs"]:
+            self.assertIsNotNone(minio_dao.stat(bucket, blob["minio_path"]))
+
+    def test_shutdown_cancels_queued_jobs(self):
+        self.cfg.jobs.max_workers = 1
+        manager = JobManager(self.cfg)
+        started, release = threading.Event(), threading.Event()
+        try:
+            running = manager.submit("block", {}, blocking_job, started,
+                                     release)
+            queued = manager.submit("block", {}, blocking_job, started,
+                                    release)
+            self.assertTrue(started.wait(10))
+            executor = manager._get_executor()
+            shutdown = executor.shutdown
+
+            # Python 3.8 executors have no `cancel_futures`
+            def shutdown_38(wait=True):
+                shutdown(wait)
+
+            executor.shutdown = shutdown_38
+            manager.shutdown()
+            self.assertEqual(self.wait(queued)["status"], FAILED)
+            self.assertEqual(jobs_dao(self.cfg).find_by_id(queued)["error"],
+                             "Cancelled")
+        finally:
+            release.set()
+        self.assertEqual(self.wait(running)["status"], DONE)
+
+    def test_streaming_split_is_stable(self):
+        self.cfg.sgd.tfidf.n_features = 1024
+        results = []
+        for chunk_size in (64, 1000):
+            self.cfg.dataset.chunk_size = chunk_size
+            results.append(train_streaming(self.cfg, "sgd", {}))
+        # Rows are split by ID, whatever the chunks are
+        splits = [(result["train_rows"], result["test_score"]["rows"])
+                  for result in results]
+        self.assertEqual(splits[0], splits[1])
+        train_rows, test_rows = splits[0]
+        self.assertEqual(results[0]["train_score"]["rows"], train_rows)
+        self.assertAlmostEqual(test_rows / (train_rows + test_rows),
+                               1 - self.cfg.dataset.train_size, delta=0.1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+import os
+import tempfile
+from unittest import TestCase, main
+
+import joblib
+import numpy as np
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+from sklearn.svm import LinearSVC
+
+from api.src.lite import LitePipeline, export_lite
+
+
+class TestLitePipeline(TestCase):
+    texts = ["Продам гараж кирпичный, охрана", "гараж бокс с ямой",
+             "телефон новый в чехле", "Смартфон: экран и батарея",
+             "диван и кресло", "шкаф, стол, стул!", "ГАРАЖ у метро"]
+    labels = [0, 0, 1, 1, 2, 2, 0]
+    queries = ["гараж и телефон", "Стол", "", "café ÉTÉ", "кресло кресло"]
+
+    def assert_same(self, pipeline):
+        lite = LitePipeline(export_lite(pipeline))
+        np.testing.assert_array_equal(lite.predict(self.queries),
+                                      pipeline.predict(self.queries))
+        np.testing.assert_allclose(lite.decision_function(self.queries),
+                                   pipeline.decision_function(self.queries))
+        diff = lite.transform(self.queries) - \
+            pipeline[:-1].transform(self.queries)
+        self.assertAlmostEqual(abs(diff).max(), 0)
+
+    def test_matches_sklearn(self):
+        self.assert_same(make_pipeline(TfidfVectorizer(), LinearSVC())
+                         .fit(self.texts, self.labels))
+        self.assert_same(make_pipeline(
+            TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True,
+                            strip_accents="unicode", stop_words=["и"]),
+            LogisticRegression()).fit(self.texts, self.labels))
+        # Binary problems have a single row of coefficients
+        self.assert_same(make_pipeline(TfidfVectorizer(), LinearSVC())
+                         .fit(self.texts, np.array(self.labels) == 0))
+
+    def test_memory_mapped(self):
+        pipeline = make_pipeline(TfidfVectorizer(), LinearSVC()) \
+            .fit(self.texts, self.labels)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "model.lite.pk")
+            joblib.dump(export_lite(pipeline), path)
+            lite = LitePipeline(joblib.load(path, mmap_mode="r"))
+            np.testing.assert_array_equal(lite.predict(self.queries),
+                                          pipeline.predict(self.queries))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+from unittest import TestCase, main
+from api.src.metrics import Counter, Histogram, Registry
+
+
+class TestMetrics(TestCase):
+    def test_render_exposition_format(self):
+        registry = Registry()
+        histogram = registry.register(Histogram(
+            "stage_seconds", "Stage duration", ("stage",), buckets=(0.1, 1)))
+        counter = registry.register(Counter("calls_total", "Calls", ("op",)))
+        histogram.observe(0.05, stage="fit")
+        histogram.observe(5, stage="fit")
+        counter.inc(op="find")
+        text = registry.render()
+        self.assertIn('stage_seconds_bucket{stage="fit",le="0.1"} 1', text)
+        self.assertIn('stage_seconds_bucket{stage="fit",le="1"} 1', text)
+        self.assertIn('stage_seconds_bucket{stage="fit",le="+Inf"} 2', text)
+        self.assertIn('stage_seconds_count{stage="fit"} 2', text)
+        self.assertIn('calls_total{op="find"} 1', text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import bson
+import mongomock
+from flask import Flask
+
+import api.endpoints as endpoints
+from api.src.dao import MongoDAO
+
+
+class TestModelList(TestCase):
+    def setUp(self):
+        self.dao = MongoDAO("mock", "27017", "mlopsdb", "models",
+                            client=mongomock.MongoClient())
+        # Ties on createdTimeS are ordered by _id
+        self.ids = [str(bson.ObjectId()) for _ in range(7)]
+        for i, _id in enumerate(self.ids):
+            self.dao.upsert(_id, {"model_type": "logreg",
+                                  "params": {"C": i},
+                                  "test_score": {"accuracy": i / 10}},
+                            on_insert={"createdTimeS": float(i // 3)})
+        app = Flask(__name__)
+        endpoints.api.init_app(app)
+        self.client = app.test_client()
+        self.patch = patch.object(endpoints, "get_mongo_dao",
+                                  lambda cfg, collection=None: self.dao)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_pages(self):
+        seen, cursor = [], None
+        for _ in range(len(self.ids)):
+            response = self.client.get(
+                "/models/list", query_string={"limit": 3,
+                                              **({"after": cursor}
+                                                 if cursor else {})})
+            self.assertEqual(response.status_code, 201)
+            seen += [doc["_id"]["$oid"] for doc in response.json]
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+        # Last page is short, so it has no cursor
+        self.assertEqual(len(response.json), 1)
+        expected = sorted(self.ids, key=lambda _id: (
+            self.ids.index(_id) // 3, _id), reverse=True)
+        self.assertEqual(seen, expected)
+
+    def test_projection(self):
+        response = self.client.get("/models/list")
+        self.assertEqual(len(response.json), len(self.ids))
+        self.assertNotIn("X-Next-Cursor", response.headers)
+        self.assertTrue(all("params" not in doc and "model_type" in doc
+                            for doc in response.json))
+
+        response = self.client.get(
+            "/models/list", query_string={"fields": "test_score",
+                                          "min_test_accuracy": 0.5})
+        self.assertEqual(len(response.json), 2)
+        self.assertEqual({key for doc in response.json for key in doc},
+                         {"_id", "createdTimeS", "test_score"})
+
+    def test_bad_query(self):
+        for args in ({"after": "garbage"}, {"after": "1.0_not-an-id"},
+                     {"limit": 0}, {"min_test_accuracy": "high"}):
+            response = self.client.get("/models/list", query_string=args)
+            self.assertEqual(response.status_code, 400, args)
+            self.assertEqual(response.json["status"], "Failed")
+
+
+if __name__ == '__main__':
+    main()
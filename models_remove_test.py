@@ -0,0 +1,93 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import mongomock
+import numpy as np
+from flask import Flask
+
+import api.endpoints as endpoints
+from api.src.dao import get_minio_dao, get_mongo_dao, shutdown_daos
+from api.src.serving import load_trainer
+from api.src.trainer import ModelTrainer
+from benchmarks.fakes import FsMinio
+
+TEXTS = ["гараж кирпичный", "телефон новый", "гараж бокс", "телефон в чехле",
+         "гараж у метро", "телефон б/у"]
+LABELS = ["garage", "phone"] * 3
+
+
+class TestModelRemove(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cfg = endpoints.cfg
+        self.saved_cfg = (self.cfg.artifacts.cache_dir,
+                          self.cfg.sgd.tfidf.n_features)
+        self.cfg.artifacts.cache_dir = os.path.join(self.root, "artifacts")
+        self.cfg.sgd.tfidf.n_features = 1024
+        client = mongomock.MongoClient()
+        self.patches = [
+            patch("pymongo.MongoClient", lambda *args, **kwargs: client),
+            patch("minio.Minio", lambda *args, **kwargs: FsMinio(
+                os.path.join(self.root, "s3"))),
+        ]
+        for p in self.patches:
+            p.start()
+        shutdown_daos()
+
+        # Models share stateless vectorizer blob, classifiers differ
+        self.ids = []
+        for alpha in (0.001, 0.01):
+            trainer = ModelTrainer(self.cfg.sgd.model, self.cfg.sgd.tfidf,
+                                   model_params={"alpha": alpha},
+                                   common_cfg=self.cfg, model_type="sgd",
+                                   logger=endpoints.logger)
+            trainer.fit(np.array(TEXTS, dtype=object), np.array(LABELS))
+            self.ids.append(trainer.save_model())
+        app = Flask(__name__)
+        endpoints.api.init_app(app)
+        self.app = app
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutdown_daos()
+        (self.cfg.artifacts.cache_dir,
+         self.cfg.sgd.tfidf.n_features) = self.saved_cfg
+        shutil.rmtree(self.root)
+
+    def refs(self) -> dict:
+        return {doc["_id"]: doc["refs"] for doc in get_mongo_dao(
+            self.cfg, self.cfg.mongo.blobs_collection).list_documents()}
+
+    def test_duplicate_removes(self):
+        kept = get_mongo_dao(self.cfg).find_by_id(self.ids[1])
+        shared = kept["blobs"][0]["minio_path"]
+        self.assertEqual(self.refs()[shared], 2)
+
+        def remove(_):
+            return self.app.test_client().post(
+                f"/models/{self.ids[0]}/remove").status_code
+
+        with ThreadPoolExecutor(4) as pool:
+            codes = sorted(pool.map(remove, range(4)))
+        codes.append(remove(None))
+        self.assertEqual(codes, [201, 404, 404, 404, 404])
+
+        # The other model keeps its blobs and still loads
+        self.assertEqual(self.refs(), {blob["minio_path"]: 1
+                                       for blob in kept["blobs"]})
+        bucket = self.cfg.minio.models_bucket
+        self.assertIsNotNone(get_minio_dao(self.cfg, bucket).stat(
+            bucket, shared))
+        trainer = load_trainer(self.cfg, kept, self.cfg.sgd.model,
+                               self.cfg.sgd.tfidf, logger=endpoints.logger)
+        self.assertEqual(len(trainer.predict_chunked(
+            np.array(TEXTS, dtype=object), 4, False)[0]), len(TEXTS))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import mongomock
+import numpy as np
+from flask import Flask
+
+import api.endpoints as endpoints
+from api.src.dao import get_mongo_dao, shutdown_daos
+from api.src.trainer import ModelTrainer
+from benchmarks.fakes import FsMinio
+
+TEXTS = ["гараж кирпичный", "телефон новый", "гараж бокс", "телефон в чехле",
+         "гараж у метро", "телефон б/у"]
+LABELS = ["garage", "phone"] * 3
+
+
+class TestModelPartialFit(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cfg = endpoints.cfg
+        self.saved_cfg = (self.cfg.artifacts.cache_dir,
+                          self.cfg.sgd.tfidf.n_features)
+        self.cfg.artifacts.cache_dir = os.path.join(self.root, "artifacts")
+        self.cfg.sgd.tfidf.n_features = 1024
+        client = mongomock.MongoClient()
+        self.patches = [
+            patch("pymongo.MongoClient", lambda *args, **kwargs: client),
+            patch("minio.Minio", lambda *args, **kwargs: FsMinio(
+                os.path.join(self.root, "s3"))),
+        ]
+        for p in self.patches:
+            p.start()
+        shutdown_daos()
+
+        trainer = ModelTrainer(self.cfg.sgd.model, self.cfg.sgd.tfidf,
+                               model_params={}, common_cfg=self.cfg,
+                               model_type="sgd", logger=endpoints.logger)
+        trainer.fit(np.array(TEXTS, dtype=object), np.array(LABELS))
+        self._id = trainer.save_model()
+        app = Flask(__name__)
+        endpoints.api.init_app(app)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        shutdown_daos()
+        (self.cfg.artifacts.cache_dir,
+         self.cfg.sgd.tfidf.n_features) = self.saved_cfg
+        shutil.rmtree(self.root)
+
+    def partial_fit(self):
+        return self.client.post(f"/models/{self._id}/partial_fit",
+                                json={"texts": ["гараж", "телефон"],
+                                      "labels": ["garage", "phone"]})
+
+    def blobs(self) -> list:
+        return sorted((doc["_id"], doc["refs"]) for doc in get_mongo_dao(
+            self.cfg, self.cfg.mongo.blobs_collection).list_documents())
+
+    def test_update(self):
+        response = self.partial_fit()
+        self.assertEqual(response.status_code, 201, response.json)
+        self.assertEqual(response.json["version"], 2)
+        doc = get_mongo_dao(self.cfg).find_by_id(self._id)
+        self.assertEqual((doc["version"], doc["incrementalSamples"]), (2, 2))
+
+    def test_update_does_not_trace_memory(self):
+        with patch("tracemalloc.start") as start:
+            response = self.partial_fit()
+        self.assertEqual(response.status_code, 201, response.json)
+        start.assert_not_called()
+
+    def test_concurrent_update(self):
+        load_trainer = endpoints.load_trainer
+        blobs = self.blobs()
+
+        def load_and_update(*args, **kwargs):
+            trainer = load_trainer(*args, **kwargs)
+            # Saved by another process meanwhile
+            get_mongo_dao(self.cfg).update_by_id(self._id, {"version": 5})
+            return trainer
+
+        with patch.object(endpoints, "load_trainer", load_and_update):
+            response = self.partial_fit()
+        self.assertEqual(response.status_code, 409, response.json)
+        self.assertEqual(
+            get_mongo_dao(self.cfg).find_by_id(self._id)["version"], 5)
+        # Blobs of the rejected update are released
+        self.assertEqual(self.blobs(), blobs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import json
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import numpy as np
+from flask import Flask
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import make_pipeline
+
+import api.endpoints as endpoints
+from api.src.serving import parse_batch_texts
+from api.src.trainer import ModelTrainer
+
+
+def fitted_trainer() -> ModelTrainer:
+    trainer = ModelTrainer(endpoints.cfg.logreg.model,
+                           endpoints.cfg.logreg.tfidf, model_params={},
+                           common_cfg=endpoints.cfg, model_type="logreg")
+    trainer.pipeline = make_pipeline(TfidfVectorizer(), LogisticRegression())
+    trainer.pipeline.fit(["гараж кирпичный", "телефон новый",
+                          "гараж бокс", "телефон в чехле", "диван"],
+                         ["garage", "phone", "garage", "phone", "sofa"])
+    return trainer
+
+
+class TestParseBatchTexts(TestCase):
+    def test_json_and_ndjson(self):
+        texts = ["гараж", 'кавычки "и"\nперенос', "телефон"]
+        self.assertEqual(parse_batch_texts(
+            "application/json", json.dumps({"texts": texts})), texts)
+        ndjson = "\n".join([json.dumps(texts[0]),
+                            json.dumps({"text": texts[1]}), "",
+                            json.dumps(texts[2])])
+        self.assertEqual(parse_batch_texts("application/x-ndjson", ndjson),
+                         texts)
+
+    def test_malformed(self):
+        with self.assertRaises(ValueError):
+            parse_batch_texts("application/x-ndjson", '"ok"\n{"text": ')
+        with self.assertRaises(KeyError):
+            parse_batch_texts("application/x-ndjson", '{"texts": "a"}')
+        with self.assertRaises(ValueError):
+            parse_batch_texts("application/json", '{"texts": "a"}')
+
+
+class TestPredictBatch(TestCase):
+    def test_chunked_matches_whole(self):
+        trainer = fitted_trainer()
+        texts = np.array(["гараж", "телефон", "диван", "новый гараж",
+                          "чехол"], dtype=object)
+        predictions, scores = trainer.predict_chunked(texts, 2, True)
+        np.testing.assert_array_equal(predictions,
+                                      trainer.pipeline.predict(texts))
+        np.testing.assert_allclose(
+            scores, trainer.pipeline.decision_function(texts))
+        predictions, scores = trainer.predict_chunked(texts[:0], 2, True)
+        self.assertEqual((len(predictions), scores.shape), (0, (0, 3)))
+
+    def test_endpoint(self):
+        app = Flask(__name__)
+        endpoints.api.init_app(app)
+        trainer = fitted_trainer()
+        doc = {"_id": "a", "model_type": "logreg", "updatedTimeS": 1.0}
+        with patch.object(endpoints, "get_model_doc",
+                          lambda cfg, _id: doc), \
+                patch.object(endpoints, "get_trainer",
+                             lambda cfg, _id, doc, logger: (doc, trainer)), \
+                patch.object(endpoints.traffic, "hit"), \
+                patch.object(endpoints, "prediction_cache") as cache:
+            cache.get_many.return_value = {}
+            client = app.test_client()
+            response = client.post(
+                "/models/a/predict_batch?scores=true",
+                data='"гараж"\n{"text": "телефон"}\n',
+                content_type="application/x-ndjson")
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual(response.json["predictions"],
+                             ["garage", "phone"])
+            self.assertEqual(len(response.json["scores"]), 2)
+
+            response = client.post("/models/a/predict_batch",
+                                   data="not json",
+                                   content_type="application/x-ndjson")
+            self.assertEqual(response.status_code, 400)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import configurator
+
+
+class TestStartup(TestCase):
+    def test_config_is_cached_resolved(self):
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch.dict(os.environ, {"CONFIG_CACHE_DIR": cache_dir,
+                                        "CONFIG_OVERRIDES": "flask.port=5005"}):
+            composed = configurator.get_config()
+            self.assertEqual(len(os.listdir(cache_dir)), 1)
+            with patch.object(configurator, "_compose") as compose:
+                cached = configurator.get_config()
+            compose.assert_not_called()
+        self.assertEqual(cached, composed)
+        self.assertEqual(cached.flask.port, 5005)
+
+    def test_serving_imports_no_training_modules(self):
+        code = ("import sys, api.endpoints\n"
+                "from api.src.startup import TRAINING_MODULES\n"
+                "print([m for m in TRAINING_MODULES if m in sys.modules])")
+        env = {**os.environ, "CONFIG_OVERRIDES": "warmup.enabled=false"}
+        out = subprocess.run([sys.executable, "-c", code], env=env,
+                             capture_output=True, text=True, check=True)
+        self.assertEqual(out.stdout.strip().splitlines()[-1], "[]")
+
+
+if __name__ == '__main__':
+    main()
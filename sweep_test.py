@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import mongomock
+from flask import Flask
+
+import api.endpoints as endpoints
+from api.src.dao import get_mongo_dao, shutdown_daos
+from api.src.feature_store import FeatureStore
+from api.src.jobs import DONE, JobManager, jobs_dao
+from benchmarks.dataset import make_listings
+from benchmarks.fakes import FsMinio
+from configurator import get_config
+
+
+class TestModelSweep(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.cfg = get_config()
+        self.cfg.dataset.out_path = os.path.join(self.root, "data.csv")
+        self.cfg.dataset.cache_dir = os.path.join(self.root, "cache")
+        self.cfg.artifacts.cache_dir = os.path.join(self.root, "artifacts")
+        self.cfg.jobs.executor = "thread"
+        self.cfg.jobs.sweep_n_jobs = 1
+        make_listings(300, seed=1).to_csv(self.cfg.dataset.out_path)
+        client = mongomock.MongoClient()
+        self.manager = JobManager(self.cfg)
+        self.patches = [
+            patch("pymongo.MongoClient", lambda *args, **kwargs: client),
+            patch("minio.Minio", lambda *args, **kwargs: FsMinio(
+                os.path.join(self.root, "s3"))),
+            patch.object(endpoints, "job_manager", self.manager),
+        ]
+        for p in self.patches:
+            p.start()
+        shutdown_daos()
+        FeatureStore._memo.clear()
+        app = Flask(__name__)
+        endpoints.api.init_app(app)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        self.manager.shutdown()
+        for p in self.patches:
+            p.stop()
+        shutdown_daos()
+        FeatureStore._memo.clear()
+        shutil.rmtree(self.root)
+
+    def wait(self, job_id: str, timeout: float = 120) -> dict:
+        start = time.time()
+        while time.time() - start < timeout:
+            job = jobs_dao(self.cfg).find_by_id(job_id)
+            if job["status"] not in ("queued", "running"):
+                return job
+            time.sleep(0.05)
+        self.fail(f"Job {job_id} is not finished")
+
+    def test_sweep(self):
+        response = self.client.post("/models/sweep", json={
+            "type": "logreg", "grid": "{'C': [0.001, 1.0, 100.0]}",
+            "top_k": 2})
+        self.assertEqual(response.status_code, 202, response.json)
+        job = self.wait(response.json["job_id"])
+        self.assertEqual(job["status"], DONE, job.get("error"))
+        result = job["result"]
+        self.assertEqual(result["candidates"], 3)
+
+        # Every candidate is recorded, two best by test accuracy are saved
+        candidates = sorted(
+            get_mongo_dao(self.cfg, self.cfg.mongo.sweeps_collection)
+            .list_documents(), key=lambda doc: doc["rank"])
+        self.assertEqual(len(candidates), 3)
+        self.assertTrue(all(doc["sweep_id"] == result["sweep_id"]
+                            for doc in candidates))
+        accuracies = [doc["test_score"]["accuracy"] for doc in candidates]
+        self.assertEqual(accuracies, sorted(accuracies, reverse=True))
+        self.assertEqual([(entry["model_id"], entry["params"])
+                          for entry in result["best"]],
+                         [(doc["model_id"], doc["params"])
+                          for doc in candidates[:2]])
+        # Underfitted candidate loses, ties keep grid order
+        self.assertEqual([entry["params"] for entry in result["best"]],
+                         [{"C": 1.0}, {"C": 100.0}])
+        self.assertIsNone(candidates[2]["model_id"])
+        for doc in candidates[:2]:
+            model = get_mongo_dao(self.cfg).find_by_id(doc["model_id"])
+            classifier = model["params"]["steps"][-1]["params"]
+            self.assertEqual(classifier["C"], str(doc["params"]["C"]))
+            self.assertEqual(model["test_score"], doc["test_score"])
+
+    def test_bad_grid(self):
+        for grid in ("__import__('os').getcwd()", "{'C': 1.0}", "{'C': [",
+                     "not a grid"):
+            response = self.client.post("/models/sweep", json={
+                "type": "logreg", "grid": grid})
+            self.assertEqual(response.status_code, 400, grid)
+            self.assertEqual(response.json["status"], "Failed")
+        self.assertEqual(jobs_dao(self.cfg).collection.count_documents({}), 0)
+
+
+if __name__ == '__main__':
+    main()
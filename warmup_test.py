@@ -0,0 +1,86 @@
+from unittest import TestCase, main
+from unittest.mock import patch
+
+import bson
+import mongomock
+
+from api.src import warmup
+from api.src.dao import MongoDAO
+from api.src.warmup import WarmUp
+from configurator import get_config
+
+
+class Trainer():
+    def predict(self, texts):
+        return ["garage"] * len(texts)
+
+
+class TestWarmUp(TestCase):
+    def setUp(self):
+        self.cfg = get_config()
+        self.cfg.warmup.most_recent = 2
+        self.cfg.warmup.top_by_traffic = 2
+        self.dao = MongoDAO("mock", "27017", "mlopsdb", "models",
+                            client=mongomock.MongoClient())
+        # Newest models are the least popular ones
+        self.ids = [str(bson.ObjectId()) for _ in range(4)]
+        for i, _id in enumerate(self.ids):
+            self.dao.upsert(_id, {"updatedTimeS": float(i),
+                                  "predictCount": 10 - i})
+        self.patch = patch.object(warmup, "get_mongo_dao",
+                                  lambda cfg, collection=None: self.dao)
+        self.patch.start()
+        self.loaded = []
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def load(self, _id: str) -> Trainer:
+        self.loaded.append(_id)
+        if _id == self.ids[0]:
+            raise ValueError("broken artifact")
+        return Trainer()
+
+    def test_select_models(self):
+        pinned = str(bson.ObjectId())
+        self.cfg.warmup.pinned = [pinned, self.ids[3]]
+        self.assertEqual(WarmUp(self.cfg, self.load).select_models(),
+                         [pinned, self.ids[3], self.ids[2],
+                          self.ids[0], self.ids[1]])
+
+        self.cfg.warmup.most_recent = 0
+        self.cfg.warmup.pinned = []
+        self.assertEqual(WarmUp(self.cfg, self.load).select_models(),
+                         self.ids[:2])
+
+    def test_failed_models_are_reported(self):
+        self.cfg.warmup.top_by_traffic = 1
+        warm = WarmUp(self.cfg, self.load)
+        summary = warm.run()
+        self.assertTrue(warm.ready.is_set())
+        self.assertEqual(summary["status"], "done")
+        self.assertEqual(sorted(summary["loaded"]),
+                         sorted(self.ids[2:]))
+        self.assertEqual(list(summary["failed"]), [self.ids[0]])
+        self.assertIn("broken artifact", summary["failed"][self.ids[0]])
+
+    def test_ready(self):
+        warm = WarmUp(self.cfg, self.load)
+        self.assertFalse(warm.ready.is_set())
+        warm.start()
+        self.assertTrue(warm.ready.wait(10))
+        self.assertEqual(warm.summary["status"], "done")
+
+        # Disabled warm-up loads nothing, whether it is run or started
+        self.cfg.warmup.enabled = False
+        self.loaded.clear()
+        for method in ("run", "start"):
+            warm = WarmUp(self.cfg, self.load)
+            getattr(warm, method)()
+            self.assertTrue(warm.ready.is_set(), method)
+            self.assertEqual(warm.summary, {"status": "disabled"})
+        self.assertEqual(self.loaded, [])
+
+
+if __name__ == '__main__':
+    main()